@@ -0,0 +1,223 @@
+"""
+Compares query latency on a single categories table and on one hash
+partitioned by project.
+
+Run from the repository root with python -m benchmarks.categories_partitions,
+see --help for the options. It uses the configured database and works in a
+bench schema that it drops first, 100M rows take about 25 GB per table.
+
+Both tables have the columns and indexes of heron.db.db.create_categories_table
+but no foreign keys, so they can be filled with generate_series. Every
+query is the one the application runs, filtered on project_id.
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import asyncpg
+
+from heron.db import create_connection_pool
+
+TABLES = ["categories_single", "categories_hashed"]
+
+# Each query with the columns of the sampled category it takes as arguments
+QUERIES = {
+    "dataset": (
+        "SELECT id, label_id, project_id, dataset_id, start_offset, end_offset, "
+        "created_by FROM {table} WHERE project_id = $1 AND dataset_id = $2 "
+        "ORDER BY start_offset, id",
+        ["project_id", "dataset_id"],
+    ),
+    "window": (
+        "SELECT id, label_id, start_offset, end_offset FROM {table} "
+        "WHERE project_id = $1 AND dataset_id = $2 "
+        "AND start_offset >= $3::integer - 30 AND start_offset < $3::integer + 500 "
+        "AND end_offset > $3 ORDER BY start_offset, id",
+        ["project_id", "dataset_id", "start_offset"],
+    ),
+    "changes": (
+        "SELECT id, label_id, start_offset, end_offset, seq FROM {table} "
+        "WHERE project_id = $1 AND dataset_id = $2 AND seq > $3 ORDER BY seq",
+        ["project_id", "dataset_id", "seq"],
+    ),
+    "update": (
+        "UPDATE {table} SET seq = seq + 1 "
+        "WHERE project_id = $1 AND id = $2 AND dataset_id = $3",
+        ["project_id", "id", "dataset_id"],
+    ),
+    "project_count": (
+        "SELECT COUNT(*) FROM {table} WHERE project_id = $1",
+        ["project_id"],
+    ),
+}
+
+
+def _uuid(kind: str, number: str) -> str:
+    return f"md5('{kind}' || {number})::uuid"
+
+
+_DATASET_NUMBER = "p::text || '/' || (n % $3)::text"
+
+
+async def create_tables(conn: asyncpg.Connection, partitions: int):
+    columns = (
+        "id UUID NOT NULL, label_id UUID, project_id UUID NOT NULL, "
+        "dataset_id UUID, start_offset INTEGER NOT NULL, "
+        "end_offset INTEGER NOT NULL, seq BIGINT NOT NULL DEFAULT 0, "
+        "created_by UUID"
+    )
+    await conn.execute("DROP SCHEMA IF EXISTS bench CASCADE")
+    await conn.execute("CREATE SCHEMA bench")
+    await conn.execute(f"CREATE TABLE bench.categories_single ({columns})")
+    await conn.execute(
+        f"CREATE TABLE bench.categories_hashed ({columns}) "
+        "PARTITION BY HASH (project_id)"
+    )
+    for remainder in range(partitions):
+        await conn.execute(
+            f"CREATE TABLE bench.categories_hashed_p{remainder} "
+            "PARTITION OF bench.categories_hashed "
+            f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})"
+        )
+
+
+async def fill(
+    conn: asyncpg.Connection,
+    rows: int,
+    projects: int,
+    datasets: int,
+    chunk_size: int,
+):
+    """
+    Spreads rows over datasets datasets of each of projects projects, a few
+    projects being much bigger than the rest like in real deployments.
+    The single table is filled first and copied into the partitioned one.
+    """
+    for start in range(0, rows, chunk_size):
+        end = min(start + chunk_size, rows)
+        # Squaring a uniform number skews rows towards the first projects
+        await conn.execute(
+            "INSERT INTO bench.categories_single "
+            "SELECT "
+            f"{_uuid('category', 'n::text')}, "
+            f"{_uuid('label', '(n % 20)::text')}, "
+            f"{_uuid('project', 'p::text')}, "
+            f"{_uuid('dataset', _DATASET_NUMBER)}, "
+            "o, o + 1 + (n % 30), n / $3, NULL "
+            "FROM generate_series($1::bigint, $2::bigint - 1) AS n, "
+            "LATERAL (SELECT floor(power(random(), 2) * $4)::bigint AS p, "
+            "(random() * 100000)::integer AS o) AS r",
+            start,
+            end,
+            datasets,
+            projects,
+        )
+        print(f"categories_single: {end}/{rows} rows", flush=True)
+    # Both tables hold the same rows
+    await conn.execute(
+        "INSERT INTO bench.categories_hashed SELECT * FROM bench.categories_single"
+    )
+    print("categories_hashed: copied", flush=True)
+    # Primary keys of create_categories_table with and without partitions
+    await conn.execute("ALTER TABLE bench.categories_single ADD PRIMARY KEY (id)")
+    await conn.execute(
+        "ALTER TABLE bench.categories_hashed ADD PRIMARY KEY (project_id, id)"
+    )
+    for table in TABLES:
+        await conn.execute(
+            f"CREATE INDEX ON bench.{table} (dataset_id, start_offset, id)"
+        )
+        await conn.execute(f"CREATE INDEX ON bench.{table} (label_id)")
+        await conn.execute(f"CREATE INDEX ON bench.{table} (dataset_id, seq)")
+        await conn.execute(f"VACUUM ANALYZE bench.{table}")
+
+
+async def sample(conn: asyncpg.Connection, samples: int) -> list[asyncpg.Record]:
+    """
+    Picks existing categories to point the queries at.
+    """
+    return await conn.fetch(
+        "SELECT project_id, dataset_id, id, start_offset, seq "
+        "FROM bench.categories_single TABLESAMPLE SYSTEM (1) "
+        "ORDER BY random() LIMIT $1",
+        samples,
+    )
+
+
+async def measure(
+    conn: asyncpg.Connection, table: str, query: str, targets: list[asyncpg.Record]
+) -> list[float]:
+    """
+    Runs query once per target through a prepared statement, like asyncpg
+    does for the application, and returns the latencies in milliseconds.
+    """
+    sql, columns = QUERIES[query]
+    statement = await conn.prepare(sql.format(table=f"bench.{table}"))
+    latencies = []
+    for target in targets:
+        args = [target[column] for column in columns]
+        start = time.perf_counter()
+        await statement.fetch(*args)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+async def sizes(conn: asyncpg.Connection) -> dict[str, int]:
+    return {
+        table: await conn.fetchval(
+            "SELECT SUM(pg_total_relation_size(oid)) FROM pg_class "
+            "WHERE oid = $1::regclass "
+            "OR oid IN (SELECT relid FROM pg_partition_tree($1::regclass))",
+            f"bench.{table}",
+        )
+        for table in TABLES
+    }
+
+
+async def run(args: argparse.Namespace):
+    pool = await create_connection_pool()
+    try:
+        async with pool.acquire() as conn:
+            if not args.skip_fill:
+                await create_tables(conn, args.partitions)
+                await fill(
+                    conn, args.rows, args.projects, args.datasets, args.chunk_size
+                )
+            targets = await sample(conn, args.samples)
+            random.shuffle(targets)
+            for table, size in (await sizes(conn)).items():
+                print(f"{table}: {size / 2**30:.2f} GiB with indexes")
+            print(f"{'query':<14}{'table':<20}{'p50 ms':>10}{'p95 ms':>10}")
+            for query in QUERIES:
+                for table in TABLES:
+                    # One warm up pass so both tables start from a warm cache
+                    await measure(conn, table, query, targets)
+                    latencies = sorted(await measure(conn, table, query, targets))
+                    p50 = statistics.median(latencies)
+                    p95 = latencies[int(len(latencies) * 0.95)]
+                    print(f"{query:<14}{table:<20}{p50:>10.3f}{p95:>10.3f}")
+    finally:
+        await pool.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.categories_partitions")
+    parser.add_argument("--rows", type=int, default=100_000_000)
+    parser.add_argument("--projects", type=int, default=2000)
+    parser.add_argument("--datasets", type=int, default=200)
+    parser.add_argument("--partitions", type=int, default=16)
+    parser.add_argument("--samples", type=int, default=500)
+    parser.add_argument("--chunk-size", type=int, default=1_000_000)
+    parser.add_argument(
+        "--skip-fill",
+        action="store_true",
+        help="Reuse the tables filled by a previous run",
+    )
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""
+Inter-annotator agreement.
+
+Spans agree when two annotators created the same offsets with the same label,
+span F1 is averaged over annotator pairs. Token-level kappas compare the label
+each annotator gave every token, 0 standing for tokens outside any span.
+
+Everything is derived from per annotator pair token confusion matrices and
+span match counts, which add up across datasets. Each dataset is scored with
+NumPy array operations, the only Python loops are over annotators.
+"""
+
+import itertools
+from collections.abc import Hashable, Sequence
+
+import numpy as np
+from pydantic import BaseModel
+
+from heron.export import TOKEN_RE
+
+
+class AgreementScores(BaseModel):
+    """
+    Represents agreement scores, None when they're undefined, like with fewer
+    than two annotators or a single category used by everyone.
+    """
+
+    span_f1: float | None
+    cohen_kappa: float | None
+    fleiss_kappa: float | None
+
+
+def token_labels(
+    token_starts: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    labels: np.ndarray,
+) -> np.ndarray:
+    """
+    Returns the label of the span covering each token, 0 if there's none.
+    Spans must be sorted by start, a token covered by overlapping spans gets
+    the label of the one reaching furthest.
+    """
+    if len(starts) == 0:
+        return np.zeros(len(token_starts), dtype=np.int64)
+    # Furthest end among the spans starting up to each span, and which span
+    running_ends = np.maximum.accumulate(ends)
+    furthest = np.maximum.accumulate(
+        np.where(ends == running_ends, np.arange(len(ends)), 0)
+    )
+    last = np.searchsorted(starts, token_starts, side="right") - 1
+    clipped = np.maximum(last, 0)
+    covered = (last >= 0) & (running_ends[clipped] > token_starts)
+    return np.where(covered, labels[furthest[clipped]], 0)
+
+
+class AgreementStats:
+    """
+    Sufficient statistics of the agreement scores, labels are numbered from 1
+    to n_labels.
+    """
+
+    def __init__(self, n_labels: int):
+        size = n_labels + 1
+        self.size = size
+        # Annotator pairs sharing each span, and spans each pair could share
+        self.span_matches = np.zeros(size)
+        self.span_totals = np.zeros(size)
+        self.confusions: dict[tuple[Hashable, Hashable], np.ndarray] = {}
+        # Fleiss' kappa terms: tokens, sum of their agreement, overall and
+        # for each label alone, and how many times each label was given
+        self.items = 0
+        self.agreement = 0.0
+        self.label_agreement = np.zeros(size)
+        self.label_totals = np.zeros(size)
+        self.annotations = 0
+
+    def add_dataset(
+        self,
+        text: str,
+        annotators: Sequence[Hashable],
+        authors: np.ndarray,
+        starts: np.ndarray,
+        ends: np.ndarray,
+        labels: np.ndarray,
+    ):
+        """
+        Adds the spans of a dataset, authors are indexes in annotators.
+        Annotators with no spans count as having left every token outside.
+        """
+        m = len(annotators)
+        if m < 2:
+            return
+        size = self.size
+
+        # The same span twice from the same annotator counts once
+        spans = np.unique(np.stack([authors, starts, ends, labels], axis=1), axis=0)
+        shared, sharing = np.unique(spans[:, 1:], axis=0, return_counts=True)
+        self.span_matches += np.bincount(
+            shared[:, 2], weights=sharing * (sharing - 1) / 2, minlength=size
+        )
+        self.span_totals += (m - 1) * np.bincount(spans[:, 3], minlength=size)
+
+        token_starts = np.fromiter(
+            (match.start() for match in TOKEN_RE.finditer(text)), dtype=np.int64
+        )
+        n = len(token_starts)
+        if n == 0:
+            return
+        # spans are sorted by author then start
+        bounds = np.searchsorted(spans[:, 0], np.arange(m + 1))
+        tokens = np.stack(
+            [
+                token_labels(
+                    token_starts,
+                    spans[bounds[a] : bounds[a + 1], 1],
+                    spans[bounds[a] : bounds[a + 1], 2],
+                    spans[bounds[a] : bounds[a + 1], 3],
+                )
+                for a in range(m)
+            ]
+        )
+
+        agreement = 0.0
+        label_agreement = np.zeros(size)
+        for a, b in itertools.combinations(range(m), 2):
+            confusion = np.bincount(
+                tokens[a] * size + tokens[b], minlength=size * size
+            ).reshape(size, size)
+            key = (annotators[a], annotators[b])
+            if key in self.confusions:
+                self.confusions[key] += confusion
+            else:
+                self.confusions[key] = confusion
+            agreement += np.trace(confusion)
+            label_agreement += _binary_agreement(confusion)
+
+        pairs = m * (m - 1) / 2
+        self.items += n
+        self.agreement += agreement / pairs
+        self.label_agreement += label_agreement / pairs
+        self.label_totals += np.bincount(tokens.ravel(), minlength=size)
+        self.annotations += m * n
+
+    def merge(self, other: "AgreementStats"):
+        """
+        Adds the statistics of other to these.
+        """
+        self.span_matches += other.span_matches
+        self.span_totals += other.span_totals
+        for key, confusion in other.confusions.items():
+            if key in self.confusions:
+                self.confusions[key] += confusion
+            else:
+                self.confusions[key] = confusion.copy()
+        self.items += other.items
+        self.agreement += other.agreement
+        self.label_agreement += other.label_agreement
+        self.label_totals += other.label_totals
+        self.annotations += other.annotations
+
+    def scores(self, label: int | None = None) -> AgreementScores:
+        """
+        Returns the scores over every label, or for label alone.
+        """
+        if label is None:
+            matches = self.span_matches.sum()
+            totals = self.span_totals.sum()
+            kappas = [_cohen_kappa(c) for c in self.confusions.values()]
+            fleiss = self._fleiss_kappa(self.agreement, self.label_totals)
+        else:
+            matches = self.span_matches[label]
+            totals = self.span_totals[label]
+            kappas = [
+                _cohen_kappa(_binary_confusion(c, label))
+                for c in self.confusions.values()
+            ]
+            given = self.label_totals[label]
+            fleiss = self._fleiss_kappa(
+                self.label_agreement[label],
+                np.array([given, self.annotations - given]),
+            )
+        defined = [k for k in kappas if k is not None]
+        return AgreementScores(
+            span_f1=float(2 * matches / totals) if totals else None,
+            cohen_kappa=float(np.mean(defined)) if defined else None,
+            fleiss_kappa=fleiss,
+        )
+
+    def _fleiss_kappa(self, agreement: float, totals: np.ndarray) -> float | None:
+        if self.items == 0:
+            return None
+        observed = agreement / self.items
+        proportions = totals / totals.sum()
+        expected = float((proportions**2).sum())
+        if expected >= 1:
+            return None
+        return float((observed - expected) / (1 - expected))
+
+
+def _cohen_kappa(confusion: np.ndarray) -> float | None:
+    total = confusion.sum()
+    if total == 0:
+        return None
+    observed = np.trace(confusion) / total
+    expected = (confusion.sum(axis=1) @ confusion.sum(axis=0)) / total**2
+    if expected >= 1:
+        return None
+    return float((observed - expected) / (1 - expected))
+
+
+def _binary_confusion(confusion: np.ndarray, label: int) -> np.ndarray:
+    """
+    Collapses a confusion matrix to label against every other category.
+    """
+    both = confusion[label, label]
+    first = confusion[label, :].sum() - both
+    second = confusion[:, label].sum() - both
+    neither = confusion.sum() - both - first - second
+    return np.array([[both, first], [second, neither]])
+
+
+def _binary_agreement(confusion: np.ndarray) -> np.ndarray:
+    """
+    Returns for each label the tokens where both annotators agree on whether
+    it's that label or not.
+    """
+    return (
+        confusion.sum()
+        - confusion.sum(axis=1)
+        - confusion.sum(axis=0)
+        + 2 * np.diagonal(confusion)
+    )
@@ -0,0 +1,72 @@
+"""
+In-process caches of values derived from the database.
+
+Entries are stored with the version of the rows they were computed from,
+readers pass the current version and stale entries are never returned, so
+writes don't need to reach every worker to invalidate them.
+"""
+
+from collections import OrderedDict
+from collections.abc import Callable, Hashable
+from typing import Generic, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class VersionedLRUCache(Generic[K, V]):
+    """
+    Keeps the max_entries most recently used values.
+
+    With max_size set the values also take at most that much room, as
+    measured by sizeof, values larger than that are never cached.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        max_size: int | None = None,
+        sizeof: Callable[[V], int] | None = None,
+    ):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.sizeof = sizeof or (lambda _: 0)
+        self.size = 0
+        self._entries: OrderedDict[K, tuple[Hashable, V]] = OrderedDict()
+
+    def get(self, key: K, version: Hashable) -> V | None:
+        """
+        Returns the value cached for key at version, None if there's none.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] != version:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: K, version: Hashable, value: V):
+        """
+        Caches value for key at version, evicting the least recently used
+        entries if needed.
+        """
+        if key in self._entries:
+            self._remove(key)
+        size = self.sizeof(value)
+        if self.max_size is not None and size > self.max_size:
+            return
+        self._entries[key] = (version, value)
+        self.size += size
+        while len(self._entries) > self.max_entries or (
+            self.max_size is not None and self.size > self.max_size
+        ):
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: K):
+        _, value = self._entries.pop(key)
+        self.size -= self.sizeof(value)
+
+    def __len__(self) -> int:
+        return len(self._entries)
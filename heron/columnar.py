@@ -0,0 +1,108 @@
+"""
+Compact columnar encoding of category listings.
+
+A listing is a single MessagePack map:
+
+- project_id, dataset_id: the 16 bytes of the ids shared by every category
+- labels: the 16 bytes of each distinct label id
+- authors: the 16 bytes of each distinct created_by, nil for unknown ones
+- ids: the 16 bytes of each category id, concatenated
+- label_indexes, author_indexes, start_offsets, end_offsets: little-endian
+  uint32 columns, indexes point into labels and authors
+- seqs: little-endian uint64 column of the change sequence numbers
+
+Columns are parallel, the nth value of each belongs to the nth category.
+"""
+
+import uuid
+from collections.abc import Sequence
+
+import msgpack
+import numpy as np
+
+from heron.db.category import Category
+
+MSGPACK_MEDIA_TYPE = "application/vnd.msgpack"
+
+_COLUMN_DTYPE = np.dtype("<u4")
+_SEQ_DTYPE = np.dtype("<u8")
+
+
+def _dictionary(
+    values: Sequence[uuid.UUID | None],
+) -> tuple[list[bytes | None], np.ndarray]:
+    """
+    Returns the distinct values in order of appearance and the index of each
+    value among them.
+    """
+    positions: dict[uuid.UUID | None, int] = {}
+    indexes = np.fromiter(
+        (positions.setdefault(v, len(positions)) for v in values),
+        dtype=_COLUMN_DTYPE,
+        count=len(values),
+    )
+    return [v.bytes if v is not None else None for v in positions], indexes
+
+
+def encode_categories(
+    project_id: uuid.UUID, dataset_id: uuid.UUID, categories: Sequence[Category]
+) -> bytes:
+    """
+    Encodes categories of a dataset, see the module docstring for the layout.
+    """
+    labels, label_indexes = _dictionary([c.label_id for c in categories])
+    authors, author_indexes = _dictionary([c.created_by for c in categories])
+    offsets = np.fromiter(
+        (o for c in categories for o in (c.start_offset, c.end_offset)),
+        dtype=_COLUMN_DTYPE,
+        count=2 * len(categories),
+    )
+    seqs = np.fromiter(
+        (c.seq for c in categories), dtype=_SEQ_DTYPE, count=len(categories)
+    )
+    return msgpack.packb(
+        {
+            "project_id": project_id.bytes,
+            "dataset_id": dataset_id.bytes,
+            "labels": labels,
+            "authors": authors,
+            "ids": b"".join(c.id.bytes for c in categories),
+            "label_indexes": label_indexes.tobytes(),
+            "author_indexes": author_indexes.tobytes(),
+            "start_offsets": offsets[0::2].tobytes(),
+            "end_offsets": offsets[1::2].tobytes(),
+            "seqs": seqs.tobytes(),
+        }
+    )
+
+
+def decode_categories(data: bytes) -> list[Category]:
+    """
+    Decodes what encode_categories returns.
+    """
+    columns = msgpack.unpackb(data)
+    project_id = uuid.UUID(bytes=columns["project_id"])
+    dataset_id = uuid.UUID(bytes=columns["dataset_id"])
+    labels = [uuid.UUID(bytes=b) for b in columns["labels"]]
+    authors = [
+        uuid.UUID(bytes=b) if b is not None else None for b in columns["authors"]
+    ]
+    ids = columns["ids"]
+    label_indexes = np.frombuffer(columns["label_indexes"], dtype=_COLUMN_DTYPE)
+    author_indexes = np.frombuffer(columns["author_indexes"], dtype=_COLUMN_DTYPE)
+    start_offsets = np.frombuffer(columns["start_offsets"], dtype=_COLUMN_DTYPE)
+    end_offsets = np.frombuffer(columns["end_offsets"], dtype=_COLUMN_DTYPE)
+    seqs = np.frombuffer(columns["seqs"], dtype=_SEQ_DTYPE)
+    return [
+        Category(
+            id=uuid.UUID(bytes=ids[16 * i : 16 * i + 16]),
+            label_id=labels[label_indexes[i]],
+            project_id=project_id,
+            dataset_id=dataset_id,
+            start_offset=int(start_offsets[i]),
+            end_offset=int(end_offsets[i]),
+            created_by=authors[author_indexes[i]],
+            seq=int(seqs[i]),
+        )
+        for i in range(len(label_indexes))
+    ]
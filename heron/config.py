@@ -10,6 +10,23 @@ class Settings(BaseSettings):
     postgres_db: str
     postgres_host: str
     postgres_port: str
+    # Backend storing the text of new datasets, either "postgres" or "filesystem"
+    dataset_storage: str = "postgres"
+    # Root directory of the "filesystem" dataset storage
+    dataset_storage_path: str = "datasets"
+    # Bytes of serialized category listings each worker keeps in memory
+    category_cache_size: int = 64 * 1024 * 1024
+    # Hash partitions of the categories table by project, 0 for a single table.
+    # Only read when the table is created, python -m heron.migrate
+    # partition-categories converts an existing one.
+    # Unvalidated: benchmarks/categories_partitions.py hasn't been run at the
+    # 100M rows partitioning is meant for, keep it off until it shows a gain
+    category_partitions: int = 0
+    # Changes of each dataset the changes feed keeps the deleted categories of,
+    # older cursors have to resync
+    tombstone_retention: int = 100_000
+    # Seconds between two compactions of the category tombstones
+    tombstone_compaction_interval: int = 3600
 
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
@@ -1,8 +1,13 @@
 import uuid
+from collections.abc import AsyncIterator
 
 import asyncpg
 from pydantic import BaseModel
 
+from heron.db.db import create_categories_table
+from heron.db.project import clone_id
+from heron.events import publish_category_events
+
 
 class Category(BaseModel):
     """
@@ -15,34 +20,131 @@ class Category(BaseModel):
     dataset_id: uuid.UUID
     start_offset: int
     end_offset: int
+    created_by: uuid.UUID | None = None
+    # Sequence number of the latest change to the category, its ETag
+    seq: int = 0
+
+
+class CategoryChange(BaseModel):
+    """
+    Represents the latest change to a category, deleted ones only have their id.
+    """
+
+    id: uuid.UUID
+    deleted: bool
+    label_id: uuid.UUID | None
+    start_offset: int | None
+    end_offset: int | None
+    seq: int
+
+
+def _event(op: str, seq: int, category: Category | None = None, **fields) -> dict:
+    """
+    Builds the event published when a category is written, deleted categories
+    only have their id.
+    """
+    if category is not None:
+        fields = category.model_dump(
+            include={"id", "label_id", "start_offset", "end_offset"}
+        )
+    return {"type": "category", "op": op, "seq": seq, "category": fields}
 
 
 async def create(conn: asyncpg.Connection, category: Category):
     """
     Creates a new category.
     """
-    await conn.execute(
+    seq = await conn.fetchval(
+        "WITH bumped AS ("
+        "UPDATE datasets SET categories_version = categories_version + 1 "
+        "WHERE id = $4 RETURNING categories_version) "
         "INSERT INTO categories "
-        "(id, label_id, project_id, dataset_id, start_offset, end_offset) "
-        "VALUES ($1, $2, $3, $4, $5, $6)",
+        "(id, label_id, project_id, dataset_id, start_offset, end_offset, seq, "
+        "created_by) "
+        "SELECT $1, $2, $3, $4, $5, $6, categories_version, $7 FROM bumped "
+        "RETURNING seq",
         category.id,
         category.label_id,
         category.project_id,
         category.dataset_id,
         category.start_offset,
         category.end_offset,
+        category.created_by,
+    )
+    if seq is not None:
+        await publish_category_events(
+            conn, category.dataset_id, [_event("create", seq, category)]
+        )
+
+
+async def _next_seq(conn: asyncpg.Connection, dataset_id: uuid.UUID) -> int:
+    """
+    Bumps the categories version of a dataset and returns it, it's the change
+    sequence number of the categories written next.
+
+    Every write bumps the dataset before touching categories, so writes to a
+    dataset are serialized on its row and sequence numbers become visible in
+    order. That's what makes reading changes since a sequence number safe.
+    """
+    return await conn.fetchval(
+        "UPDATE datasets SET categories_version = categories_version + 1 "
+        "WHERE id = $1 RETURNING categories_version",
+        dataset_id,
+    )
+
+
+async def create_many(
+    conn: asyncpg.Connection, dataset_id: uuid.UUID, categories: list[Category]
+):
+    """
+    Creates many categories of a dataset with a single COPY.
+    """
+    if not categories:
+        return
+    seq = await _next_seq(conn, dataset_id)
+    await conn.copy_records_to_table(
+        "categories",
+        records=[
+            (
+                c.id,
+                c.label_id,
+                c.project_id,
+                c.dataset_id,
+                c.start_offset,
+                c.end_offset,
+                seq,
+                c.created_by,
+            )
+            for c in categories
+        ],
+        columns=[
+            "id",
+            "label_id",
+            "project_id",
+            "dataset_id",
+            "start_offset",
+            "end_offset",
+            "seq",
+            "created_by",
+        ],
+    )
+    await publish_category_events(
+        conn, dataset_id, [_event("create", seq, c) for c in categories]
     )
 
 
 async def get_by_id(
-    conn: asyncpg.Connection, category_id: uuid.UUID
+    conn: asyncpg.Connection, project_id: uuid.UUID, category_id: uuid.UUID
 ) -> Category | None:
     """
-    Gets a category by its id.
+    Gets a category of a project by its id.
     """
     record: asyncpg.Record | None = await conn.fetchrow(
-        "SELECT id, label_id, project_id, dataset_id, start_offset, end_offset "
-        "FROM categories WHERE id = $1",
+        "SELECT id, label_id, project_id, dataset_id, start_offset, end_offset, "
+        "created_by, seq "
+        "FROM categories WHERE project_id = $1 AND id = $2 "
+        "AND label_id NOT IN (SELECT id FROM labels WHERE deleted)",
+        project_id,
         category_id,
     )
     if record is None:
@@ -51,34 +153,768 @@ async def get_by_id(
     return Category(**record)
 
 
+async def get_by_ids(
+    conn: asyncpg.Connection,
+    project_id: uuid.UUID,
+    dataset_id: uuid.UUID,
+    category_ids: list[uuid.UUID],
+) -> list[Category]:
+    """
+    Gets the categories of a dataset with the given ids, missing ones are
+    skipped.
+    """
+    records: list[asyncpg.Record] = await conn.fetch(
+        "SELECT id, label_id, project_id, dataset_id, start_offset, end_offset, "
+        "created_by, seq "
+        "FROM categories WHERE project_id = $1 AND dataset_id = $2 "
+        "AND id = ANY($3) "
+        "AND label_id NOT IN (SELECT id FROM labels WHERE deleted)",
+        project_id,
+        dataset_id,
+        category_ids,
+    )
+    return [Category(**r) for r in records]
+
+
+async def lock_dataset(conn: asyncpg.Connection, dataset_id: uuid.UUID):
+    """
+    Blocks other writes to the categories of a dataset until the current
+    transaction ends, so checks made before writing still hold.
+    """
+    await conn.execute("SELECT 1 FROM datasets WHERE id = $1 FOR UPDATE", dataset_id)
+
+
+def _dataset_query(
+    project_id: uuid.UUID,
+    dataset_id: uuid.UUID,
+    start: int | None,
+    end: int | None,
+    after: tuple[int, uuid.UUID] | None,
+    limit: int | None,
+) -> tuple[str, list]:
+    """
+    Builds the query selecting the categories of a dataset, see get_by_dataset.
+    """
+    conditions = [
+        "project_id = $1",
+        "dataset_id = $2",
+        "label_id NOT IN (SELECT id FROM labels WHERE deleted)",
+    ]
+    args: list = [project_id, dataset_id]
+    if start is not None or end is not None:
+        # Overlapping categories can only start between start minus the
+        # dataset longest span and end. The longest span is read from the
+        # (dataset_id, end_offset - start_offset) index, so the bound shrinks
+        # as soon as long spans are deleted or shortened
+        args.append(start or 0)
+        conditions.append(
+            f"start_offset >= ${len(args)}::integer - "
+            "(SELECT COALESCE(MAX(end_offset - start_offset), 0) FROM categories "
+            "WHERE project_id = $1 AND dataset_id = $2)"
+        )
+        conditions.append(f"end_offset > ${len(args)}")
+        if end is not None:
+            args.append(end)
+            conditions.append(f"start_offset < ${len(args)}")
+    if after is not None:
+        args.extend(after)
+        conditions.append(f"(start_offset, id) > (${len(args) - 1}, ${len(args)})")
+
+    query = (
+        "SELECT id, label_id, project_id, dataset_id, start_offset, end_offset, "
+        "created_by, seq "
+        f"FROM categories WHERE {' AND '.join(conditions)} "
+        "ORDER BY start_offset, id"
+    )
+    if limit is not None:
+        args.append(limit)
+        query += f" LIMIT ${len(args)}"
+    return query, args
+
+
 async def get_by_dataset(
-    conn: asyncpg.Connection, dataset_id: uuid.UUID
+    conn: asyncpg.Connection,
+    project_id: uuid.UUID,
+    dataset_id: uuid.UUID,
+    start: int | None = None,
+    end: int | None = None,
+    after: tuple[int, uuid.UUID] | None = None,
+    limit: int | None = None,
 ) -> list[Category]:
     """
-    Gets all categories for a dataset.
+    Gets all categories for a dataset of a project ordered by start offset
+    and id.
+
+    If start or end are set only the categories overlapping [start, end) are
+    returned, the scan then only covers that slice of the
+    (dataset_id, start_offset, id) index instead of the whole dataset.
+    after is the (start_offset, id) of the last category of the previous
+    page, to get the next up to limit categories.
+    """
+    query, args = _dataset_query(project_id, dataset_id, start, end, after, limit)
+    records: list[asyncpg.Record] = await conn.fetch(query, *args)
+    return [Category(**r) for r in records]
+
+
+async def iter_by_dataset(
+    conn: asyncpg.Connection,
+    project_id: uuid.UUID,
+    dataset_id: uuid.UUID,
+    start: int | None = None,
+    end: int | None = None,
+    after: tuple[int, uuid.UUID] | None = None,
+    limit: int | None = None,
+) -> AsyncIterator[Category]:
+    """
+    Same as get_by_dataset but reads the categories through a server-side
+    cursor, only a few of them are held in memory at any time.
+    """
+    query, args = _dataset_query(project_id, dataset_id, start, end, after, limit)
+    async with conn.transaction():
+        async for record in conn.cursor(query, *args, prefetch=1000):
+            yield Category(**record)
+
+
+async def get_by_label_subtree(
+    conn: asyncpg.Connection,
+    project_id: uuid.UUID,
+    label_path: str,
+    dataset_id: uuid.UUID | None = None,
+) -> list[Category]:
+    """
+    Gets the categories of a label and all its descendants, the label being
+    given by its path. With dataset_id set only the ones of that dataset.
+
+    The labels come from a prefix scan of the (project_id, path) index and
+    their categories from the label_id one, the cost only depends on what's
+    returned.
     """
     records: list[asyncpg.Record] = await conn.fetch(
-        "SELECT id, label_id, project_id, dataset_id, start_offset, end_offset "
-        "FROM categories WHERE dataset_id = $1",
+        "SELECT categories.id, categories.label_id, categories.project_id, "
+        "categories.dataset_id, categories.start_offset, categories.end_offset, "
+        "categories.created_by "
+        "FROM labels JOIN categories ON categories.label_id = labels.id "
+        "JOIN datasets ON datasets.id = categories.dataset_id "
+        "WHERE labels.project_id = $1 AND labels.path LIKE $2 || '%' "
+        "AND categories.project_id = $1 "
+        "AND NOT labels.deleted AND NOT datasets.deleted "
+        "AND ($3::uuid IS NULL OR categories.dataset_id = $3) "
+        "ORDER BY categories.dataset_id, categories.start_offset, categories.id",
+        project_id,
+        label_path,
         dataset_id,
     )
     return [Category(**r) for r in records]
 
 
-async def update(conn: asyncpg.Connection, category: Category):
+async def get_version(
+    conn: asyncpg.Connection, project_id: uuid.UUID, dataset_id: uuid.UUID
+) -> tuple[int, int] | None:
     """
-    Updates a category.
+    Gets the versions the categories of a dataset of a project depend on.
+
+    Returns the dataset categories version and its project labels version,
+    deleting a label deletes its categories too. None if the dataset doesn't
+    exist in the project.
     """
-    await conn.execute(
-        "UPDATE categories SET start_offset = $2, end_offset = $3 WHERE id = $1",
-        category.id,
-        category.start_offset,
-        category.end_offset,
+    record: asyncpg.Record | None = await conn.fetchrow(
+        "SELECT datasets.categories_version, projects.labels_version "
+        "FROM datasets JOIN projects ON projects.id = datasets.project_id "
+        "WHERE datasets.id = $1 AND datasets.project_id = $2 "
+        "AND NOT datasets.deleted",
+        dataset_id,
+        project_id,
+    )
+    if record is None:
+        return None
+    return record["categories_version"], record["labels_version"]
+
+
+async def update(
+    conn: asyncpg.Connection,
+    project_id: uuid.UUID,
+    dataset_id: uuid.UUID,
+    category_id: uuid.UUID,
+    label_id: uuid.UUID | None = None,
+    start_offset: int | None = None,
+    end_offset: int | None = None,
+    seq: int | None = None,
+) -> tuple[Category, int] | None:
+    """
+    Updates a category of a dataset with a single statement, None leaves that
+    field unchanged.
+    If seq is set the category is only updated if it wasn't written since the
+    change with that sequence number.
+
+    Returns the updated category and the sequence number of the change, None
+    if the category doesn't exist in the dataset or was written since seq.
+    """
+    record: asyncpg.Record | None = await conn.fetchrow(
+        "WITH bumped AS ("
+        "UPDATE datasets SET categories_version = categories_version + 1 "
+        "WHERE id = $1 RETURNING categories_version) "
+        "UPDATE categories SET "
+        "label_id = COALESCE($3, categories.label_id), "
+        "start_offset = COALESCE($4, categories.start_offset), "
+        "end_offset = COALESCE($5, categories.end_offset), "
+        "seq = bumped.categories_version "
+        "FROM bumped WHERE categories.project_id = $7 "
+        "AND categories.id = $2 AND categories.dataset_id = $1 "
+        "AND ($6::bigint IS NULL OR categories.seq = $6) "
+        "AND categories.label_id NOT IN (SELECT id FROM labels WHERE deleted) "
+        "RETURNING categories.id, categories.label_id, categories.project_id, "
+        "categories.dataset_id, categories.start_offset, categories.end_offset, "
+        "categories.created_by, categories.seq",
+        dataset_id,
+        category_id,
+        label_id,
+        start_offset,
+        end_offset,
+        seq,
+        project_id,
+    )
+    if record is None:
+        return None
+
+    category = Category(**record)
+    await publish_category_events(
+        conn, dataset_id, [_event("update", record["seq"], category)]
+    )
+    return category, record["seq"]
+
+
+async def update_many(
+    conn: asyncpg.Connection,
+    project_id: uuid.UUID,
+    dataset_id: uuid.UUID,
+    ids: list[uuid.UUID],
+    label_ids: list[uuid.UUID | None],
+    start_offsets: list[int | None],
+    end_offsets: list[int | None],
+) -> list[Category]:
+    """
+    Updates many categories of a dataset with a single statement.
+    The lists are parallel, None leaves that field of the category unchanged.
+
+    Returns the updated categories, ids not in the dataset are skipped.
+    """
+    if not ids:
+        return []
+    seq = await _next_seq(conn, dataset_id)
+    records: list[asyncpg.Record] = await conn.fetch(
+        "UPDATE categories SET "
+        "label_id = COALESCE(u.label_id, categories.label_id), "
+        "start_offset = COALESCE(u.start_offset, categories.start_offset), "
+        "end_offset = COALESCE(u.end_offset, categories.end_offset), "
+        "seq = $6 "
+        "FROM unnest($2::uuid[], $3::uuid[], $4::integer[], $5::integer[]) "
+        "AS u(id, label_id, start_offset, end_offset) "
+        "WHERE categories.project_id = $7 AND categories.id = u.id "
+        "AND categories.dataset_id = $1 "
+        "RETURNING categories.id, categories.label_id, categories.project_id, "
+        "categories.dataset_id, categories.start_offset, categories.end_offset, "
+        "categories.created_by, categories.seq",
+        dataset_id,
+        ids,
+        label_ids,
+        start_offsets,
+        end_offsets,
+        seq,
+        project_id,
+    )
+    categories = [Category(**r) for r in records]
+    await publish_category_events(
+        conn, dataset_id, [_event("update", seq, c) for c in categories]
+    )
+    return categories
+
+
+async def delete_many(
+    conn: asyncpg.Connection,
+    project_id: uuid.UUID,
+    dataset_id: uuid.UUID,
+    ids: list[uuid.UUID],
+) -> list[uuid.UUID]:
+    """
+    Deletes many categories of a dataset with a single statement.
+    Returns the ids of the deleted categories.
+    """
+    if not ids:
+        return []
+    seq = await _next_seq(conn, dataset_id)
+    records: list[asyncpg.Record] = await conn.fetch(
+        "WITH deleted AS ("
+        "DELETE FROM categories WHERE project_id = $4 AND dataset_id = $1 "
+        "AND id = ANY($2) RETURNING id) "
+        "INSERT INTO category_tombstones (dataset_id, category_id, seq) "
+        "SELECT $1, id, $3 FROM deleted RETURNING category_id",
+        dataset_id,
+        ids,
+        seq,
+        project_id,
+    )
+    deleted = [r["category_id"] for r in records]
+    await publish_category_events(
+        conn,
+        dataset_id,
+        [_event("delete", seq, id=category_id) for category_id in deleted],
+    )
+    return deleted
+
+
+async def delete_category(
+    conn: asyncpg.Connection,
+    project_id: uuid.UUID,
+    dataset_id: uuid.UUID,
+    category_id: uuid.UUID,
+):
+    """
+    Deletes a category of a dataset, leaving a tombstone in its place.
+    Nothing changes if the category doesn't exist in the dataset.
+    """
+    async with conn.transaction():
+        # The dataset is only bumped if the category is deleted, locking it
+        # first still orders this after the writes before it
+        await lock_dataset(conn, dataset_id)
+        seq = await conn.fetchval(
+            "WITH deleted AS ("
+            "DELETE FROM categories "
+            "WHERE project_id = $3 AND id = $2 AND dataset_id = $1 "
+            "RETURNING id), "
+            "bumped AS ("
+            "UPDATE datasets SET categories_version = categories_version + 1 "
+            "WHERE id = $1 AND EXISTS (SELECT 1 FROM deleted) "
+            "RETURNING categories_version) "
+            "INSERT INTO category_tombstones (dataset_id, category_id, seq) "
+            "SELECT $1, deleted.id, bumped.categories_version "
+            "FROM deleted, bumped RETURNING seq",
+            dataset_id,
+            category_id,
+            project_id,
+        )
+        if seq is not None:
+            await publish_category_events(
+                conn, dataset_id, [_event("delete", seq, id=category_id)]
+            )
+
+
+async def count_by_dataset(
+    conn: asyncpg.Connection, project_id: uuid.UUID, dataset_id: uuid.UUID
+) -> int:
+    """
+    Counts the categories of a dataset.
+    """
+    return await conn.fetchval(
+        "SELECT COUNT(*) FROM categories WHERE project_id = $1 AND dataset_id = $2",
+        project_id,
+        dataset_id,
+    )
+
+
+async def count_by_datasets(
+    conn: asyncpg.Connection, project_id: uuid.UUID, dataset_ids: list[uuid.UUID]
+) -> int:
+    """
+    Counts the categories of any of the datasets, leaving out the ones of
+    deleted labels.
+    """
+    return await conn.fetchval(
+        "SELECT COUNT(*) FROM categories WHERE project_id = $1 "
+        "AND dataset_id = ANY($2) "
+        "AND label_id NOT IN (SELECT id FROM labels WHERE deleted)",
+        project_id,
+        dataset_ids,
+    )
+
+
+async def count_by_label(
+    conn: asyncpg.Connection, project_id: uuid.UUID, label_id: uuid.UUID
+) -> int:
+    """
+    Counts the categories of a label.
+    """
+    return await conn.fetchval(
+        "SELECT COUNT(*) FROM categories WHERE project_id = $1 AND label_id = $2",
+        project_id,
+        label_id,
+    )
+
+
+async def count_by_labels(
+    conn: asyncpg.Connection, project_id: uuid.UUID, label_ids: list[uuid.UUID]
+) -> int:
+    """
+    Counts the categories of any of the labels.
+    """
+    return await conn.fetchval(
+        "SELECT COUNT(*) FROM categories WHERE project_id = $1 "
+        "AND label_id = ANY($2)",
+        project_id,
+        label_ids,
+    )
+
+
+async def get_dataset_ids_by_labels(
+    conn: asyncpg.Connection, project_id: uuid.UUID, label_ids: list[uuid.UUID]
+) -> list[uuid.UUID]:
+    """
+    Gets the ids of the datasets with categories of any of the labels.
+    """
+    records: list[asyncpg.Record] = await conn.fetch(
+        "SELECT DISTINCT dataset_id FROM categories "
+        "WHERE project_id = $1 AND label_id = ANY($2)",
+        project_id,
+        label_ids,
     )
+    return [r["dataset_id"] for r in records]
 
 
-async def delete_category(conn: asyncpg.Connection, category_id: uuid.UUID):
+async def relabel_batch(
+    conn: asyncpg.Connection,
+    project_id: uuid.UUID,
+    dataset_id: uuid.UUID,
+    source_ids: list[uuid.UUID],
+    target_id: uuid.UUID,
+    batch_size: int,
+) -> int | None:
     """
-    Deletes a category.
+    Moves up to batch_size categories of a dataset from any of the source
+    labels to the target one.
+    Returns how many were moved, None if the target label was deleted.
+
+    The target label is locked until the categories are moved, so it can't
+    be hidden in between and leave them to a label being purged unnoticed.
     """
-    await conn.execute("DELETE FROM categories WHERE id = $1", category_id)
+    async with conn.transaction():
+        target = await conn.fetchval(
+            "SELECT 1 FROM labels WHERE id = $1 AND project_id = $2 AND NOT deleted "
+            "FOR SHARE",
+            target_id,
+            project_id,
+        )
+        if target is None:
+            return None
+        records: list[asyncpg.Record] = await conn.fetch(
+            "WITH bumped AS ("
+            "UPDATE datasets SET categories_version = categories_version + 1 "
+            "WHERE id = $1 RETURNING categories_version) "
+            "UPDATE categories SET label_id = $3, seq = bumped.categories_version "
+            "FROM bumped WHERE categories.project_id = $5 AND categories.id IN ("
+            "SELECT id FROM categories WHERE project_id = $5 AND dataset_id = $1 "
+            "AND label_id = ANY($2) LIMIT $4) "
+            "RETURNING categories.id, categories.label_id, categories.project_id, "
+            "categories.dataset_id, categories.start_offset, categories.end_offset, "
+            "categories.created_by, categories.seq",
+            dataset_id,
+            source_ids,
+            target_id,
+            batch_size,
+            project_id,
+        )
+    await publish_category_events(
+        conn,
+        dataset_id,
+        [_event("update", r["seq"], Category(**r)) for r in records],
+    )
+    return len(records)
+
+
+async def clone_batch(
+    conn: asyncpg.Connection,
+    project_id: uuid.UUID,
+    dataset_id: uuid.UUID,
+    target_project_id: uuid.UUID,
+    after: tuple[int, uuid.UUID] | None,
+    batch_size: int,
+) -> tuple[int, tuple[int, uuid.UUID] | None]:
+    """
+    Copies up to batch_size categories of a dataset of project_id, the ones
+    after the (start_offset, id) key after, into the copy of the dataset in
+    the target project with a single statement. Ids are remapped like
+    heron.db.project.clone_id does.
+
+    Each batch bumps the categories version of the copy like any other write,
+    so nothing cached from a partial copy is served once it grows. Categories
+    of labels created after the labels were copied have nothing to point to
+    and are skipped.
+
+    Returns how many categories were read and the key of the last one.
+    """
+    record: asyncpg.Record = await conn.fetchrow(
+        "WITH batch AS ("
+        "SELECT * FROM categories WHERE project_id = $6 AND dataset_id = $1 "
+        "AND label_id NOT IN (SELECT id FROM labels WHERE deleted) "
+        "AND ($3::integer IS NULL OR (start_offset, id) > ($3, $4)) "
+        "ORDER BY start_offset, id LIMIT $5), "
+        "bumped AS ("
+        "UPDATE datasets SET categories_version = categories_version + 1 "
+        f"WHERE id = {clone_id('$2', '$1::uuid')} "
+        "AND EXISTS (SELECT 1 FROM batch) RETURNING categories_version), "
+        "inserted AS ("
+        "INSERT INTO categories (id, label_id, project_id, dataset_id, "
+        "start_offset, end_offset, seq, created_by) "
+        f"SELECT {clone_id('$2', 'batch.id')}, labels.id, $2, "
+        f"{clone_id('$2', 'batch.dataset_id')}, batch.start_offset, "
+        "batch.end_offset, bumped.categories_version, batch.created_by "
+        "FROM batch CROSS JOIN bumped "
+        f"JOIN labels ON labels.id = {clone_id('$2', 'batch.label_id')} "
+        "ON CONFLICT DO NOTHING) "
+        "SELECT COUNT(*) AS copied, "
+        "(ARRAY_AGG(start_offset ORDER BY start_offset DESC, id DESC))[1] "
+        "AS last_start, "
+        "(ARRAY_AGG(id ORDER BY start_offset DESC, id DESC))[1] AS last_id "
+        "FROM batch",
+        dataset_id,
+        target_project_id,
+        *(after or (None, None)),
+        batch_size,
+        project_id,
+    )
+    if record["copied"] == 0:
+        return 0, None
+    return record["copied"], (record["last_start"], record["last_id"])
+
+
+async def delete_batch_by_dataset(
+    conn: asyncpg.Connection,
+    project_id: uuid.UUID,
+    dataset_id: uuid.UUID,
+    batch_size: int,
+) -> int:
+    """
+    Deletes up to batch_size categories of a dataset.
+    Returns how many were deleted.
+    """
+    status = await conn.execute(
+        "DELETE FROM categories WHERE project_id = $1 AND id IN ("
+        "SELECT id FROM categories WHERE project_id = $1 AND dataset_id = $2 "
+        "LIMIT $3)",
+        project_id,
+        dataset_id,
+        batch_size,
+    )
+    return int(status.split()[-1])
+
+
+async def delete_tombstones_batch(
+    conn: asyncpg.Connection, dataset_id: uuid.UUID, batch_size: int
+) -> int:
+    """
+    Deletes up to batch_size category tombstones of a dataset.
+    Returns how many were deleted.
+    """
+    status = await conn.execute(
+        "DELETE FROM category_tombstones WHERE (dataset_id, seq, category_id) IN ("
+        "SELECT dataset_id, seq, category_id FROM category_tombstones "
+        "WHERE dataset_id = $1 LIMIT $2)",
+        dataset_id,
+        batch_size,
+    )
+    return int(status.split()[-1])
+
+
+async def get_compactable_datasets(
+    conn: asyncpg.Connection, retention: int
+) -> list[tuple[uuid.UUID, int]]:
+    """
+    Gets the datasets having category tombstones more than retention changes
+    older than their latest change, with the sequence number up to which they
+    can be compacted.
+    """
+    records: list[asyncpg.Record] = await conn.fetch(
+        "SELECT id, categories_version - $1 AS until_seq FROM datasets "
+        "WHERE EXISTS (SELECT 1 FROM category_tombstones "
+        "WHERE dataset_id = datasets.id AND seq <= datasets.categories_version - $1)",
+        retention,
+    )
+    return [(r["id"], r["until_seq"]) for r in records]
+
+
+async def start_compaction(
+    conn: asyncpg.Connection, dataset_id: uuid.UUID, until_seq: int
+) -> int:
+    """
+    Records that the category tombstones of a dataset up to until_seq are
+    about to be deleted, before deleting any so the changes feed never misses
+    one without noticing. Returns the sequence number of the last of them.
+    """
+    return await conn.fetchval(
+        "UPDATE datasets SET tombstones_compacted_seq = GREATEST("
+        "tombstones_compacted_seq, (SELECT MAX(seq) FROM category_tombstones "
+        "WHERE dataset_id = $1 AND seq <= $2)) "
+        "WHERE id = $1 RETURNING tombstones_compacted_seq",
+        dataset_id,
+        until_seq,
+    )
+
+
+async def compact_tombstones_batch(
+    conn: asyncpg.Connection, dataset_id: uuid.UUID, until_seq: int, batch_size: int
+) -> int:
+    """
+    Deletes up to batch_size category tombstones of a dataset with a sequence
+    number up to until_seq, see start_compaction.
+    Returns how many were deleted.
+    """
+    status = await conn.execute(
+        "DELETE FROM category_tombstones WHERE (dataset_id, seq, category_id) IN ("
+        "SELECT dataset_id, seq, category_id FROM category_tombstones "
+        "WHERE dataset_id = $1 AND seq <= $2 LIMIT $3)",
+        dataset_id,
+        until_seq,
+        batch_size,
+    )
+    return int(status.split()[-1])
+
+
+async def delete_batch_by_label(
+    conn: asyncpg.Connection,
+    project_id: uuid.UUID,
+    label_id: uuid.UUID,
+    batch_size: int,
+) -> int:
+    """
+    Deletes up to batch_size categories of a label, leaving tombstones in
+    their place.
+    Returns how many were deleted.
+    """
+    records: list[asyncpg.Record] = await conn.fetch(
+        "SELECT id, dataset_id FROM categories "
+        "WHERE project_id = $1 AND label_id = $2 LIMIT $3",
+        project_id,
+        label_id,
+        batch_size,
+    )
+    by_dataset: dict[uuid.UUID, list[uuid.UUID]] = {}
+    for record in records:
+        by_dataset.setdefault(record["dataset_id"], []).append(record["id"])
+    deleted = 0
+    for dataset_id, ids in by_dataset.items():
+        async with conn.transaction():
+            deleted += len(await delete_many(conn, project_id, dataset_id, ids))
+    return deleted
+
+
+async def get_changes(
+    conn: asyncpg.Connection, project_id: uuid.UUID, dataset_id: uuid.UUID, since: int
+) -> list[CategoryChange] | None:
+    """
+    Gets the changes to the categories of a dataset with a sequence number
+    greater than since, ordered by sequence number.
+
+    Only the latest change of each category is returned. Returns None if
+    tombstones of categories deleted after since were compacted, the changes
+    would miss these deletions.
+    """
+    records: list[asyncpg.Record] = await conn.fetch(
+        "SELECT id, FALSE AS deleted, label_id, start_offset, end_offset, seq "
+        "FROM categories WHERE project_id = $3 AND dataset_id = $1 AND seq > $2 "
+        "AND label_id NOT IN (SELECT id FROM labels WHERE deleted) "
+        "UNION ALL "
+        "SELECT category_id, TRUE, NULL, NULL, NULL, seq "
+        "FROM category_tombstones WHERE dataset_id = $1 AND seq > $2 "
+        "ORDER BY seq",
+        dataset_id,
+        since,
+        project_id,
+    )
+    # Checked afterwards, compactions record their bound before deleting
+    compacted_seq = await conn.fetchval(
+        "SELECT tombstones_compacted_seq FROM datasets WHERE id = $1", dataset_id
+    )
+    if compacted_seq is not None and since < compacted_seq:
+        return None
+    return [CategoryChange(**r) for r in records]
+
+
+_COLUMNS = (
+    "id, label_id, project_id, dataset_id, start_offset, end_offset, seq, " "created_by"
+)
+
+
+async def is_partitioned(conn: asyncpg.Connection) -> bool:
+    """
+    Tells whether the categories table is partitioned.
+    """
+    return await conn.fetchval(
+        "SELECT relkind = 'p' FROM pg_class WHERE oid = 'categories'::regclass"
+    )
+
+
+async def partition_table(
+    conn: asyncpg.Connection, partitions: int, batch_size: int = 10000
+) -> int:
+    """
+    Moves every category into a new categories table hash partitioned by
+    project, see heron.db.db.create_categories_table.
+    Returns the number of categories copied.
+
+    Categories are copied in batches while the application keeps running.
+    Then writes are blocked, the datasets whose categories version moved
+    since the copy started are copied again, and the tables are swapped in
+    the same transaction. The old table is kept as categories_unpartitioned.
+    An interrupted migration starts over.
+    """
+    await conn.execute("DROP TABLE IF EXISTS categories_partitioned")
+    await create_categories_table(conn, "categories_partitioned", partitions)
+    versions = {
+        r["id"]: r["categories_version"]
+        for r in await conn.fetch("SELECT id, categories_version FROM datasets")
+    }
+
+    copied = 0
+    after: uuid.UUID | None = None
+    while True:
+        record: asyncpg.Record = await conn.fetchrow(
+            "WITH batch AS ("
+            f"SELECT {_COLUMNS} FROM categories "
+            "WHERE $1::uuid IS NULL OR id > $1 ORDER BY id LIMIT $2), "
+            "inserted AS ("
+            f"INSERT INTO categories_partitioned ({_COLUMNS}) "
+            f"SELECT {_COLUMNS} FROM batch) "
+            "SELECT COUNT(*) AS copied, (ARRAY_AGG(id ORDER BY id DESC))[1] AS last_id "
+            "FROM batch",
+            after,
+            batch_size,
+        )
+        if record["copied"] == 0:
+            break
+        copied += record["copied"]
+        after = record["last_id"]
+
+    async with conn.transaction():
+        # Every category write bumps its dataset, which tells the datasets
+        # whose categories changed during the copy
+        await conn.execute("LOCK TABLE categories IN EXCLUSIVE MODE")
+        changed = [
+            r["id"]
+            for r in await conn.fetch(
+                "SELECT id, categories_version, deleted FROM datasets"
+            )
+            if r["deleted"] or versions.get(r["id"]) != r["categories_version"]
+        ]
+        await conn.execute(
+            "DELETE FROM categories_partitioned WHERE dataset_id = ANY($1)", changed
+        )
+        await conn.execute(
+            f"INSERT INTO categories_partitioned ({_COLUMNS}) "
+            f"SELECT {_COLUMNS} FROM categories WHERE dataset_id = ANY($1)",
+            changed,
+        )
+
+        await conn.execute("ALTER TABLE categories RENAME TO categories_unpartitioned")
+        await conn.execute("ALTER TABLE categories_partitioned RENAME TO categories")
+        for index in ["pkey", "dataset_start_idx", "label_id_idx", "dataset_seq_idx"]:
+            await conn.execute(
+                f"ALTER INDEX categories_{index} "
+                f"RENAME TO categories_unpartitioned_{index}"
+            )
+            await conn.execute(
+                f"ALTER INDEX categories_partitioned_{index} RENAME TO categories_{index}"
+            )
+        for remainder in range(partitions):
+            await conn.execute(
+                f"ALTER TABLE categories_partitioned_p{remainder} "
+                f"RENAME TO categories_p{remainder}"
+            )
+    return copied
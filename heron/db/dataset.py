@@ -1,8 +1,20 @@
+import hashlib
 import uuid
+from collections.abc import AsyncIterator
 
 import asyncpg
 from pydantic import BaseModel
 
+from heron.storage import DatasetStorage, get_storage
+
+# Only the start of longer texts is searchable. Postgres rejects search
+# vectors over 1MB, this many characters stay well under that whatever the
+# text, and positions past 16383 aren't told apart anyway
+SEARCH_TEXT_LIMIT = 100_000
+# Searches rank at most this many matching datasets, the pages of larger
+# results come from an arbitrary subset of the matches
+SEARCH_CANDIDATES = 1000
+
 
 class Dataset(BaseModel):
     """
@@ -15,21 +27,119 @@ class Dataset(BaseModel):
     text: str
 
 
+class DatasetMetadata(BaseModel):
+    """
+    Represents a dataset without its text.
+    """
+
+    id: uuid.UUID
+    project_id: uuid.UUID
+    filename: str | None
+    text_length: int
+    content_hash: str
+
+
+class AnnotatedDataset(BaseModel):
+    """
+    Represents a dataset with its categories as (start, end, label name)
+    ordered by start offset.
+    """
+
+    id: uuid.UUID
+    filename: str | None
+    text: str
+    spans: list[tuple[int, int, str]]
+
+
+class AuthoredDataset(BaseModel):
+    """
+    Represents a dataset with the categories whose author is known, as
+    parallel lists.
+    """
+
+    id: uuid.UUID
+    filename: str | None
+    text: str
+    created_by: list[uuid.UUID]
+    label_ids: list[uuid.UUID]
+    start_offsets: list[int]
+    end_offsets: list[int]
+
+
+class StoredText(BaseModel):
+    """
+    Represents where the text of a dataset is stored.
+    """
+
+    storage: str
+    content_hash: str
+
+
+class DatasetSearchHit(BaseModel):
+    """
+    Represents a dataset matching a full-text search.
+    """
+
+    id: uuid.UUID
+    filename: str | None
+    rank: float
+    text: str
+
+
 async def create(conn: asyncpg.Connection, dataset: Dataset) -> str:
     """
     Creates a new dataset in the database.
+
+    The text is stored by the configured storage backend, the search vector is
+    always computed by Postgres, from the first SEARCH_TEXT_LIMIT characters.
     """
+    storage = get_storage()
+    content_hash = hashlib.sha256(dataset.text.encode("utf-8")).hexdigest()
+    async with conn.transaction():
+        await _lock_text(conn, content_hash)
+        column_text = await storage.write(content_hash, dataset.text)
+        try:
+            # A savepoint, so the text can still be released if this fails
+            async with conn.transaction():
+                return await _insert(conn, dataset, storage, column_text, content_hash)
+        except Exception:
+            await _release_text(conn, storage.name, content_hash)
+            raise
+
+
+async def _insert(
+    conn: asyncpg.Connection,
+    dataset: Dataset,
+    storage: DatasetStorage,
+    column_text: str | None,
+    content_hash: str,
+) -> str:
     return await conn.execute(
+        "WITH inserted AS ("
         "INSERT INTO datasets "
-        "(id, project_id, filename, text) "
-        "VALUES ($1, $2, $3, $4)",
+        "(id, project_id, filename, text, storage, search_vector, content_hash, "
+        "text_length) "
+        "VALUES ($1, $2, $3, $4, $5, to_tsvector('simple', $6), $7, $8) "
+        "RETURNING project_id) "
+        "UPDATE projects SET datasets_version = datasets_version + 1, "
+        "dataset_count = dataset_count + 1 "
+        "WHERE id IN (SELECT project_id FROM inserted)",
         dataset.id,
         dataset.project_id,
         dataset.filename,
-        dataset.text,
+        column_text,
+        storage.name,
+        dataset.text[:SEARCH_TEXT_LIMIT],
+        content_hash,
+        len(dataset.text),
     )
 
 
+async def _read_text(record: asyncpg.Record) -> str:
+    storage = get_storage(record["storage"])
+    return await storage.read(record["content_hash"], record["text"])
+
+
 async def get_by_project(
     conn: asyncpg.Connection, project_id: uuid.UUID
 ) -> list[Dataset]:
@@ -37,12 +147,21 @@ async def get_by_project(
     Gets a dataset by its id.
     """
     record: list[asyncpg.Record] = await conn.fetch(
-        "SELECT id, project_id, filename, text FROM datasets WHERE project_id = $1",
+        "SELECT id, project_id, filename, text, storage, content_hash "
+        "FROM datasets WHERE project_id = $1 AND NOT deleted",
         project_id,
     )
     if record is None:
         return None
-    return [Dataset(**r) for r in record]
+    return [
+        Dataset(
+            id=r["id"],
+            project_id=r["project_id"],
+            filename=r["filename"],
+            text=await _read_text(r),
+        )
+        for r in record
+    ]
 
 
 async def get_by_id(conn: asyncpg.Connection, dataset_id: uuid.UUID) -> Dataset | None:
@@ -50,16 +169,330 @@ async def get_by_id(conn: asyncpg.Connection, dataset_id: uuid.UUID) -> Dataset
     Gets a dataset by its id.
     """
     record: asyncpg.Record | None = await conn.fetchrow(
-        "SELECT id, project_id, filename, text FROM datasets WHERE id = $1", dataset_id
+        "SELECT id, project_id, filename, text, storage, content_hash "
+        "FROM datasets WHERE id = $1 AND NOT deleted",
+        dataset_id,
     )
     if record is None:
         return None
 
-    return Dataset(**record)
+    return Dataset(
+        id=record["id"],
+        project_id=record["project_id"],
+        filename=record["filename"],
+        text=await _read_text(record),
+    )
+
+
+async def iter_annotated(
+    conn: asyncpg.Connection, project_id: uuid.UUID
+) -> AsyncIterator[AnnotatedDataset]:
+    """
+    Yields every dataset of a project with its categories, reading them through
+    a server-side cursor so only a few datasets are held in memory at once.
+    """
+    async with conn.transaction():
+        async for record in conn.cursor(
+            "SELECT datasets.id, datasets.filename, datasets.text, "
+            "datasets.storage, datasets.content_hash, "
+            "spans.starts, spans.ends, spans.labels "
+            "FROM datasets CROSS JOIN LATERAL ("
+            "SELECT "
+            "array_agg(categories.start_offset ORDER BY categories.start_offset, "
+            "categories.id) AS starts, "
+            "array_agg(categories.end_offset ORDER BY categories.start_offset, "
+            "categories.id) AS ends, "
+            "array_agg(labels.name ORDER BY categories.start_offset, "
+            "categories.id) AS labels "
+            "FROM categories JOIN labels ON labels.id = categories.label_id "
+            "WHERE categories.project_id = $1 "
+            "AND categories.dataset_id = datasets.id AND NOT labels.deleted"
+            ") AS spans "
+            "WHERE datasets.project_id = $1 AND NOT datasets.deleted "
+            "ORDER BY datasets.id",
+            project_id,
+            prefetch=50,
+        ):
+            yield AnnotatedDataset(
+                id=record["id"],
+                filename=record["filename"],
+                text=await _read_text(record),
+                spans=list(
+                    zip(
+                        record["starts"] or [],
+                        record["ends"] or [],
+                        record["labels"] or [],
+                    )
+                ),
+            )
+
+
+async def iter_authored(
+    conn: asyncpg.Connection, project_id: uuid.UUID
+) -> AsyncIterator[AuthoredDataset]:
+    """
+    Yields every dataset of a project with its categories and their authors,
+    reading them through a server-side cursor like iter_annotated.
+    """
+    async with conn.transaction():
+        async for record in conn.cursor(
+            "SELECT datasets.id, datasets.filename, datasets.text, "
+            "datasets.storage, datasets.content_hash, "
+            "spans.created_by, spans.label_ids, spans.starts, spans.ends "
+            "FROM datasets CROSS JOIN LATERAL ("
+            "SELECT array_agg(created_by) AS created_by, "
+            "array_agg(label_id) AS label_ids, "
+            "array_agg(start_offset) AS starts, "
+            "array_agg(end_offset) AS ends "
+            "FROM categories "
+            "WHERE project_id = $1 AND dataset_id = datasets.id "
+            "AND created_by IS NOT NULL "
+            "AND label_id NOT IN (SELECT id FROM labels WHERE deleted)"
+            ") AS spans "
+            "WHERE datasets.project_id = $1 AND NOT datasets.deleted "
+            "ORDER BY datasets.id",
+            project_id,
+            prefetch=50,
+        ):
+            yield AuthoredDataset(
+                id=record["id"],
+                filename=record["filename"],
+                text=await _read_text(record),
+                created_by=record["created_by"] or [],
+                label_ids=record["label_ids"] or [],
+                start_offsets=record["starts"] or [],
+                end_offsets=record["ends"] or [],
+            )
+
+
+async def get_metadata(
+    conn: asyncpg.Connection, dataset_id: uuid.UUID
+) -> DatasetMetadata | None:
+    """
+    Gets a dataset by its id without loading its text.
+    """
+    record: asyncpg.Record | None = await conn.fetchrow(
+        "SELECT id, project_id, filename, text_length, content_hash "
+        "FROM datasets WHERE id = $1 AND NOT deleted",
+        dataset_id,
+    )
+    if record is None:
+        return None
+    return DatasetMetadata(**record)
+
+
+async def get_metadata_by_project(
+    conn: asyncpg.Connection, project_id: uuid.UUID
+) -> list[DatasetMetadata]:
+    """
+    Gets all datasets of a project without loading their text.
+    """
+    records: list[asyncpg.Record] = await conn.fetch(
+        "SELECT id, project_id, filename, text_length, content_hash "
+        "FROM datasets WHERE project_id = $1 AND NOT deleted",
+        project_id,
+    )
+    return [DatasetMetadata(**r) for r in records]
+
+
+async def get_content_hash(
+    conn: asyncpg.Connection, dataset_id: uuid.UUID
+) -> str | None:
+    """
+    Gets the SHA-256 of a dataset text without loading the text itself.
+    """
+    return await conn.fetchval(
+        "SELECT content_hash FROM datasets WHERE id = $1 AND NOT deleted", dataset_id
+    )
+
+
+async def get_stored_text(
+    conn: asyncpg.Connection, project_id: uuid.UUID, dataset_id: uuid.UUID
+) -> StoredText | None:
+    """
+    Gets where the text of a dataset of a project is stored without loading it.
+    """
+    record: asyncpg.Record | None = await conn.fetchrow(
+        "SELECT storage, content_hash FROM datasets "
+        "WHERE id = $1 AND project_id = $2 AND NOT deleted",
+        dataset_id,
+        project_id,
+    )
+    if record is None:
+        return None
+    return StoredText(**record)
+
+
+async def get_text_range(
+    conn: asyncpg.Connection,
+    project_id: uuid.UUID,
+    dataset_id: uuid.UUID,
+    start: int,
+    end: int | None,
+) -> str | None:
+    """
+    Gets the characters in [start, end) of the text of a dataset of a project,
+    up to its end if end is None.
+
+    Only the requested range leaves Postgres or is read from the filesystem.
+    """
+    length = None if end is None else max(end - start, 0)
+    record: asyncpg.Record | None = await conn.fetchrow(
+        "SELECT storage, content_hash, "
+        "CASE WHEN $3::integer IS NULL THEN substr(text, $2 + 1) "
+        "ELSE substr(text, $2 + 1, $3) END AS text "
+        "FROM datasets WHERE id = $1 AND project_id = $4 AND NOT deleted",
+        dataset_id,
+        start,
+        length,
+        project_id,
+    )
+    if record is None:
+        return None
+    if record["text"] is not None:
+        return record["text"]
+    storage = get_storage(record["storage"])
+    return await storage.read_range(record["content_hash"], None, start, end)
+
+
+async def _lock_text(conn: asyncpg.Connection, content_hash: str):
+    """
+    Serializes writes and deletes of the texts with content_hash until the
+    current transaction ends, so a text isn't deleted while a new dataset
+    starts referencing it.
+    """
+    await conn.execute("SELECT pg_advisory_xact_lock(hashtext($1))", content_hash)
+
+
+async def _release_text(conn: asyncpg.Connection, storage_name: str, content_hash: str):
+    """
+    Deletes a stored text if no dataset references it anymore.
+    """
+    async with conn.transaction():
+        await _lock_text(conn, content_hash)
+        referenced = await conn.fetchval(
+            "SELECT 1 FROM datasets WHERE storage = $1 AND content_hash = $2 LIMIT 1",
+            storage_name,
+            content_hash,
+        )
+        if not referenced:
+            await get_storage(storage_name).delete(content_hash)
+
+
+async def hide(
+    conn: asyncpg.Connection, project_id: uuid.UUID, dataset_id: uuid.UUID
+) -> bool:
+    """
+    Marks a dataset of a project as deleted, it's not returned by any read from
+    now on.
+    Returns False if the dataset doesn't exist in the project or was already
+    hidden.
+
+    The row itself is removed by delete once its categories are purged.
+    """
+    hidden = await conn.fetchval(
+        "WITH hidden AS ("
+        "UPDATE datasets SET deleted = TRUE "
+        "WHERE id = $1 AND project_id = $2 AND NOT deleted "
+        "RETURNING project_id) "
+        "UPDATE projects SET datasets_version = datasets_version + 1, "
+        "dataset_count = dataset_count - 1 "
+        "WHERE id IN (SELECT project_id FROM hidden) "
+        "RETURNING TRUE",
+        dataset_id,
+        project_id,
+    )
+    return bool(hidden)
 
 
 async def delete(conn: asyncpg.Connection, dataset_id: uuid.UUID):
     """
     Deletes a dataset from the database.
     """
-    await conn.execute("DELETE FROM datasets WHERE id = $1", dataset_id)
+    record: asyncpg.Record | None = await conn.fetchrow(
+        "DELETE FROM datasets WHERE id = $1 RETURNING storage, content_hash",
+        dataset_id,
+    )
+    if record is not None:
+        await _release_text(conn, record["storage"], record["content_hash"])
+
+
+async def migrate_storage(
+    conn: asyncpg.Connection, target: DatasetStorage, batch_size: int = 100
+) -> int:
+    """
+    Moves the text of every dataset not stored by target into it.
+    Returns the number of datasets moved.
+
+    Each text is written to target before its row is updated and the old copy
+    is deleted only after that, so the migration can be interrupted and resumed.
+    """
+    moved = 0
+    while True:
+        records: list[asyncpg.Record] = await conn.fetch(
+            "SELECT id, text, storage, content_hash FROM datasets "
+            "WHERE storage <> $1 ORDER BY id LIMIT $2",
+            target.name,
+            batch_size,
+        )
+        if not records:
+            return moved
+        for record in records:
+            text = await _read_text(record)
+            async with conn.transaction():
+                await _lock_text(conn, record["content_hash"])
+                column_text = await target.write(record["content_hash"], text)
+                await conn.execute(
+                    "UPDATE datasets SET text = $2, storage = $3 WHERE id = $1",
+                    record["id"],
+                    column_text,
+                    target.name,
+                )
+                await _release_text(conn, record["storage"], record["content_hash"])
+            moved += 1
+
+
+async def search(
+    conn: asyncpg.Connection,
+    project_id: uuid.UUID,
+    query: str,
+    limit: int,
+    offset: int = 0,
+) -> list[DatasetSearchHit]:
+    """
+    Full-text searches the datasets of a project, best matches first.
+
+    query uses the websearch syntax, e.g. quoted phrases, "or" and "-word".
+    Only SEARCH_CANDIDATES matches are ranked, and only the texts of the
+    returned page are read.
+    """
+    records: list[asyncpg.Record] = await conn.fetch(
+        "WITH candidates AS ("
+        "SELECT id, search_vector FROM datasets "
+        "WHERE project_id = $1 "
+        "AND search_vector @@ websearch_to_tsquery('simple', $2) AND NOT deleted "
+        "LIMIT $5), "
+        "ranked AS ("
+        "SELECT id, ts_rank(search_vector, websearch_to_tsquery('simple', $2)) "
+        "AS rank FROM candidates "
+        "ORDER BY rank DESC, id "
+        "LIMIT $3 OFFSET $4) "
+        "SELECT datasets.id, datasets.filename, ranked.rank, "
+        "datasets.text, datasets.storage, datasets.content_hash "
+        "FROM ranked JOIN datasets ON datasets.id = ranked.id "
+        "ORDER BY ranked.rank DESC, ranked.id",
+        project_id,
+        query,
+        limit,
+        offset,
+        SEARCH_CANDIDATES,
+    )
+    return [
+        DatasetSearchHit(
+            id=r["id"],
+            filename=r["filename"],
+            rank=r["rank"],
+            text=await _read_text(r),
+        )
+        for r in records
+    ]
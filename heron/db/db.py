@@ -4,6 +4,7 @@ import asyncpg
 from fastapi import Request
 
 from heron.config import settings
+from heron.db.dataset import SEARCH_TEXT_LIMIT
 
 
 async def create_connection_pool() -> asyncpg.Pool:
@@ -23,6 +24,8 @@ async def create_connection_pool() -> asyncpg.Pool:
 async def create_tables(conn: asyncpg.Pool):
     """
     Well, this creates the tables.
+
+    Tables created by earlier versions get the columns added since then.
     """
     await conn.execute(
         "CREATE TABLE IF NOT EXISTS users ("
@@ -37,7 +40,13 @@ async def create_tables(conn: asyncpg.Pool):
         "id UUID PRIMARY KEY, "
         "owner UUID references users(id), "
         "title TEXT NOT NULL, "
-        "description TEXT NOT NULL"
+        "description TEXT NOT NULL, "
+        "labels_version BIGINT NOT NULL DEFAULT 0, "
+        "datasets_version BIGINT NOT NULL DEFAULT 0, "
+        "overlap_policy TEXT NOT NULL DEFAULT 'allow', "
+        # Datasets and labels that aren't deleted, kept by their write paths
+        "dataset_count BIGINT NOT NULL DEFAULT 0, "
+        "label_count BIGINT NOT NULL DEFAULT 0"
         ")"
     )
     await conn.execute(
@@ -46,37 +55,244 @@ async def create_tables(conn: asyncpg.Pool):
         "user_id UUID references users(id), "
         "PRIMARY KEY (project_id, user_id))"
     )
+    await conn.execute(
+        "ALTER TABLE projects "
+        "ADD COLUMN IF NOT EXISTS labels_version BIGINT NOT NULL DEFAULT 0, "
+        "ADD COLUMN IF NOT EXISTS datasets_version BIGINT NOT NULL DEFAULT 0, "
+        "ADD COLUMN IF NOT EXISTS overlap_policy TEXT NOT NULL DEFAULT 'allow'"
+    )
+    # Serves the keyset pagination of the projects of a member
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS project_members_user_id_idx "
+        "ON project_members (user_id, project_id)"
+    )
     await conn.execute(
         "CREATE TABlE IF NOT EXISTS datasets ("
         "id UUID PRIMARY KEY, "
         "project_id UUID references projects(id), "
         "filename TEXT, "
-        "text TEXT NOT NULL"
+        "text TEXT, "
+        "storage TEXT NOT NULL DEFAULT 'postgres', "
+        "search_vector TSVECTOR NOT NULL, "
+        "content_hash TEXT NOT NULL, "
+        "text_length INTEGER NOT NULL, "
+        "categories_version BIGINT NOT NULL DEFAULT 0, "
+        "tombstones_compacted_seq BIGINT NOT NULL DEFAULT 0, "
+        "deleted BOOLEAN NOT NULL DEFAULT FALSE"
         ")"
     )
+    # Texts of datasets created before storage backends were all in Postgres
+    await conn.execute(
+        "ALTER TABLE datasets ALTER COLUMN text DROP NOT NULL, "
+        "ADD COLUMN IF NOT EXISTS storage TEXT NOT NULL DEFAULT 'postgres', "
+        "ADD COLUMN IF NOT EXISTS categories_version BIGINT NOT NULL DEFAULT 0, "
+        "ADD COLUMN IF NOT EXISTS tombstones_compacted_seq BIGINT NOT NULL DEFAULT 0, "
+        "ADD COLUMN IF NOT EXISTS deleted BOOLEAN NOT NULL DEFAULT FALSE"
+    )
+    await _add_computed_column(
+        conn,
+        "datasets",
+        "search_vector",
+        "TSVECTOR",
+        f"to_tsvector('simple', left(text, {SEARCH_TEXT_LIMIT}))",
+    )
+    await _add_computed_column(
+        conn,
+        "datasets",
+        "content_hash",
+        "TEXT",
+        "encode(sha256(convert_to(text, 'UTF8')), 'hex')",
+    )
+    await _add_computed_column(
+        conn, "datasets", "text_length", "INTEGER", "char_length(text)"
+    )
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS datasets_project_id_idx ON datasets (project_id)"
+    )
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS datasets_content_hash_idx "
+        "ON datasets (content_hash)"
+    )
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS datasets_search_vector_idx "
+        "ON datasets USING GIN (search_vector)"
+    )
     await conn.execute(
         "CREATE TABLE IF NOT EXISTS labels ("
         "id UUID PRIMARY KEY, "
         "project_id UUID references projects(id), "
         "name TEXT NOT NULL, "
-        "color VARCHAR(7) NOT NULL"
+        "color VARCHAR(7) NOT NULL, "
+        "parent_id UUID references labels(id) ON DELETE CASCADE, "
+        # Ids of the label ancestors and its own, each followed by a slash
+        "path TEXT NOT NULL, "
+        "version BIGINT NOT NULL DEFAULT 0, "
+        "deleted BOOLEAN NOT NULL DEFAULT FALSE"
         ")"
     )
     await conn.execute(
-        "CREATE TABLE IF NOT EXISTS categories ("
+        "ALTER TABLE labels "
+        "ADD COLUMN IF NOT EXISTS parent_id UUID "
+        "references labels(id) ON DELETE CASCADE, "
+        "ADD COLUMN IF NOT EXISTS version BIGINT NOT NULL DEFAULT 0, "
+        "ADD COLUMN IF NOT EXISTS deleted BOOLEAN NOT NULL DEFAULT FALSE"
+    )
+    # Labels created before they could be nested are all roots
+    await _add_computed_column(conn, "labels", "path", "TEXT", "id::text || '/'")
+    await _add_computed_column(
+        conn,
+        "projects",
+        "dataset_count",
+        "BIGINT",
+        "(SELECT COUNT(*) FROM datasets "
+        "WHERE datasets.project_id = projects.id AND NOT datasets.deleted)",
+    )
+    await _add_computed_column(
+        conn,
+        "projects",
+        "label_count",
+        "BIGINT",
+        "(SELECT COUNT(*) FROM labels "
+        "WHERE labels.project_id = projects.id AND NOT labels.deleted)",
+    )
+    # Serves the labels of a project and their subtrees as path prefixes
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS labels_project_path_idx "
+        "ON labels (project_id, path text_pattern_ops)"
+    )
+    # Categories reads exclude the ones of hidden labels, this keeps that cheap
+    await conn.execute(
+        "CREATE INDEX IF NOT EXISTS labels_deleted_idx ON labels (id) WHERE deleted"
+    )
+    await create_categories_table(conn, partitions=settings().category_partitions)
+    await conn.execute(
+        "CREATE TABLE IF NOT EXISTS category_tombstones ("
+        "dataset_id UUID references datasets(id) ON DELETE CASCADE, "
+        "category_id UUID NOT NULL, "
+        "seq BIGINT NOT NULL, "
+        "PRIMARY KEY (dataset_id, seq, category_id))"
+    )
+    await conn.execute(
+        "CREATE TABLE IF NOT EXISTS operations ("
         "id UUID PRIMARY KEY, "
-        "label_id UUID references labels(id) ON DELETE CASCADE, "
         "project_id UUID references projects(id), "
-        "dataset_id UUID references datasets(id) ON DELETE CASCADE, "
-        "start_offset INTEGER NOT NULL, "
-        "end_offset INTEGER NOT NULL"
+        "kind TEXT NOT NULL, "
+        "target_id UUID NOT NULL, "
+        "source_ids UUID[] NOT NULL DEFAULT '{}', "
+        "status TEXT NOT NULL, "
+        "processed BIGINT NOT NULL DEFAULT 0, "
+        "total BIGINT NOT NULL DEFAULT 0"
         ")"
     )
 
 
+async def create_categories_table(
+    conn: asyncpg.Connection, name: str = "categories", partitions: int = 0
+):
+    """
+    Creates the categories table under name and its indexes, their names
+    starting with the table one.
+
+    With partitions set the table is hash partitioned by project in that many
+    partitions, named after the table with a _p suffix and their number.
+    Queries filtering on project_id then only touch one of them, so vacuum,
+    index bloat and bulk deletes of a project stay within its partition.
+    The primary key has to include the partition key, ids are only unique
+    within a project.
+    """
+    if partitions:
+        await conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {name} ("
+            "id UUID NOT NULL, "
+            "label_id UUID references labels(id) ON DELETE CASCADE, "
+            "project_id UUID NOT NULL references projects(id), "
+            "dataset_id UUID references datasets(id) ON DELETE CASCADE, "
+            "start_offset INTEGER NOT NULL, "
+            "end_offset INTEGER NOT NULL, "
+            "seq BIGINT NOT NULL DEFAULT 0, "
+            "created_by UUID references users(id), "
+            "PRIMARY KEY (project_id, id)"
+            ") PARTITION BY HASH (project_id)"
+        )
+        for remainder in range(partitions):
+            await conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {name}_p{remainder} "
+                f"PARTITION OF {name} "
+                f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})"
+            )
+    else:
+        await conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {name} ("
+            "id UUID PRIMARY KEY, "
+            "label_id UUID references labels(id) ON DELETE CASCADE, "
+            "project_id UUID references projects(id), "
+            "dataset_id UUID references datasets(id) ON DELETE CASCADE, "
+            "start_offset INTEGER NOT NULL, "
+            "end_offset INTEGER NOT NULL, "
+            "seq BIGINT NOT NULL DEFAULT 0, "
+            "created_by UUID references users(id)"
+            ")"
+        )
+    # Categories created before changes were tracked come before any change
+    await conn.execute(
+        f"ALTER TABLE {name} "
+        "ADD COLUMN IF NOT EXISTS seq BIGINT NOT NULL DEFAULT 0, "
+        "ADD COLUMN IF NOT EXISTS created_by UUID references users(id)"
+    )
+    # Serves whole dataset reads, offset windows and keyset pagination
+    await conn.execute(
+        f"CREATE INDEX IF NOT EXISTS {name}_dataset_start_idx "
+        f"ON {name} (dataset_id, start_offset, id)"
+    )
+    # Gives the longest span of a dataset, which bounds offset windows
+    await conn.execute(
+        f"CREATE INDEX IF NOT EXISTS {name}_dataset_length_idx "
+        f"ON {name} (dataset_id, (end_offset - start_offset))"
+    )
+    await conn.execute(
+        f"CREATE INDEX IF NOT EXISTS {name}_label_id_idx ON {name} (label_id)"
+    )
+    await conn.execute(
+        f"CREATE INDEX IF NOT EXISTS {name}_dataset_seq_idx "
+        f"ON {name} (dataset_id, seq)"
+    )
+
+
+async def _add_computed_column(
+    conn: asyncpg.Pool, table: str, column: str, column_type: str, expression: str
+):
+    """
+    Adds a NOT NULL column to table if it's missing, computing it from
+    expression for the rows that already exist.
+
+    Safe to run again if it was interrupted, rows still without a value are
+    computed then.
+    """
+    not_null: bool | None = await conn.fetchval(
+        "SELECT is_nullable = 'NO' FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = $1 "
+        "AND column_name = $2",
+        table,
+        column,
+    )
+    if not_null:
+        return
+    await conn.execute(
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {column_type}"
+    )
+    await conn.execute(
+        f"UPDATE {table} SET {column} = {expression} WHERE {column} IS NULL"
+    )
+    await conn.execute(f"ALTER TABLE {table} ALTER COLUMN {column} SET NOT NULL")
+
+
 async def get_connection(request: Request) -> AsyncGenerator[asyncpg.Connection, None]:
     """
     Dependency used to get a connection from the global connection pool.
+
+    Declare it with scope="function" so the connection goes back to the pool
+    as soon as the path operation returns, streamed responses would hold it
+    until they're fully sent otherwise.
     """
     async with request.state.db_pool.acquire() as conn:
         yield conn
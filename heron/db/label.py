@@ -1,7 +1,13 @@
 import uuid
 
 import asyncpg
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+from heron.cache import VersionedLRUCache
+from heron.events import publish_label_events
+
+# Caps the labels of all projects kept by _project_labels_cache
+MAX_CACHED_LABELS = 100000
 
 
 class Label(BaseModel):
@@ -13,21 +19,72 @@ class Label(BaseModel):
     project_id: uuid.UUID
     name: str
     color: str
+    parent_id: uuid.UUID | None = None
+    # Ids of the label ancestors and its own, each followed by a slash, the
+    # labels of a subtree are the ones with its path as prefix
+    path: str = Field(default="", exclude=True)
+    # Incremented on every update, the label ETag
+    version: int = 0
+
 
+# Labels of the most recently used projects by id, per worker
+_project_labels_cache: VersionedLRUCache[uuid.UUID, dict[uuid.UUID, Label]] = (
+    VersionedLRUCache(max_entries=1024, max_size=MAX_CACHED_LABELS, sizeof=len)
+)
 
-async def create(conn: asyncpg.Connection, label: Label) -> str:
+
+def _event(op: str, label: Label | None = None, **fields) -> dict:
     """
-    Creates a new label in the database.
+    Builds the event published when a label is written, deleted labels only
+    have their id.
     """
-    return await conn.execute(
-        "INSERT INTO labels "
-        "(id, project_id, name, color) "
-        "VALUES ($1, $2, $3, $4)",
-        label.id,
-        label.project_id,
-        label.name,
-        label.color,
-    )
+    if label is not None:
+        fields = label.model_dump(
+            include={"id", "name", "color", "parent_id", "version"}
+        )
+    return {"type": "label", "op": op, "label": fields}
+
+
+async def lock_tree(conn: asyncpg.Connection, project_id: uuid.UUID):
+    """
+    Serializes changes to the label tree of a project until the current
+    transaction ends.
+    """
+    await conn.execute("SELECT 1 FROM projects WHERE id = $1 FOR UPDATE", project_id)
+
+
+async def create(conn: asyncpg.Connection, label: Label) -> bool:
+    """
+    Creates a new label in the database, under its parent if it has one.
+    Returns False if the parent isn't a label of the same project.
+    """
+    async with conn.transaction():
+        if label.parent_id is not None:
+            # So the parent can't be deleted before this commits
+            await lock_tree(conn, label.project_id)
+        status = await conn.execute(
+            "WITH inserted AS ("
+            "INSERT INTO labels "
+            "(id, project_id, name, color, parent_id, path) "
+            "SELECT $1::uuid, $2::uuid, $3, $4, $5::uuid, "
+            "COALESCE((SELECT path FROM labels WHERE id = $5), '') "
+            "|| $1::uuid::text || '/' "
+            "WHERE $5::uuid IS NULL OR EXISTS ("
+            "SELECT 1 FROM labels WHERE id = $5 AND project_id = $2 AND NOT deleted) "
+            "RETURNING project_id) "
+            "UPDATE projects SET labels_version = labels_version + 1, "
+            "label_count = label_count + 1 "
+            "WHERE id IN (SELECT project_id FROM inserted)",
+            label.id,
+            label.project_id,
+            label.name,
+            label.color,
+            label.parent_id,
+        )
+        if status == "UPDATE 0":
+            return False
+        await publish_label_events(conn, label.project_id, [_event("create", label)])
+    return True
 
 
 async def get_by_id(conn: asyncpg.Connection, label_id: uuid.UUID) -> Label | None:
@@ -35,7 +92,9 @@ async def get_by_id(conn: asyncpg.Connection, label_id: uuid.UUID) -> Label | No
     Gets a label by its id.
     """
     record: asyncpg.Record | None = await conn.fetchrow(
-        "SELECT id, project_id, name, color FROM labels WHERE id = $1", label_id
+        "SELECT id, project_id, name, color, parent_id, path, version FROM labels "
+        "WHERE id = $1 AND NOT deleted",
+        label_id,
     )
     if record is None:
         return None
@@ -50,26 +109,221 @@ async def get_by_project(
     Gets all labels for a project.
     """
     records: list[asyncpg.Record] = await conn.fetch(
-        "SELECT id, project_id, name, color FROM labels WHERE project_id = $1",
+        "SELECT id, project_id, name, color, parent_id, path, version FROM labels "
+        "WHERE project_id = $1 AND NOT deleted",
         project_id,
     )
     return [Label(**r) for r in records]
 
 
-async def update(conn: asyncpg.Connection, label: Label):
+async def get_cached_by_project(
+    conn: asyncpg.Connection, project_id: uuid.UUID, labels_version: int
+) -> dict[uuid.UUID, Label]:
     """
-    Updates a label.
+    Gets all labels for a project by id.
+    labels_version is the project current one, the labels are only read from
+    the database the first time they're asked at that version.
+    The result is shared, it must not be modified.
     """
-    await conn.execute(
-        "UPDATE labels SET name = $2, color = $3 WHERE id = $1",
-        label.id,
-        label.name,
-        label.color,
+    labels = _project_labels_cache.get(project_id, labels_version)
+    if labels is None:
+        labels = {label.id: label for label in await get_by_project(conn, project_id)}
+        # Writes committed since reading the version only make the entry
+        # stale right away
+        _project_labels_cache.put(project_id, labels_version, labels)
+    return labels
+
+
+async def get_span_counts(
+    conn: asyncpg.Connection, project_id: uuid.UUID
+) -> dict[uuid.UUID, int]:
+    """
+    Counts the categories of each label of a project, leaving out the ones of
+    deleted datasets. Labels without categories are missing.
+    """
+    records: list[asyncpg.Record] = await conn.fetch(
+        "SELECT categories.label_id, COUNT(*) AS spans FROM datasets "
+        "JOIN categories ON categories.dataset_id = datasets.id "
+        "WHERE datasets.project_id = $1 AND NOT datasets.deleted "
+        "AND categories.project_id = $1 "
+        "GROUP BY categories.label_id",
+        project_id,
+    )
+    return {r["label_id"]: r["spans"] for r in records}
+
+
+async def update(
+    conn: asyncpg.Connection,
+    project_id: uuid.UUID,
+    label_id: uuid.UUID,
+    name: str | None = None,
+    color: str | None = None,
+    version: int | None = None,
+) -> Label | None:
+    """
+    Updates a label of a project with a single statement, None leaves that
+    field unchanged.
+    If version is set the label is only updated if that's still its version.
+
+    Returns the updated label, None if it doesn't exist in the project or its
+    version changed.
+    """
+    record: asyncpg.Record | None = await conn.fetchrow(
+        "WITH updated AS ("
+        "UPDATE labels SET name = COALESCE($3, name), "
+        "color = COALESCE($4, color), version = version + 1 "
+        "WHERE id = $1 AND project_id = $2 AND NOT deleted "
+        "AND ($5::bigint IS NULL OR version = $5) "
+        "RETURNING id, project_id, name, color, parent_id, path, version), "
+        "bumped AS ("
+        "UPDATE projects SET labels_version = labels_version + 1 "
+        "WHERE id IN (SELECT project_id FROM updated)) "
+        "SELECT * FROM updated",
+        label_id,
+        project_id,
+        name,
+        color,
+        version,
     )
+    if record is None:
+        return None
+
+    label = Label(**record)
+    await publish_label_events(conn, project_id, [_event("update", label)])
+    return label
+
+
+async def move(
+    conn: asyncpg.Connection,
+    project_id: uuid.UUID,
+    label_id: uuid.UUID,
+    parent_id: uuid.UUID | None,
+) -> bool:
+    """
+    Moves a label of a project and its subtree under parent_id, to the root
+    if it's None.
+    The parent must be a label of the same project.
+
+    Must run in a transaction, moves within a project are serialized on its
+    row so two of them can't build a cycle together.
+    Returns False if nothing was moved, because the label doesn't exist or
+    the parent is in its subtree.
+    """
+    await lock_tree(conn, project_id)
+    status = await conn.execute(
+        "WITH moved AS ("
+        "SELECT path AS old_path, "
+        "COALESCE((SELECT path FROM labels WHERE id = $3), '') || id::text || '/' "
+        "AS new_path "
+        "FROM labels WHERE id = $1 AND project_id = $2 AND NOT deleted), "
+        "allowed AS ("
+        "SELECT * FROM moved WHERE NOT moved.new_path LIKE moved.old_path || '_%'), "
+        "updated AS ("
+        "UPDATE labels SET "
+        "path = moved.new_path || substr(labels.path, length(moved.old_path) + 1), "
+        "parent_id = CASE WHEN labels.id = $1 THEN $3 ELSE labels.parent_id END "
+        "FROM allowed AS moved WHERE labels.project_id = $2 "
+        "AND labels.path LIKE moved.old_path || '%' "
+        "RETURNING labels.project_id) "
+        "UPDATE projects SET labels_version = labels_version + 1 "
+        "WHERE id IN (SELECT project_id FROM updated)",
+        label_id,
+        project_id,
+        parent_id,
+    )
+    return status != "UPDATE 0"
+
+
+def subtree_counts(
+    paths: dict[uuid.UUID, str], counts: dict[uuid.UUID, int]
+) -> dict[uuid.UUID, int]:
+    """
+    Sums the counts of each label and all its descendants, labels are given
+    by id with their path.
+    """
+    totals = dict.fromkeys(paths, 0)
+    for label_id, path in paths.items():
+        count = counts.get(label_id, 0)
+        for ancestor in path.split("/")[:-1]:
+            ancestor_id = uuid.UUID(ancestor)
+            if ancestor_id in totals:
+                totals[ancestor_id] += count
+    return totals
+
+
+async def has_children(conn: asyncpg.Connection, label_id: uuid.UUID) -> bool:
+    """
+    Checks whether a label has child labels that aren't deleted.
+    """
+    return await conn.fetchval(
+        "SELECT EXISTS (SELECT 1 FROM labels WHERE parent_id = $1 AND NOT deleted)",
+        label_id,
+    )
+
+
+async def hide(
+    conn: asyncpg.Connection, project_id: uuid.UUID, label_id: uuid.UUID
+) -> bool:
+    """
+    Marks a label of a project and its categories as deleted, they're not
+    returned by any read from now on.
+    Returns False if the label doesn't exist in the project or was already
+    hidden.
+
+    The row itself is removed by delete once its categories are purged.
+    """
+    hidden = await conn.fetchval(
+        "WITH hidden AS ("
+        "UPDATE labels SET deleted = TRUE "
+        "WHERE id = $1 AND project_id = $2 AND NOT deleted "
+        "RETURNING project_id) "
+        "UPDATE projects SET labels_version = labels_version + 1, "
+        "label_count = label_count - 1 "
+        "WHERE id IN (SELECT project_id FROM hidden) "
+        "RETURNING TRUE",
+        label_id,
+        project_id,
+    )
+    if hidden:
+        await publish_label_events(conn, project_id, [_event("delete", id=label_id)])
+    return bool(hidden)
+
+
+async def restore(
+    conn: asyncpg.Connection, project_id: uuid.UUID, label_id: uuid.UUID
+) -> bool:
+    """
+    Undoes hide, the label and its categories are returned by reads again.
+    Returns False if the label doesn't exist in the project or isn't hidden.
+    """
+    record: asyncpg.Record | None = await conn.fetchrow(
+        "WITH restored AS ("
+        "UPDATE labels SET deleted = FALSE "
+        "WHERE id = $1 AND project_id = $2 AND deleted "
+        "RETURNING id, project_id, name, color, parent_id, path, version), "
+        "bumped AS ("
+        "UPDATE projects SET labels_version = labels_version + 1, "
+        "label_count = label_count + 1 "
+        "WHERE id IN (SELECT project_id FROM restored)) "
+        "SELECT * FROM restored",
+        label_id,
+        project_id,
+    )
+    if record is None:
+        return False
+    await publish_label_events(conn, project_id, [_event("create", Label(**record))])
+    return True
 
 
 async def delete(conn: asyncpg.Connection, label_id: uuid.UUID):
     """
     Deletes a label from the database.
     """
-    await conn.execute("DELETE FROM labels WHERE id = $1", label_id)
+    await conn.execute(
+        "WITH deleted AS ("
+        "DELETE FROM labels WHERE id = $1 RETURNING project_id, deleted) "
+        "UPDATE projects SET labels_version = labels_version + 1, "
+        "label_count = label_count - (SELECT COUNT(*) FROM deleted WHERE NOT deleted) "
+        "WHERE id IN (SELECT project_id FROM deleted)",
+        label_id,
+    )
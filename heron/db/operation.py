@@ -0,0 +1,139 @@
+import uuid
+
+import asyncpg
+from pydantic import BaseModel
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class Operation(BaseModel):
+    """
+    Represents a long running operation executed in the background.
+    """
+
+    id: uuid.UUID
+    project_id: uuid.UUID
+    kind: str
+    target_id: uuid.UUID
+    # What the operation reads from, like the labels merged into target_id
+    source_ids: list[uuid.UUID] = []
+    status: str
+    processed: int
+    total: int
+
+
+async def create(conn: asyncpg.Connection, operation: Operation):
+    """
+    Creates a new operation.
+    """
+    await conn.execute(
+        "INSERT INTO operations "
+        "(id, project_id, kind, target_id, source_ids, status, processed, total) "
+        "VALUES ($1, $2, $3, $4, $5, $6, $7, $8)",
+        operation.id,
+        operation.project_id,
+        operation.kind,
+        operation.target_id,
+        operation.source_ids,
+        operation.status,
+        operation.processed,
+        operation.total,
+    )
+
+
+async def get_by_id(
+    conn: asyncpg.Connection, operation_id: uuid.UUID
+) -> Operation | None:
+    """
+    Gets an operation by its id.
+    """
+    record: asyncpg.Record | None = await conn.fetchrow(
+        "SELECT id, project_id, kind, target_id, source_ids, status, processed, total "
+        "FROM operations WHERE id = $1",
+        operation_id,
+    )
+    if record is None:
+        return None
+    return Operation(**record)
+
+
+async def get_unfinished(conn: asyncpg.Connection, kinds: list[str]) -> list[Operation]:
+    """
+    Gets all operations of the given kinds that never completed.
+    """
+    records: list[asyncpg.Record] = await conn.fetch(
+        "SELECT id, project_id, kind, target_id, source_ids, status, processed, total "
+        "FROM operations WHERE kind = ANY($1) AND status IN ($2, $3)",
+        kinds,
+        PENDING,
+        RUNNING,
+    )
+    return [Operation(**r) for r in records]
+
+
+async def try_lock(conn: asyncpg.Connection, operation_id: uuid.UUID) -> bool:
+    """
+    Takes a session lock on an operation unless another connection holds it.
+    It's released by unlock or when the connection closes, so the lock of a
+    worker that died doesn't outlive it.
+    """
+    return await conn.fetchval(
+        "SELECT pg_try_advisory_lock(hashtextextended($1::uuid::text, 0))", operation_id
+    )
+
+
+async def unlock(conn: asyncpg.Connection, operation_id: uuid.UUID):
+    """
+    Releases the lock taken by try_lock.
+    """
+    await conn.execute(
+        "SELECT pg_advisory_unlock(hashtextextended($1::uuid::text, 0))", operation_id
+    )
+
+
+async def claim(conn: asyncpg.Connection, operation_id: uuid.UUID) -> bool:
+    """
+    Marks an unfinished operation as running, returns False if it already
+    completed.
+    """
+    claimed = await conn.fetchval(
+        "UPDATE operations SET status = $2 "
+        "WHERE id = $1 AND status IN ($3, $2) RETURNING id",
+        operation_id,
+        RUNNING,
+        PENDING,
+    )
+    return claimed is not None
+
+
+async def update_status(conn: asyncpg.Connection, operation_id: uuid.UUID, status: str):
+    """
+    Updates the status of an operation.
+    """
+    await conn.execute(
+        "UPDATE operations SET status = $2 WHERE id = $1", operation_id, status
+    )
+
+
+async def add_progress(
+    conn: asyncpg.Connection,
+    operation_id: uuid.UUID,
+    processed: int,
+    remaining: int | None = None,
+):
+    """
+    Adds processed to the items processed by an operation.
+    If remaining is set the total becomes the items processed so far plus
+    remaining, so resumed operations keep a consistent total.
+    """
+    await conn.execute(
+        "UPDATE operations "
+        "SET processed = processed + $2, total = COALESCE(processed + $3, total) "
+        "WHERE id = $1",
+        operation_id,
+        processed,
+        remaining,
+    )
@@ -1,7 +1,12 @@
 import uuid
+from typing import Literal
 
 import asyncpg
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+
+from heron.db.label import subtree_counts
+
+OverlapPolicy = Literal["allow", "forbid_same_label", "forbid_any"]
 
 
 class Project(BaseModel):
@@ -14,34 +19,64 @@ class Project(BaseModel):
     members: list[uuid.UUID]
     title: str
     description: str
+    overlap_policy: OverlapPolicy = "allow"
+    # Lets label reads be validated against caches, not sent to clients
+    labels_version: int = Field(default=0, exclude=True)
 
 
 async def create(conn: asyncpg.Connection, project: Project):
     """
-    Creates a new project and all members relationships including the owner.
+    Creates a new project and all members relationships including the owner,
+    all or nothing.
     """
-    await conn.execute(
-        "INSERT INTO projects "
-        "(id, owner, title, description) "
-        "VALUES ($1, $2, $3, $4)",
-        project.id,
-        project.owner,
-        project.title,
-        project.description,
-    )
-    # TODO: Delete project if membership transaction fails
     async with conn.transaction():
         await conn.execute(
-            "INSERT INTO project_members (project_id, user_id) VALUES ($1, $2)",
+            "INSERT INTO projects "
+            "(id, owner, title, description, overlap_policy) "
+            "VALUES ($1, $2, $3, $4, $5)",
             project.id,
             project.owner,
+            project.title,
+            project.description,
+            project.overlap_policy,
         )
-        await conn.executemany(
-            "INSERT INTO project_members (project_id, user_id) VALUES ($1, $2)",
-            [(project.id, member) for member in project.members],
+        await conn.execute(
+            "INSERT INTO project_members (project_id, user_id) "
+            "SELECT $1, user_id FROM unnest($2::uuid[]) AS user_id "
+            "ON CONFLICT DO NOTHING",
+            project.id,
+            [project.owner, *project.members],
         )
 
 
+async def set_members(
+    conn: asyncpg.Connection, project_id: uuid.UUID, members: list[uuid.UUID]
+) -> tuple[int, int]:
+    """
+    Makes members the members of a project with a single statement, only
+    the missing relationships are added and the extra ones removed.
+    Returns how many members were added and removed.
+    """
+    record: asyncpg.Record = await conn.fetchrow(
+        "WITH removed AS ("
+        "DELETE FROM project_members "
+        "WHERE project_id = $1 AND user_id <> ALL($2::uuid[]) "
+        "RETURNING user_id), "
+        "added AS ("
+        "INSERT INTO project_members (project_id, user_id) "
+        "SELECT $1, user_id FROM unnest($2::uuid[]) AS user_id "
+        "WHERE user_id NOT IN ("
+        "SELECT user_id FROM project_members WHERE project_id = $1) "
+        "ON CONFLICT DO NOTHING "
+        "RETURNING user_id) "
+        "SELECT (SELECT COUNT(*) FROM added) AS added, "
+        "(SELECT COUNT(*) FROM removed) AS removed",
+        project_id,
+        members,
+    )
+    return record["added"], record["removed"]
+
+
 async def get_by_id(conn: asyncpg.Connection, project_id: uuid.UUID) -> Project | None:
     """
     Finds a project by its id. Returns None if not found.
@@ -52,11 +87,13 @@ async def get_by_id(conn: asyncpg.Connection, project_id: uuid.UUID) -> Project
         "projects.owner, "
         "projects.title, "
         "projects.description, "
+        "projects.overlap_policy, "
+        "projects.labels_version, "
         "ARRAY_AGG(project_members.user_id) as members "
         "FROM projects "
         "JOIN project_members ON projects.id = project_members.project_id "
         "WHERE project_members.project_id = $1 "
-        "GROUP BY projects.id, projects.owner, projects.title, projects.description",
+        "GROUP BY projects.id",
         project_id,
     )
     if record is not None:
@@ -64,9 +101,31 @@ async def get_by_id(conn: asyncpg.Connection, project_id: uuid.UUID) -> Project
     return None
 
 
-async def get_by_member(conn: asyncpg.Connection, user_id: uuid.UUID) -> list[Project]:
+class ProjectSummary(Project):
+    """
+    Represents a project as listed to its members, with its sizes.
+    """
+
+    member_count: int
+    datasets: int
+    labels: int
+    spans: int = 0
+    # The get_write_version of the project, for caching the spans count
+    write_version: tuple[int, int, int] = Field(default=(0, 0, 0), exclude=True)
+
+
+async def get_by_member(
+    conn: asyncpg.Connection,
+    user_id: uuid.UUID,
+    after: uuid.UUID | None = None,
+    limit: int | None = None,
+) -> list[ProjectSummary]:
     """
-    Finds all projects this user is member of.
+    Finds the projects this user is member of ordered by id, with all their
+    members and the number of their datasets and labels, as kept by their
+    write paths. Spans are left to count_spans.
+    after is the id of the last project of the previous page, to get the
+    next up to limit projects.
     """
     records: list[asyncpg.Record] = await conn.fetch(
         "SELECT "
@@ -74,14 +133,52 @@ async def get_by_member(conn: asyncpg.Connection, user_id: uuid.UUID) -> list[Pr
         "projects.owner, "
         "projects.title, "
         "projects.description, "
-        "ARRAY_AGG(project_members.user_id) as members "
-        "FROM projects "
-        "JOIN project_members ON projects.id = project_members.project_id "
+        "projects.overlap_policy, "
+        "projects.labels_version, "
+        "members.members, "
+        "CARDINALITY(members.members) AS member_count, "
+        "projects.dataset_count AS datasets, "
+        "projects.label_count AS labels, "
+        "ARRAY[projects.labels_version, projects.datasets_version, "
+        "datasets.categories_version] AS write_version "
+        "FROM project_members "
+        "JOIN projects ON projects.id = project_members.project_id "
+        "CROSS JOIN LATERAL ("
+        "SELECT ARRAY_AGG(user_id) AS members FROM project_members AS m "
+        "WHERE m.project_id = projects.id) AS members "
+        # Category writes only bump their dataset, so they don't all contend
+        # on the project row
+        "CROSS JOIN LATERAL ("
+        "SELECT COALESCE(SUM(categories_version), 0) AS categories_version "
+        "FROM datasets WHERE project_id = projects.id AND NOT deleted) AS datasets "
         "WHERE project_members.user_id = $1 "
-        "GROUP BY projects.id, projects.owner, projects.title, projects.description",
+        "AND ($2::uuid IS NULL OR project_members.project_id > $2) "
+        "ORDER BY project_members.project_id "
+        "LIMIT $3",
         user_id,
+        after,
+        limit,
     )
-    return [Project(**r) for r in records]
+    return [ProjectSummary(**r) for r in records]
+
+
+async def count_spans(
+    conn: asyncpg.Connection, project_ids: list[uuid.UUID]
+) -> dict[uuid.UUID, int]:
+    """
+    Counts the spans of each project, categories of deleted datasets or
+    labels don't count. Projects without spans are missing.
+    """
+    records: list[asyncpg.Record] = await conn.fetch(
+        "SELECT datasets.project_id, COUNT(*) AS spans FROM datasets "
+        "JOIN categories ON categories.dataset_id = datasets.id "
+        "WHERE datasets.project_id = ANY($1) AND NOT datasets.deleted "
+        "AND categories.project_id = ANY($1) "
+        "AND categories.label_id NOT IN (SELECT id FROM labels WHERE deleted) "
+        "GROUP BY datasets.project_id",
+        project_ids,
+    )
+    return {r["project_id"]: r["spans"] for r in records}
 
 
 async def update_project(conn: asyncpg.Connection, project: Project):
@@ -90,10 +187,260 @@ async def update_project(conn: asyncpg.Connection, project: Project):
     """
     await conn.execute(
         "UPDATE projects "
-        "SET owner = $2, title = $3, description = $4 "
+        "SET owner = $2, title = $3, description = $4, overlap_policy = $5 "
         "WHERE id = $1",
         project.id,
         project.owner,
         project.title,
         project.description,
+        project.overlap_policy,
+    )
+
+
+def clone_id(target_id: str, column: str) -> str:
+    """
+    Returns the SQL expression mapping the id in column to the id of its copy
+    in the project whose id is the target_id expression.
+    The same id always maps to the same copy, so cloning can be resumed.
+    """
+    return f"md5({target_id}::uuid::text || {column}::text)::uuid"
+
+
+async def clone_labels(
+    conn: asyncpg.Connection, source_id: uuid.UUID, target_id: uuid.UUID
+):
+    """
+    Copies the labels of the source project to the target one with a single
+    statement, remapping their ids, parents and paths.
+    """
+    await conn.execute(
+        "WITH inserted AS ("
+        "INSERT INTO labels (id, project_id, name, color, parent_id, path) "
+        f"SELECT {clone_id('$2', 'labels.id')}, $2, labels.name, labels.color, "
+        f"{clone_id('$2', 'labels.parent_id')}, "
+        f"(SELECT string_agg({clone_id('$2', 'ancestor.id')}::text || '/', '' "
+        "ORDER BY ancestor.position) "
+        "FROM unnest(string_to_array(rtrim(labels.path, '/'), '/')) "
+        "WITH ORDINALITY AS ancestor(id, position)) "
+        "FROM labels WHERE labels.project_id = $1 AND NOT labels.deleted "
+        "ON CONFLICT DO NOTHING RETURNING id) "
+        "UPDATE projects SET labels_version = labels_version + 1, "
+        "label_count = label_count + (SELECT COUNT(*) FROM inserted) "
+        "WHERE id = $2",
+        source_id,
+        target_id,
+    )
+
+
+async def clone_datasets(
+    conn: asyncpg.Connection,
+    source_id: uuid.UUID,
+    target_id: uuid.UUID,
+) -> list[uuid.UUID]:
+    """
+    Copies the datasets of the source project to the target one with a single
+    statement, texts are shared by content hash so they're never read.
+    The copies start without categories, category.clone_batch bumps their
+    categories version as it fills them.
+
+    Returns the ids of the source datasets.
+    """
+    records: list[asyncpg.Record] = await conn.fetch(
+        "WITH inserted AS ("
+        "INSERT INTO datasets (id, project_id, filename, text, storage, "
+        "search_vector, content_hash, text_length) "
+        f"SELECT {clone_id('$2', 'id')}, $2, filename, text, storage, "
+        "search_vector, content_hash, text_length "
+        "FROM datasets WHERE project_id = $1 AND NOT deleted "
+        "ON CONFLICT DO NOTHING RETURNING id), "
+        "bumped AS ("
+        "UPDATE projects SET datasets_version = datasets_version + 1, "
+        "dataset_count = dataset_count + (SELECT COUNT(*) FROM inserted) "
+        "WHERE id = $2) "
+        "SELECT id FROM datasets WHERE project_id = $1 AND NOT deleted",
+        source_id,
+        target_id,
+    )
+    return [r["id"] for r in records]
+
+
+class LabelStatistics(BaseModel):
+    """
+    Represents the number of spans of a label and of its subtree.
+    """
+
+    label_id: uuid.UUID
+    name: str
+    color: str
+    parent_id: uuid.UUID | None = None
+    spans: int
+    # Spans of the label and all its descendants
+    subtree_spans: int = 0
+
+
+class DatasetStatistics(BaseModel):
+    """
+    Represents the number of spans of a dataset.
+    """
+
+    dataset_id: uuid.UUID
+    filename: str | None
+    spans: int
+
+
+class SpanLengthStatistics(BaseModel):
+    """
+    Represents the distribution of span lengths in characters.
+
+    histogram maps the lower bound of power of two buckets, the lengths in
+    [bound, 2 * bound), to their number of spans.
+    """
+
+    min: int | None
+    max: int | None
+    mean: float | None
+    median: int | None
+    p90: int | None
+    p99: int | None
+    histogram: dict[int, int]
+
+
+class ProjectStatistics(BaseModel):
+    """
+    Represents annotation statistics of a project.
+    """
+
+    spans: int
+    datasets: int
+    annotated_datasets: int
+    unannotated_datasets: int
+    labels: list[LabelStatistics]
+    datasets_spans: list[DatasetStatistics]
+    span_lengths: SpanLengthStatistics
+
+
+async def get_write_version(
+    conn: asyncpg.Connection, project_id: uuid.UUID
+) -> tuple[int, int, int] | None:
+    """
+    Gets a version of everything annotated in a project, it changes whenever
+    a dataset, label or category of the project is written.
+
+    Categories versions only grow, their sum can't come back to a previous
+    value unless the datasets change, which bumps datasets_version.
+    """
+    record: asyncpg.Record | None = await conn.fetchrow(
+        "SELECT projects.labels_version, projects.datasets_version, "
+        "(SELECT COALESCE(SUM(categories_version), 0) FROM datasets "
+        "WHERE project_id = projects.id AND NOT deleted) AS categories_version "
+        "FROM projects WHERE id = $1",
+        project_id,
+    )
+    if record is None:
+        return None
+    return (
+        record["labels_version"],
+        record["datasets_version"],
+        record["categories_version"],
+    )
+
+
+async def get_statistics(
+    conn: asyncpg.Connection, project_id: uuid.UUID
+) -> ProjectStatistics:
+    """
+    Computes the annotation statistics of a project, every aggregate runs in
+    Postgres. Categories of deleted datasets or labels don't count.
+    """
+    # Categories are reached through their dataset to use the
+    # (dataset_id, start_offset, id) index
+    visible_categories = (
+        "SELECT categories.* FROM datasets "
+        "JOIN categories ON categories.dataset_id = datasets.id "
+        "WHERE datasets.project_id = $1 AND NOT datasets.deleted "
+        "AND categories.project_id = $1 "
+        "AND categories.label_id NOT IN (SELECT id FROM labels WHERE deleted)"
+    )
+    async with conn.transaction(isolation="repeatable_read", readonly=True):
+        datasets: list[asyncpg.Record] = await conn.fetch(
+            "SELECT datasets.id AS dataset_id, datasets.filename, "
+            "COUNT(categories.id) AS spans "
+            "FROM datasets LEFT JOIN categories "
+            "ON categories.dataset_id = datasets.id "
+            "AND categories.project_id = $1 "
+            "AND categories.label_id NOT IN (SELECT id FROM labels WHERE deleted) "
+            "WHERE datasets.project_id = $1 AND NOT datasets.deleted "
+            "GROUP BY datasets.id ORDER BY datasets.filename, datasets.id",
+            project_id,
+        )
+        labels: list[asyncpg.Record] = await conn.fetch(
+            "SELECT labels.id AS label_id, labels.name, labels.color, "
+            "labels.parent_id, labels.path, COUNT(visible.id) AS spans "
+            f"FROM labels LEFT JOIN ({visible_categories}) AS visible "
+            "ON visible.label_id = labels.id "
+            "WHERE labels.project_id = $1 AND NOT labels.deleted "
+            "GROUP BY labels.id ORDER BY labels.name, labels.id",
+            project_id,
+        )
+        # Spans rarely have more than a few thousand distinct lengths, their
+        # distribution is derived from the count of each
+        lengths: list[asyncpg.Record] = await conn.fetch(
+            "SELECT end_offset - start_offset AS length, COUNT(*) AS spans "
+            f"FROM ({visible_categories}) AS visible "
+            "GROUP BY length ORDER BY length",
+            project_id,
+        )
+
+    subtree_spans = subtree_counts(
+        {r["label_id"]: r["path"] for r in labels},
+        {r["label_id"]: r["spans"] for r in labels},
+    )
+    annotated = sum(1 for d in datasets if d["spans"])
+    return ProjectStatistics(
+        spans=sum(d["spans"] for d in datasets),
+        datasets=len(datasets),
+        annotated_datasets=annotated,
+        unannotated_datasets=len(datasets) - annotated,
+        labels=[
+            LabelStatistics(**r, subtree_spans=subtree_spans[r["label_id"]])
+            for r in labels
+        ],
+        datasets_spans=[DatasetStatistics(**r) for r in datasets],
+        span_lengths=_span_length_statistics(
+            [(r["length"], r["spans"]) for r in lengths]
+        ),
+    )
+
+
+def _span_length_statistics(counts: list[tuple[int, int]]) -> SpanLengthStatistics:
+    """
+    Summarizes (length, number of spans) pairs sorted by length.
+    """
+    total = sum(spans for _, spans in counts)
+    if total == 0:
+        return SpanLengthStatistics(
+            min=None, max=None, mean=None, median=None, p90=None, p99=None, histogram={}
+        )
+
+    def percentile(fraction: float) -> int:
+        # Smallest length with at least fraction of the spans up to it
+        seen = 0
+        for length, spans in counts:
+            seen += spans
+            if seen >= fraction * total:
+                return length
+        return counts[-1][0]
+
+    histogram: dict[int, int] = {}
+    for length, spans in counts:
+        bucket = 1 << (max(length, 1).bit_length() - 1)
+        histogram[bucket] = histogram.get(bucket, 0) + spans
+    return SpanLengthStatistics(
+        min=counts[0][0],
+        max=counts[-1][0],
+        mean=sum(length * spans for length, spans in counts) / total,
+        median=percentile(0.5),
+        p90=percentile(0.9),
+        p99=percentile(0.99),
+        histogram=histogram,
     )
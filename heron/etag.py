@@ -0,0 +1,58 @@
+from fastapi import HTTPException, Response
+
+
+def make_etag(*parts: object) -> str:
+    """
+    Builds a strong ETag out of values that change whenever the resource does.
+    """
+    return '"' + "-".join(str(p) for p in parts) + '"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    Checks whether an If-None-Match header value matches etag.
+
+    Uses the weak comparison mandated for If-None-Match by RFC 9110.
+    """
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def not_modified(etag: str, vary: str | None = None) -> Response:
+    """
+    Returns an empty 304 response for etag, vary is the Vary header the full
+    response would have.
+    """
+    headers = {"ETag": etag}
+    if vary is not None:
+        headers["Vary"] = vary
+    return Response(status_code=304, headers=headers)
+
+
+def if_match_version(if_match: str | None) -> int | None:
+    """
+    Returns the version an If-Match header requires, for resources whose
+    ETag is make_etag of a single version number.
+    None means any version will do.
+
+    Raises a 412 HTTPException if the header can't match any such ETag.
+    """
+    if if_match is None or if_match.strip() == "*":
+        return None
+    candidate = if_match.strip()
+    # If-Match uses the strong comparison, weak ETags never match
+    if candidate.startswith('"') and candidate.endswith('"'):
+        try:
+            return int(candidate[1:-1])
+        except ValueError:
+            pass
+    raise HTTPException(status_code=412, detail="Precondition failed")
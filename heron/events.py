@@ -0,0 +1,195 @@
+"""
+Real-time annotation events.
+
+Write paths publish events with Postgres NOTIFY, so they're delivered once
+the writing transaction commits and reach every app worker. Each worker runs
+a single EventBroker that LISTENs on one connection and fans events out to
+its local subscribers.
+"""
+
+import asyncio
+import json
+import uuid
+from logging import getLogger
+
+import asyncpg
+
+logger = getLogger(__name__)
+
+CHANNEL = "heron_events"
+# NOTIFY payloads must be shorter than 8000 bytes
+MAX_PAYLOAD_SIZE = 7900
+# Writes touching more categories publish a single sync event instead, telling
+# subscribers to catch up through the changes endpoint
+MAX_CATEGORY_EVENTS = 100
+# Events buffered for a subscriber before it's considered too slow and evicted
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+
+async def _publish(conn: asyncpg.Connection, target: dict, events: list[dict]):
+    """
+    Sends events to target in as few notifications as the payload size allows.
+    """
+    base_size = len(json.dumps({**target, "events": []}, default=str))
+    chunk: list[str] = []
+    size = base_size
+    for event in events:
+        encoded = json.dumps(event, default=str)
+        if chunk and size + len(encoded) + 1 > MAX_PAYLOAD_SIZE:
+            await _notify(conn, target, chunk)
+            chunk = []
+            size = base_size
+        chunk.append(encoded)
+        size += len(encoded) + 1
+    if chunk:
+        await _notify(conn, target, chunk)
+
+
+async def _notify(conn: asyncpg.Connection, target: dict, encoded_events: list[str]):
+    payload = json.dumps(target, default=str)[:-1]
+    payload += ', "events": [' + ",".join(encoded_events) + "]}"
+    await conn.execute("SELECT pg_notify($1, $2)", CHANNEL, payload)
+
+
+async def publish_category_events(
+    conn: asyncpg.Connection, dataset_id: uuid.UUID, events: list[dict]
+):
+    """
+    Publishes events about the categories of a dataset, or a single sync event
+    if there are more than MAX_CATEGORY_EVENTS.
+    """
+    if len(events) > MAX_CATEGORY_EVENTS:
+        seq = max(event["seq"] for event in events)
+        events = [{"type": "category", "op": "sync", "seq": seq}]
+    await _publish(conn, {"dataset_id": dataset_id}, events)
+
+
+async def publish_label_events(
+    conn: asyncpg.Connection, project_id: uuid.UUID, events: list[dict]
+):
+    """
+    Publishes events about the labels of a project.
+    """
+    await _publish(conn, {"project_id": project_id}, events)
+
+
+class Subscription:
+    """
+    Receives the events of a dataset and of its project labels.
+    """
+
+    def __init__(self, project_id: uuid.UUID, dataset_id: uuid.UUID, queue_size: int):
+        self.project_id = project_id
+        self.dataset_id = dataset_id
+        self._queue: asyncio.Queue[dict | None] = asyncio.Queue(queue_size)
+
+    async def get(self) -> dict | None:
+        """
+        Waits for the next event, returns None once the subscription has been
+        evicted. Evicted subscribers might have missed events.
+        """
+        return await self._queue.get()
+
+
+class EventBroker:
+    """
+    Shares a single LISTEN connection among all the subscribers of a worker.
+    """
+
+    def __init__(self, pool: asyncpg.Pool, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        self._pool = pool
+        self._queue_size = queue_size
+        self._conn: asyncpg.Connection | None = None
+        self._lock = asyncio.Lock()
+        self._by_dataset: dict[uuid.UUID, set[Subscription]] = {}
+        self._by_project: dict[uuid.UUID, set[Subscription]] = {}
+
+    async def start(self):
+        """
+        Starts listening, before requests hold the pool connections.
+        """
+        await self._listen()
+
+    async def subscribe(
+        self, project_id: uuid.UUID, dataset_id: uuid.UUID
+    ) -> Subscription:
+        """
+        Subscribes to the events of a dataset, starts listening if needed.
+        """
+        await self._listen()
+        subscription = Subscription(project_id, dataset_id, self._queue_size)
+        self._by_dataset.setdefault(dataset_id, set()).add(subscription)
+        self._by_project.setdefault(project_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        """
+        Stops delivering events to subscription.
+        """
+        for registry, key in (
+            (self._by_dataset, subscription.dataset_id),
+            (self._by_project, subscription.project_id),
+        ):
+            subscriptions = registry.get(key)
+            if subscriptions is None:
+                continue
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del registry[key]
+
+    async def close(self):
+        """
+        Stops listening and evicts every subscriber.
+        """
+        async with self._lock:
+            if self._conn is not None:
+                conn, self._conn = self._conn, None
+                await conn.remove_listener(CHANNEL, self._dispatch)
+                await self._pool.release(conn)
+        self._evict_all()
+
+    async def _listen(self):
+        async with self._lock:
+            if self._conn is not None:
+                return
+            conn = await self._pool.acquire()
+            conn.add_termination_listener(self._on_termination)
+            await conn.add_listener(CHANNEL, self._dispatch)
+            self._conn = conn
+
+    def _on_termination(self, conn: asyncpg.Connection):
+        # Events sent while reconnecting would be lost, evicting tells
+        # subscribers to resynchronize
+        logger.warning("Events listener connection lost")
+        self._conn = None
+        asyncio.get_running_loop().create_task(self._pool.release(conn))
+        self._evict_all()
+
+    def _dispatch(self, conn: asyncpg.Connection, pid: int, channel: str, payload: str):
+        notification = json.loads(payload)
+        if "dataset_id" in notification:
+            key = uuid.UUID(notification["dataset_id"])
+            subscriptions = self._by_dataset.get(key, set())
+        else:
+            key = uuid.UUID(notification["project_id"])
+            subscriptions = self._by_project.get(key, set())
+
+        for subscription in list(subscriptions):
+            for event in notification["events"]:
+                try:
+                    subscription._queue.put_nowait(event)
+                except asyncio.QueueFull:
+                    self._evict(subscription)
+                    break
+
+    def _evict(self, subscription: Subscription):
+        self.unsubscribe(subscription)
+        # Drop what's buffered so the eviction is seen right away
+        while not subscription._queue.empty():
+            subscription._queue.get_nowait()
+        subscription._queue.put_nowait(None)
+
+    def _evict_all(self):
+        for subscriptions in list(self._by_dataset.values()):
+            for subscription in list(subscriptions):
+                self._evict(subscription)
@@ -0,0 +1,123 @@
+"""
+Formats annotated datasets for training NLP models.
+
+Each formatter turns a single dataset into a chunk of the export, so exports
+can be streamed one dataset at a time.
+"""
+
+import json
+import re
+import zlib
+from collections.abc import AsyncIterator, Callable
+from typing import Literal
+
+from heron.db.dataset import AnnotatedDataset
+
+ExportFormat = Literal["jsonl", "conll", "spacy"]
+
+# Words and single punctuation marks, close to what most tokenizers produce
+TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+
+def to_jsonl(dataset: AnnotatedDataset) -> str:
+    """
+    One JSON object per dataset with its text and spans.
+    """
+    record = {
+        "id": str(dataset.id),
+        "filename": dataset.filename,
+        "text": dataset.text,
+        "spans": [
+            {"start": start, "end": end, "label": label}
+            for start, end, label in dataset.spans
+        ],
+    }
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def to_spacy(dataset: AnnotatedDataset) -> str:
+    """
+    One JSON object per dataset shaped like spaCy Doc.to_json, spans are in
+    the "sc" span group since they may overlap.
+    """
+    record = {
+        "text": dataset.text,
+        "spans": {
+            "sc": [
+                {"start": start, "end": end, "label": label}
+                for start, end, label in dataset.spans
+            ]
+        },
+        "user_data": {"id": str(dataset.id), "filename": dataset.filename},
+    }
+    return json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def to_conll(dataset: AnnotatedDataset) -> str:
+    """
+    One token and its BIO tag per line, sentences split on line breaks and
+    documents starting with a -DOCSTART- line.
+
+    BIO can't represent overlapping spans, a token belongs to the span that
+    started first and the spans it hides are cut or dropped.
+    """
+    text = dataset.text
+    spans = dataset.spans
+    lines = [f"-DOCSTART-\tO\t{dataset.id}", ""]
+    current: tuple[int, int, str] | None = None
+    next_span = 0
+    previous_end = 0
+    for match in TOKEN_RE.finditer(text):
+        start, end = match.span()
+        if "\n" in text[previous_end:start] and lines[-1] != "":
+            lines.append("")
+        previous_end = end
+
+        if current is not None and start >= current[1]:
+            current = None
+        if current is not None:
+            tag = f"I-{current[2]}"
+        else:
+            # Spans ending before this token were hidden by the previous one
+            while next_span < len(spans) and spans[next_span][1] <= start:
+                next_span += 1
+            if next_span < len(spans) and spans[next_span][0] < end:
+                current = spans[next_span]
+                next_span += 1
+                tag = f"B-{current[2]}"
+            else:
+                tag = "O"
+        lines.append(f"{match.group()}\t{tag}")
+
+    if lines[-1] != "":
+        lines.append("")
+    return "\n".join(lines) + "\n"
+
+
+FORMATTERS: dict[ExportFormat, Callable[[AnnotatedDataset], str]] = {
+    "jsonl": to_jsonl,
+    "conll": to_conll,
+    "spacy": to_spacy,
+}
+
+
+async def encode(
+    datasets: AsyncIterator[AnnotatedDataset],
+    export_format: ExportFormat,
+    compress: bool = False,
+) -> AsyncIterator[bytes]:
+    """
+    Formats and encodes datasets one at a time, gzip compressed if compress
+    is set.
+    """
+    formatter = FORMATTERS[export_format]
+    # wbits 31 writes a gzip header and trailer
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    async for dataset in datasets:
+        chunk = formatter(dataset).encode("utf-8")
+        if compressor is not None:
+            chunk = compressor.compress(chunk)
+        if chunk:
+            yield chunk
+    if compressor is not None:
+        yield compressor.flush()
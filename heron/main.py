@@ -1,18 +1,47 @@
+import asyncio
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 
+from heron import tasks
+from heron.config import settings
 from heron.db import create_connection_pool, create_tables
-from heron.routers import category, dataset, label, project, user
+from heron.events import EventBroker
+from heron.routers import (
+    category,
+    dataset,
+    event,
+    export,
+    label,
+    operation,
+    project,
+    user,
+)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     connection_pool = await create_connection_pool()
     await create_tables(connection_pool)
+    resumed_operations = asyncio.create_task(tasks.resume_operations(connection_pool))
+    compaction = asyncio.create_task(
+        tasks.schedule_tombstone_compaction(
+            connection_pool,
+            settings().tombstone_retention,
+            settings().tombstone_compaction_interval,
+        )
+    )
+    event_broker = EventBroker(connection_pool)
+    # Requests holding every pool connection would otherwise wait forever on
+    # the first subscription
+    await event_broker.start()
     yield {
         "db_pool": connection_pool,
+        "event_broker": event_broker,
     }
+    resumed_operations.cancel()
+    compaction.cancel()
+    await event_broker.close()
     await connection_pool.close()
 
 
@@ -23,3 +52,6 @@ app.include_router(user.router)
 app.include_router(dataset.router)
 app.include_router(label.router)
 app.include_router(category.router)
+app.include_router(operation.router)
+app.include_router(event.router)
+app.include_router(export.router)
@@ -0,0 +1,77 @@
+"""
+Maintenance commands that move existing data around.
+
+Run with python -m heron.migrate <command>, see --help for the commands.
+"""
+
+import argparse
+import asyncio
+
+from heron.db import category as db_category
+from heron.db import create_connection_pool
+from heron.db import dataset as db_dataset
+from heron.storage import get_storage
+
+
+async def migrate_storage(target: str, batch_size: int):
+    """
+    Moves every dataset text into the target storage backend.
+    """
+    pool = await create_connection_pool()
+    try:
+        async with pool.acquire() as conn:
+            moved = await db_dataset.migrate_storage(
+                conn, get_storage(target), batch_size
+            )
+    finally:
+        await pool.close()
+    print(f"Moved {moved} datasets to {target} storage")
+
+
+async def partition_categories(partitions: int, batch_size: int):
+    """
+    Moves the categories into a table hash partitioned by project.
+    """
+    pool = await create_connection_pool()
+    try:
+        async with pool.acquire() as conn:
+            if await db_category.is_partitioned(conn):
+                print("Categories are already partitioned")
+                return
+            copied = await db_category.partition_table(conn, partitions, batch_size)
+    finally:
+        await pool.close()
+    print(
+        f"Moved {copied} categories to {partitions} partitions, "
+        "drop categories_unpartitioned once everything checks out"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m heron.migrate")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    storage = commands.add_parser(
+        "storage", help="Move datasets text to another storage backend"
+    )
+    storage.add_argument("target", choices=["postgres", "filesystem"])
+    storage.add_argument("--batch-size", type=int, default=100)
+
+    partition = commands.add_parser(
+        "partition-categories",
+        help="Hash partition the categories table by project, "
+        "set CATEGORY_PARTITIONS to the same number. Unvalidated at scale, "
+        "benchmark it first",
+    )
+    partition.add_argument("partitions", type=int)
+    partition.add_argument("--batch-size", type=int, default=10000)
+
+    args = parser.parse_args()
+    if args.command == "storage":
+        asyncio.run(migrate_storage(args.target, args.batch_size))
+    elif args.command == "partition-categories":
+        asyncio.run(partition_categories(args.partitions, args.batch_size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Overlapping spans detection.
+
+Both the sweep line and SpanIndex rely on the same property the categories
+window query does: spans overlapping [start, end) start in
+[start - longest span length, end), so sorting by start is enough.
+"""
+
+import bisect
+import heapq
+import uuid
+from collections.abc import Iterable, Iterator
+
+from heron.db.category import Category
+from heron.db.project import OverlapPolicy
+
+
+def violates(policy: OverlapPolicy, label_id: uuid.UUID, other_label_id: uuid.UUID):
+    """
+    Returns whether two overlapping spans with these labels break policy.
+    """
+    if policy == "forbid_any":
+        return True
+    if policy == "forbid_same_label":
+        return label_id == other_label_id
+    return False
+
+
+def find_overlaps(
+    categories: Iterable[Category],
+) -> Iterator[tuple[Category, Category]]:
+    """
+    Yields every pair of overlapping categories, categories must be sorted by
+    start offset. Pairs come in the order their second category starts.
+
+    Sweeps the spans keeping the ones still open in a heap ordered by end
+    offset, runs in O(n log n + k) for k overlapping pairs.
+    """
+    active: list[tuple[int, int, Category]] = []
+    for index, category in enumerate(categories):
+        while active and active[0][0] <= category.start_offset:
+            heapq.heappop(active)
+        for _, _, other in active:
+            yield other, category
+        # The index breaks ties so categories are never compared
+        heapq.heappush(active, (category.end_offset, index, category))
+
+
+def _key(category: Category) -> tuple[int, uuid.UUID]:
+    return category.start_offset, category.id
+
+
+# Adding a category shifts at most this many others
+_BUCKET_SIZE = 1000
+
+
+class SpanIndex:
+    """
+    Categories kept sorted by start offset to find the ones overlapping a
+    range in O(log n + m), used to check spans not written yet.
+
+    The sorted categories are split in buckets split again once they double
+    in size, so adding one costs O(log n) plus shifting its bucket instead
+    of shifting up to all of them.
+    """
+
+    def __init__(self, categories: Iterable[Category] = ()):
+        ordered = sorted(categories, key=_key)
+        self._buckets: list[list[Category]] = [
+            ordered[i : i + _BUCKET_SIZE] for i in range(0, len(ordered), _BUCKET_SIZE)
+        ]
+        self._keys = [[_key(c) for c in bucket] for bucket in self._buckets]
+        # Last key of each bucket
+        self._maxes = [keys[-1] for keys in self._keys]
+        self._max_length = max(
+            (c.end_offset - c.start_offset for c in ordered), default=0
+        )
+
+    def add(self, category: Category):
+        key = _key(category)
+        self._max_length = max(
+            self._max_length, category.end_offset - category.start_offset
+        )
+        if not self._buckets:
+            self._buckets.append([category])
+            self._keys.append([key])
+            self._maxes.append(key)
+            return
+
+        i = min(bisect.bisect_left(self._maxes, key), len(self._maxes) - 1)
+        bucket, keys = self._buckets[i], self._keys[i]
+        index = bisect.bisect(keys, key)
+        keys.insert(index, key)
+        bucket.insert(index, category)
+        self._maxes[i] = keys[-1]
+        if len(keys) >= 2 * _BUCKET_SIZE:
+            self._buckets[i : i + 1] = [bucket[:_BUCKET_SIZE], bucket[_BUCKET_SIZE:]]
+            self._keys[i : i + 1] = [keys[:_BUCKET_SIZE], keys[_BUCKET_SIZE:]]
+            self._maxes[i : i + 1] = [keys[_BUCKET_SIZE - 1], keys[-1]]
+
+    def overlapping(self, start: int, end: int) -> list[Category]:
+        """
+        Returns the categories overlapping [start, end), sorted by start offset.
+        """
+        low = (start - self._max_length,)
+        high = (end,)
+        found: list[Category] = []
+        for i in range(bisect.bisect_left(self._maxes, low), len(self._maxes)):
+            keys = self._keys[i]
+            if keys[0] >= high:
+                break
+            found.extend(
+                c
+                for c in self._buckets[i][
+                    bisect.bisect_left(keys, low) : bisect.bisect_left(keys, high)
+                ]
+                if c.end_offset > start
+            )
+        return found
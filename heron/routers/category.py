@@ -1,21 +1,47 @@
+import gzip
 import uuid
-from typing import Annotated
+from collections.abc import AsyncIterator
+from functools import lru_cache
+from typing import Annotated, Literal
 
 import asyncpg
-from fastapi import APIRouter, Depends, HTTPException
-from pydantic import BaseModel
-
+from fastapi import (
+    APIRouter,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    UploadFile,
+)
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, TypeAdapter, ValidationError
+
+from heron.cache import VersionedLRUCache
+from heron.columnar import MSGPACK_MEDIA_TYPE, encode_categories
+from heron.config import settings
 from heron.db import category as db_category
 from heron.db import dataset as db_dataset
 from heron.db import label as db_label
 from heron.db import project as db_project
 from heron.db import user as db_user
 from heron.db.db import get_connection
+from heron.etag import etag_matches, if_match_version, make_etag, not_modified
+from heron.overlap import SpanIndex, find_overlaps, violates
 
 from .user import get_current_user
 
 router = APIRouter()
 
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+# Imported categories are written in COPY batches of this size
+IMPORT_BATCH_SIZE = 10000
+# Caps the errors listed in an import report, all of them are counted
+MAX_IMPORT_ERRORS = 1000
+
+_categories_adapter = TypeAdapter(list[db_category.Category])
+
 
 class CategoryCreateIn(BaseModel):
     label_id: uuid.UUID
@@ -30,11 +56,158 @@ class CategoryUpdateIn(BaseModel):
     end_offset: int | None = None
 
 
+class CategoryBatchOperationIn(BaseModel):
+    op: Literal["create", "update", "delete"]
+    id: uuid.UUID | None = None
+    label_id: uuid.UUID | None = None
+    start_offset: int | None = None
+    end_offset: int | None = None
+
+
+class CategoryBatchIn(BaseModel):
+    operations: list[CategoryBatchOperationIn]
+
+
+class CategoryBatchResult(BaseModel):
+    status: Literal["ok", "error"]
+    id: uuid.UUID | None = None
+    detail: str | None = None
+
+
+class CategoryImportRow(BaseModel):
+    dataset_id: uuid.UUID | None = None
+    filename: str | None = None
+    label: str
+    start: int
+    end: int
+
+
+class CategoryImportError(BaseModel):
+    line: int
+    detail: str
+
+
+class CategoryImportResult(BaseModel):
+    dry_run: bool
+    imported: int
+    error_count: int
+    errors: list[CategoryImportError]
+
+
+@lru_cache()
+def _snapshot_cache() -> (
+    VersionedLRUCache[tuple[uuid.UUID, uuid.UUID, bool, bool], bytes]
+):
+    """
+    Encoded listings of the most recently read datasets, per worker.
+    Created on first use, importing the module doesn't need the settings.
+    """
+    return VersionedLRUCache(
+        max_entries=1024, max_size=settings().category_cache_size, sizeof=len
+    )
+
+
+def _parse_cursor(cursor: str) -> tuple[int, uuid.UUID]:
+    """
+    Parses a pagination cursor made by _make_cursor.
+    """
+    try:
+        start_offset, category_id = cursor.split(":", 1)
+        return int(start_offset), uuid.UUID(category_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _make_cursor(category: db_category.Category) -> str:
+    """
+    Makes the cursor of the page following category.
+    """
+    return f"{category.start_offset}:{category.id}"
+
+
+def _offsets_error(start_offset: int, end_offset: int, text_length: int) -> str | None:
+    """
+    Returns why the offsets don't delimit a span of the text, None if they do.
+    """
+    if start_offset < 0 or start_offset >= end_offset:
+        return "start_offset must be positive and lower than end_offset"
+    if end_offset > text_length:
+        return "Offsets out of the dataset text"
+    return None
+
+
+async def _iter_lines(file: UploadFile) -> AsyncIterator[bytes]:
+    """
+    Yields the lines of an uploaded file without reading it all in memory.
+    """
+    remainder = b""
+    while chunk := await file.read(1 << 20):
+        lines = (remainder + chunk).split(b"\n")
+        remainder = lines.pop()
+        for line in lines:
+            yield line
+    if remainder:
+        yield remainder
+
+
+async def _find_violation(
+    conn: asyncpg.Connection,
+    policy: db_project.OverlapPolicy,
+    category: db_category.Category,
+    ignored: set[uuid.UUID] | None = None,
+    pending: SpanIndex | None = None,
+) -> db_category.Category | None:
+    """
+    Returns a category that category would overlap breaking policy.
+    Stored categories in ignored don't count, pending ones are about to be
+    written too.
+    """
+    if policy == "allow":
+        return None
+    ignored = ignored or set()
+    stored = await db_category.get_by_dataset(
+        conn,
+        category.project_id,
+        category.dataset_id,
+        category.start_offset,
+        category.end_offset,
+    )
+    candidates = [c for c in stored if c.id not in ignored]
+    if pending is not None:
+        candidates += pending.overlapping(category.start_offset, category.end_offset)
+    for other in candidates:
+        if other.id != category.id and violates(
+            policy, category.label_id, other.label_id
+        ):
+            return other
+    return None
+
+
+async def _check_overlaps(
+    conn: asyncpg.Connection,
+    policy: db_project.OverlapPolicy,
+    category: db_category.Category,
+):
+    """
+    Raises if category would overlap a stored one breaking policy.
+    Must be called in the transaction writing category, the dataset stays
+    locked until it ends.
+    """
+    if policy == "allow":
+        return
+    await db_category.lock_dataset(conn, category.dataset_id)
+    other = await _find_violation(conn, policy, category)
+    if other is not None:
+        raise HTTPException(
+            status_code=409, detail=f"Category overlaps category {other.id}"
+        )
+
+
 @router.post("/project/{project_id}/dataset/{dataset_id}/category")
 async def create_category(
     project_id: uuid.UUID,
     dataset_id: uuid.UUID,
-    conn: Annotated[asyncpg.Connection, Depends(get_connection)],
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
     current_user: Annotated[db_user.User, Depends(get_current_user)],
     category: CategoryCreateIn,
 ):
@@ -47,38 +220,377 @@ async def create_category(
         # The project exists but the current user is not a member
         raise HTTPException(status_code=404, detail="Project not found")
 
-    stored_dataset = await db_dataset.get_by_id(conn, dataset_id)
-    if stored_dataset is None:
-        # Dataset doesn't exist at all
+    stored_dataset = await db_dataset.get_metadata(conn, dataset_id)
+    if stored_dataset is None or stored_dataset.project_id != project_id:
+        # Dataset doesn't exist at all or not in this project
         raise HTTPException(status_code=404, detail="Dataset not found")
 
-    stored_label = await db_label.get_by_id(conn, category.label_id)
-    if stored_label is None:
-        # Label doesn't exist at all
+    labels = await db_label.get_cached_by_project(
+        conn, project_id, project.labels_version
+    )
+    if category.label_id not in labels:
+        # Label doesn't exist at all or not in this project
         raise HTTPException(status_code=404, detail="Label not found")
 
+    error = _offsets_error(
+        category.start_offset, category.end_offset, stored_dataset.text_length
+    )
+    if error is not None:
+        raise HTTPException(status_code=400, detail=error)
+
     category_id = uuid.uuid4()
-    await db_category.create(
-        conn,
-        db_category.Category(
-            id=category_id,
-            label_id=category.label_id,
-            project_id=project_id,
-            dataset_id=dataset_id,
-            start_offset=category.start_offset,
-            end_offset=category.end_offset,
-        ),
+    new_category = db_category.Category(
+        id=category_id,
+        label_id=category.label_id,
+        project_id=project_id,
+        dataset_id=dataset_id,
+        start_offset=category.start_offset,
+        end_offset=category.end_offset,
+        created_by=current_user.id,
     )
+    async with conn.transaction():
+        await _check_overlaps(conn, project.overlap_policy, new_category)
+        await db_category.create(conn, new_category)
     return {"category_id": category_id}
 
 
-@router.get("/project/{project_id}/dataset/{dataset_id}/category")
+@router.post("/project/{project_id}/category/import")
+async def import_categories(
+    project_id: uuid.UUID,
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
+    current_user: Annotated[db_user.User, Depends(get_current_user)],
+    file: UploadFile,
+    dry_run: bool = False,
+) -> CategoryImportResult:
+    """
+    Imports categories from a JSON lines file, each line having the dataset_id
+    or filename of the dataset, the label name and the start and end offsets.
+
+    Invalid lines are reported and skipped, the others are validated like
+    single writes and imported in a single transaction. With dry_run set
+    nothing is written.
+    """
+    project = await db_project.get_by_id(conn, project_id)
+    if project is None:
+        # Project doesn't exist at all
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    if current_user.id not in project.members:
+        # The project exists but the current user is not a member
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    if project.owner != current_user.id:
+        # Current user doesn't own this project, they can't import
+        raise HTTPException(
+            status_code=401, detail="Not enough permissions to import categories"
+        )
+
+    labels = await db_label.get_cached_by_project(
+        conn, project_id, project.labels_version
+    )
+    label_ids = {label.name: label.id for label in labels.values()}
+    datasets = await db_dataset.get_metadata_by_project(conn, project_id)
+    datasets_by_id = {d.id: d for d in datasets}
+    datasets_by_filename: dict[str, list[db_dataset.DatasetMetadata]] = {}
+    for stored_dataset in datasets:
+        if stored_dataset.filename is not None:
+            datasets_by_filename.setdefault(stored_dataset.filename, []).append(
+                stored_dataset
+            )
+
+    result = CategoryImportResult(dry_run=dry_run, imported=0, error_count=0, errors=[])
+
+    def report(line: int, detail: str):
+        result.error_count += 1
+        if len(result.errors) < MAX_IMPORT_ERRORS:
+            result.errors.append(CategoryImportError(line=line, detail=detail))
+
+    # Stored and imported spans of each dataset, only kept to enforce the
+    # overlap policy
+    indexes: dict[uuid.UUID, SpanIndex] = {}
+    batch: dict[uuid.UUID, list[db_category.Category]] = {}
+    batch_size = 0
+
+    async def write_batch():
+        nonlocal batch, batch_size
+        if not dry_run:
+            for dataset_id, categories in batch.items():
+                await db_category.create_many(conn, dataset_id, categories)
+        batch = {}
+        batch_size = 0
+
+    async with conn.transaction():
+        line_number = 0
+        async for line in _iter_lines(file):
+            line_number += 1
+            if not line.strip():
+                continue
+            try:
+                row = CategoryImportRow.model_validate_json(line)
+            except ValidationError:
+                report(line_number, "Invalid row")
+                continue
+
+            if row.dataset_id is not None:
+                dataset = datasets_by_id.get(row.dataset_id)
+            elif row.filename is not None:
+                matches = datasets_by_filename.get(row.filename, [])
+                if len(matches) > 1:
+                    report(line_number, "Ambiguous filename")
+                    continue
+                dataset = matches[0] if matches else None
+            else:
+                report(line_number, "Missing dataset_id or filename")
+                continue
+            if dataset is None:
+                report(line_number, "Dataset not found")
+                continue
+
+            label_id = label_ids.get(row.label)
+            if label_id is None:
+                report(line_number, "Label not found")
+                continue
+
+            error = _offsets_error(row.start, row.end, dataset.text_length)
+            if error is not None:
+                report(line_number, error)
+                continue
+
+            category = db_category.Category(
+                id=uuid.uuid4(),
+                label_id=label_id,
+                project_id=project_id,
+                dataset_id=dataset.id,
+                start_offset=row.start,
+                end_offset=row.end,
+                created_by=current_user.id,
+            )
+            if project.overlap_policy != "allow":
+                index = indexes.get(dataset.id)
+                if index is None:
+                    await db_category.lock_dataset(conn, dataset.id)
+                    index = indexes[dataset.id] = SpanIndex(
+                        await db_category.get_by_dataset(conn, project_id, dataset.id)
+                    )
+                other = next(
+                    (
+                        c
+                        for c in index.overlapping(row.start, row.end)
+                        if violates(project.overlap_policy, label_id, c.label_id)
+                    ),
+                    None,
+                )
+                if other is not None:
+                    report(line_number, f"Category overlaps category {other.id}")
+                    continue
+                index.add(category)
+
+            batch.setdefault(dataset.id, []).append(category)
+            batch_size += 1
+            result.imported += 1
+            if batch_size >= IMPORT_BATCH_SIZE:
+                await write_batch()
+        await write_batch()
+
+    return result
+
+
+@router.get(
+    "/project/{project_id}/dataset/{dataset_id}/category",
+    response_model=list[db_category.Category],
+)
 async def get_dataset_categories(
     project_id: uuid.UUID,
     dataset_id: uuid.UUID,
-    conn: Annotated[asyncpg.Connection, Depends(get_connection)],
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
+    current_user: Annotated[db_user.User, Depends(get_current_user)],
+    request: Request,
+    response: Response,
+    start: Annotated[int | None, Query(ge=0)] = None,
+    end: Annotated[int | None, Query(ge=0)] = None,
+    after: str | None = None,
+    limit: Annotated[int | None, Query(ge=1, le=10000)] = None,
+    accept: Annotated[str | None, Header()] = None,
+    accept_encoding: Annotated[str | None, Header()] = None,
+    if_none_match: Annotated[str | None, Header()] = None,
+) -> list[db_category.Category] | Response:
+    """
+    Returns the categories of the dataset ordered by start offset and id.
+    If start or end are set only the ones overlapping [start, end) are returned.
+
+    With limit set at most limit categories are returned, if there might be
+    more the X-Next-Cursor header holds the after value of the next page.
+    Accepting application/x-ndjson streams one category per line instead.
+    Accepting application/vnd.msgpack returns them in the compact columnar
+    encoding of heron.columnar.
+
+    Whole dataset listings are served from a cache of their encoded bytes,
+    gzip compressed for clients accepting it.
+    """
+    project = await db_project.get_by_id(conn, project_id)
+    if project is None:
+        # Project doesn't exist at all
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    if current_user.id not in project.members:
+        # The project exists but the current user is not a member
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    version = await db_category.get_version(conn, project_id, dataset_id)
+    if version is None:
+        # Dataset doesn't exist at all or not in this project
+        raise HTTPException(status_code=404, detail="Dataset not found")
+
+    ndjson = accept is not None and NDJSON_MEDIA_TYPE in accept
+    columnar = accept is not None and MSGPACK_MEDIA_TYPE in accept
+    snapshot = not ndjson and all(p is None for p in (start, end, after, limit))
+    compress = snapshot and accept_encoding is not None and "gzip" in accept_encoding
+    # Each representation of the same categories needs its own ETag, and
+    # caches have to tell them apart on every response of this URL
+    etag_parts: list[str | int] = [*version]
+    if ndjson:
+        etag_parts.append("ndjson")
+    elif columnar:
+        etag_parts.append("msgpack")
+    if compress:
+        etag_parts.append("gzip")
+    etag = make_etag(*etag_parts)
+    vary = "Accept, Accept-Encoding"
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag, vary)
+
+    if snapshot:
+        key = (project_id, dataset_id, columnar, compress)
+        body = _snapshot_cache().get(key, version)
+        if body is None:
+            categories = await db_category.get_by_dataset(conn, project_id, dataset_id)
+            if columnar:
+                body = encode_categories(project_id, dataset_id, categories)
+            else:
+                body = _categories_adapter.dump_json(categories)
+            if compress:
+                body = gzip.compress(body, compresslevel=6, mtime=0)
+            # Writes committed since reading the version only make the entry
+            # stale right away
+            _snapshot_cache().put(key, version, body)
+        headers = {"ETag": etag, "Vary": vary}
+        if compress:
+            headers["Content-Encoding"] = "gzip"
+        return Response(
+            body,
+            media_type=MSGPACK_MEDIA_TYPE if columnar else "application/json",
+            headers=headers,
+        )
+
+    after_key = _parse_cursor(after) if after is not None else None
+
+    if ndjson:
+        # conn goes back to the pool when this handler returns, the stream
+        # reads through a connection of its own for as long as it's sent
+        pool: asyncpg.Pool = request.state.db_pool
+
+        async def stream():
+            async with pool.acquire() as stream_conn:
+                async for category in db_category.iter_by_dataset(
+                    stream_conn, project_id, dataset_id, start, end, after_key, limit
+                ):
+                    yield category.model_dump_json() + "\n"
+
+        return StreamingResponse(
+            stream(), media_type=NDJSON_MEDIA_TYPE, headers={"ETag": etag, "Vary": vary}
+        )
+
+    categories = await db_category.get_by_dataset(
+        conn, project_id, dataset_id, start, end, after_key, limit
+    )
+    headers = {"ETag": etag, "Vary": vary}
+    if limit is not None and len(categories) == limit:
+        headers["X-Next-Cursor"] = _make_cursor(categories[-1])
+    if columnar:
+        return Response(
+            encode_categories(project_id, dataset_id, categories),
+            media_type=MSGPACK_MEDIA_TYPE,
+            headers=headers,
+        )
+    response.headers.update(headers)
+    return categories
+
+
+class CategoryChangesOut(BaseModel):
+    cursor: int
+    changes: list[db_category.CategoryChange]
+    resync: bool = False
+
+
+@router.get("/project/{project_id}/dataset/{dataset_id}/category/changes")
+async def get_dataset_category_changes(
+    project_id: uuid.UUID,
+    dataset_id: uuid.UUID,
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
+    current_user: Annotated[db_user.User, Depends(get_current_user)],
+    since: Annotated[int, Query(ge=0)] = 0,
+) -> CategoryChangesOut:
+    """
+    Returns the changes to the dataset categories made after the since cursor,
+    deleted categories are returned as tombstones.
+    Pass the returned cursor as since to get the following changes.
+
+    Tombstones are only kept for the latest changes, see
+    heron.tasks.compact_tombstones. For older cursors resync is set without
+    changes, clients have to reload the categories and continue from the
+    returned cursor.
+    """
+    project = await db_project.get_by_id(conn, project_id)
+    if project is None:
+        # Project doesn't exist at all
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    if current_user.id not in project.members:
+        # The project exists but the current user is not a member
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    stored_dataset = await db_dataset.get_metadata(conn, dataset_id)
+    if stored_dataset is None or stored_dataset.project_id != project_id:
+        # Dataset doesn't exist at all or not in this project
+        raise HTTPException(status_code=404, detail="Dataset not found")
+
+    changes = await db_category.get_changes(conn, project_id, dataset_id, since)
+    if changes is None:
+        version = await db_category.get_version(conn, project_id, dataset_id)
+        if version is None:
+            raise HTTPException(status_code=404, detail="Dataset not found")
+        return CategoryChangesOut(cursor=version[0], changes=[], resync=True)
+    cursor = changes[-1].seq if changes else since
+    return CategoryChangesOut(cursor=cursor, changes=changes)
+
+
+class CategoryOverlapOut(BaseModel):
+    first_id: uuid.UUID
+    second_id: uuid.UUID
+    start_offset: int
+    end_offset: int
+    same_label: bool
+    violation: bool
+
+
+class CategoryOverlapReport(BaseModel):
+    overlap_policy: db_project.OverlapPolicy
+    overlaps: list[CategoryOverlapOut]
+    violations: int
+
+
+@router.get("/project/{project_id}/dataset/{dataset_id}/category/overlaps")
+async def get_dataset_category_overlaps(
+    project_id: uuid.UUID,
+    dataset_id: uuid.UUID,
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
     current_user: Annotated[db_user.User, Depends(get_current_user)],
-) -> list[db_category.Category]:
+) -> CategoryOverlapReport:
+    """
+    Returns every pair of overlapping categories of the dataset with the range
+    they share, violations are the pairs breaking the project overlap policy.
+    Spans written before the policy was set might break it.
+    """
     project = await db_project.get_by_id(conn, project_id)
     if project is None:
         # Project doesn't exist at all
@@ -88,12 +600,27 @@ async def get_dataset_categories(
         # The project exists but the current user is not a member
         raise HTTPException(status_code=404, detail="Project not found")
 
-    stored_dataset = await db_dataset.get_by_id(conn, dataset_id)
-    if stored_dataset is None:
-        # Dataset doesn't exist at all
+    if await db_category.get_version(conn, project_id, dataset_id) is None:
+        # Dataset doesn't exist at all or not in this project
         raise HTTPException(status_code=404, detail="Dataset not found")
 
-    return await db_category.get_by_dataset(conn, dataset_id)
+    categories = await db_category.get_by_dataset(conn, project_id, dataset_id)
+    overlaps = [
+        CategoryOverlapOut(
+            first_id=first.id,
+            second_id=second.id,
+            start_offset=second.start_offset,
+            end_offset=min(first.end_offset, second.end_offset),
+            same_label=first.label_id == second.label_id,
+            violation=violates(project.overlap_policy, first.label_id, second.label_id),
+        )
+        for first, second in find_overlaps(categories)
+    ]
+    return CategoryOverlapReport(
+        overlap_policy=project.overlap_policy,
+        overlaps=overlaps,
+        violations=sum(o.violation for o in overlaps),
+    )
 
 
 @router.put("/project/{project_id}/dataset/{dataset_id}/category/{category_id}")
@@ -101,10 +628,19 @@ async def update_category(
     project_id: uuid.UUID,
     dataset_id: uuid.UUID,
     category_id: uuid.UUID,
-    conn: Annotated[asyncpg.Connection, Depends(get_connection)],
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
     current_user: Annotated[db_user.User, Depends(get_current_user)],
     category: CategoryUpdateIn,
+    response: Response,
+    if_match: Annotated[str | None, Header()] = None,
 ) -> db_category.Category:
+    """
+    Updates the fields set in the body.
+    The category ETag is the seq of its latest change, as returned here and
+    by the changes endpoint and events. With an If-Match header holding it
+    the update only happens if nobody changed the category since, otherwise
+    it fails with 412.
+    """
     project = await db_project.get_by_id(conn, project_id)
     if project is None:
         # Project doesn't exist at all
@@ -114,26 +650,50 @@ async def update_category(
         # The project exists but the current user is not a member
         raise HTTPException(status_code=404, detail="Project not found")
 
-    stored_dataset = await db_dataset.get_by_id(conn, dataset_id)
-    if stored_dataset is None:
-        # Dataset doesn't exist at all
+    stored_dataset = await db_dataset.get_metadata(conn, dataset_id)
+    if stored_dataset is None or stored_dataset.project_id != project_id:
+        # Dataset doesn't exist at all or not in this project
         raise HTTPException(status_code=404, detail="Dataset not found")
 
-    stored_category = await db_category.get_by_id(conn, category_id)
-    if stored_category is None:
-        # Category doesn't exist at all
-        raise HTTPException(status_code=404, detail="Category not found")
-
-    updated_category = db_category.Category(
-        **{
-            **stored_category.model_dump(),
-            **category.model_dump(exclude_unset=True),
-        }
-    )
-    await db_category.update(
-        conn,
-        updated_category,
+    seq = if_match_version(if_match)
+    labels = await db_label.get_cached_by_project(
+        conn, project_id, project.labels_version
     )
+    if category.label_id is not None and category.label_id not in labels:
+        raise HTTPException(status_code=404, detail="Label not found")
+
+    # The update is checked once written, failed checks roll it back
+    async with conn.transaction():
+        updated = await db_category.update(
+            conn,
+            project_id,
+            dataset_id,
+            category_id,
+            category.label_id,
+            category.start_offset,
+            category.end_offset,
+            seq,
+        )
+        if updated is None:
+            # Only failed writes pay for telling a stale seq from a missing
+            # category
+            stored_category = await db_category.get_by_id(conn, project_id, category_id)
+            if stored_category is None or stored_category.dataset_id != dataset_id:
+                # Category doesn't exist at all or not in this dataset
+                raise HTTPException(status_code=404, detail="Category not found")
+            raise HTTPException(status_code=412, detail="Category was modified")
+
+        updated_category, seq = updated
+        error = _offsets_error(
+            updated_category.start_offset,
+            updated_category.end_offset,
+            stored_dataset.text_length,
+        )
+        if error is not None:
+            raise HTTPException(status_code=400, detail=error)
+        await _check_overlaps(conn, project.overlap_policy, updated_category)
+
+    response.headers["ETag"] = make_etag(seq)
     return updated_category
 
 
@@ -142,9 +702,14 @@ async def get_category(
     project_id: uuid.UUID,
     dataset_id: uuid.UUID,
     category_id: uuid.UUID,
-    conn: Annotated[asyncpg.Connection, Depends(get_connection)],
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
     current_user: Annotated[db_user.User, Depends(get_current_user)],
+    response: Response,
 ) -> db_category.Category:
+    """
+    Returns the category, its ETag is the seq to send as If-Match to update
+    it.
+    """
     project = await db_project.get_by_id(conn, project_id)
     if project is None:
         # Project doesn't exist at all
@@ -154,15 +719,16 @@ async def get_category(
         # The project exists but the current user is not a member
         raise HTTPException(status_code=404, detail="Project not found")
 
-    stored_dataset = await db_dataset.get_by_id(conn, dataset_id)
-    if stored_dataset is None:
-        # Dataset doesn't exist at all
+    stored_dataset = await db_dataset.get_metadata(conn, dataset_id)
+    if stored_dataset is None or stored_dataset.project_id != project_id:
+        # Dataset doesn't exist at all or not in this project
         raise HTTPException(status_code=404, detail="Dataset not found")
 
-    stored_category = await db_category.get_by_id(conn, category_id)
-    if stored_category is None:
-        # Category doesn't exist
+    stored_category = await db_category.get_by_id(conn, project_id, category_id)
+    if stored_category is None or stored_category.dataset_id != dataset_id:
+        # Category doesn't exist or not in this dataset
         raise HTTPException(status_code=404, detail="Category not found")
+    response.headers["ETag"] = make_etag(stored_category.seq)
     return stored_category
 
 
@@ -171,7 +737,7 @@ async def delete_category(
     project_id: uuid.UUID,
     dataset_id: uuid.UUID,
     category_id: uuid.UUID,
-    conn: Annotated[asyncpg.Connection, Depends(get_connection)],
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
     current_user: Annotated[db_user.User, Depends(get_current_user)],
 ):
     project = await db_project.get_by_id(conn, project_id)
@@ -183,9 +749,185 @@ async def delete_category(
         # The project exists but the current user is not a member
         raise HTTPException(status_code=404, detail="Project not found")
 
-    stored_dataset = await db_dataset.get_by_id(conn, dataset_id)
-    if stored_dataset is None:
-        # Dataset doesn't exist at all
+    stored_dataset = await db_dataset.get_metadata(conn, dataset_id)
+    if stored_dataset is None or stored_dataset.project_id != project_id:
+        # Dataset doesn't exist at all or not in this project
+        raise HTTPException(status_code=404, detail="Dataset not found")
+
+    await db_category.delete_category(conn, project_id, dataset_id, category_id)
+
+
+@router.post("/project/{project_id}/dataset/{dataset_id}/category/batch")
+async def batch_categories(
+    project_id: uuid.UUID,
+    dataset_id: uuid.UUID,
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
+    current_user: Annotated[db_user.User, Depends(get_current_user)],
+    batch: CategoryBatchIn,
+) -> list[CategoryBatchResult]:
+    """
+    Applies many category operations to a dataset in a single transaction.
+
+    Returns a result for each operation in the same order, failed operations
+    don't prevent the others from being applied.
+    Created and updated spans are checked in operations order against the
+    project overlap policy, taking the deletes of the batch into account.
+    """
+    project = await db_project.get_by_id(conn, project_id)
+    if project is None:
+        # Project doesn't exist at all
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    if current_user.id not in project.members:
+        # The project exists but the current user is not a member
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    stored_dataset = await db_dataset.get_metadata(conn, dataset_id)
+    if stored_dataset is None or stored_dataset.project_id != project_id:
+        # Dataset doesn't exist at all or not in this project
         raise HTTPException(status_code=404, detail="Dataset not found")
 
-    await db_category.delete_category(conn, category_id)
+    operations = batch.operations
+    results: list[CategoryBatchResult] = [
+        CategoryBatchResult(status="ok") for _ in operations
+    ]
+    to_create: dict[int, db_category.Category] = {}
+    # Updates of the same category are merged, later operations win
+    to_update: dict[uuid.UUID, dict] = {}
+    update_indexes: dict[uuid.UUID, list[int]] = {}
+    delete_indexes: dict[uuid.UUID, int] = {}
+
+    async with conn.transaction():
+        if project.overlap_policy != "allow":
+            await db_category.lock_dataset(conn, dataset_id)
+
+        existing_label_ids = await db_label.get_cached_by_project(
+            conn, project_id, project.labels_version
+        )
+
+        for index, op in enumerate(operations):
+            if op.label_id is not None and op.label_id not in existing_label_ids:
+                results[index] = CategoryBatchResult(
+                    status="error", id=op.id, detail="Label not found"
+                )
+            elif op.op == "create":
+                if (
+                    op.label_id is None
+                    or op.start_offset is None
+                    or op.end_offset is None
+                ):
+                    results[index] = CategoryBatchResult(
+                        status="error",
+                        detail="Missing label_id, start_offset or end_offset",
+                    )
+                    continue
+                category_id = uuid.uuid4()
+                to_create[index] = db_category.Category(
+                    id=category_id,
+                    label_id=op.label_id,
+                    project_id=project_id,
+                    dataset_id=dataset_id,
+                    start_offset=op.start_offset,
+                    end_offset=op.end_offset,
+                    created_by=current_user.id,
+                )
+                results[index].id = category_id
+            elif op.id is None:
+                results[index] = CategoryBatchResult(
+                    status="error", detail="Missing id"
+                )
+            elif op.id in delete_indexes:
+                # Deleted by a previous operation of this batch
+                results[index] = CategoryBatchResult(
+                    status="error", id=op.id, detail="Category not found"
+                )
+            elif op.op == "update":
+                to_update.setdefault(op.id, {}).update(
+                    op.model_dump(
+                        include={"label_id", "start_offset", "end_offset"},
+                        exclude_none=True,
+                    )
+                )
+                update_indexes.setdefault(op.id, []).append(index)
+            else:
+                delete_indexes[op.id] = index
+
+        # Spans as they'll be once written, keyed by their first operation
+        written: dict[int, db_category.Category] = dict(to_create)
+        stored = await db_category.get_by_ids(
+            conn, project_id, dataset_id, list(to_update)
+        )
+        for stored_category in stored:
+            written[update_indexes[stored_category.id][0]] = db_category.Category(
+                **{
+                    **stored_category.model_dump(),
+                    **to_update[stored_category.id],
+                }
+            )
+
+        # Deleted spans don't count. Other updated spans count both as stored
+        # and as updated, so a rejected update never leaves a conflict behind
+        ignored = set(delete_indexes)
+        pending = SpanIndex()
+        for first_index, written_category in sorted(written.items()):
+            error = _offsets_error(
+                written_category.start_offset,
+                written_category.end_offset,
+                stored_dataset.text_length,
+            )
+            if error is None:
+                other = await _find_violation(
+                    conn, project.overlap_policy, written_category, ignored, pending
+                )
+                if other is not None:
+                    error = f"Category overlaps category {other.id}"
+            if error is None:
+                pending.add(written_category)
+                continue
+
+            if first_index in to_create:
+                del to_create[first_index]
+                results[first_index] = CategoryBatchResult(status="error", detail=error)
+            else:
+                for index in update_indexes.pop(written_category.id):
+                    results[index] = CategoryBatchResult(
+                        status="error", id=written_category.id, detail=error
+                    )
+                del to_update[written_category.id]
+
+        await db_category.create_many(conn, dataset_id, list(to_create.values()))
+
+        update_ids = list(to_update)
+        updated = await db_category.update_many(
+            conn,
+            project_id,
+            dataset_id,
+            update_ids,
+            [to_update[i].get("label_id") for i in update_ids],
+            [to_update[i].get("start_offset") for i in update_ids],
+            [to_update[i].get("end_offset") for i in update_ids],
+        )
+        updated_ids = {c.id for c in updated}
+        for category_id, indexes in update_indexes.items():
+            for index in indexes:
+                if category_id in updated_ids:
+                    results[index].id = category_id
+                else:
+                    results[index] = CategoryBatchResult(
+                        status="error", id=category_id, detail="Category not found"
+                    )
+
+        deleted_ids = set(
+            await db_category.delete_many(
+                conn, project_id, dataset_id, list(delete_indexes)
+            )
+        )
+        for category_id, index in delete_indexes.items():
+            if category_id in deleted_ids:
+                results[index].id = category_id
+            else:
+                results[index] = CategoryBatchResult(
+                    status="error", id=category_id, detail="Category not found"
+                )
+
+    return results
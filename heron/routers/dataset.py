@@ -1,23 +1,73 @@
+import re
 import uuid
 from typing import Annotated
 
 import asyncpg
-from fastapi import APIRouter, Depends, HTTPException, UploadFile
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    UploadFile,
+)
+from fastapi.responses import FileResponse, PlainTextResponse
+from pydantic import BaseModel
 
+from heron import tasks
 from heron.db import dataset as db_dataset
 from heron.db import project as db_project
 from heron.db import user as db_user
 from heron.db.db import get_connection
+from heron.etag import etag_matches, make_etag, not_modified
+from heron.storage import get_storage
 
 from .user import get_current_user
 
 router = APIRouter()
 
+# Caps the number of hit offsets returned for a single dataset, a common word
+# can easily appear thousands of times in a long document.
+MAX_SEARCH_MATCHES = 100
+
+
+class SearchMatch(BaseModel):
+    start_offset: int
+    end_offset: int
+
+
+class SearchResult(BaseModel):
+    dataset_id: uuid.UUID
+    filename: str | None
+    rank: float
+    matches: list[SearchMatch]
+
+
+def _search_terms_pattern(query: str) -> re.Pattern | None:
+    """
+    Builds a pattern matching every positive term of a websearch query.
+
+    Excluded terms ("-word") and the "or" operator are not highlighted.
+    """
+    terms = {
+        term.lower()
+        for negated, term in re.findall(r"(-?)(\w+)", query)
+        if not negated and term.lower() != "or"
+    }
+    if not terms:
+        return None
+    # Longest first so overlapping terms prefer the longer match
+    alternatives = "|".join(re.escape(t) for t in sorted(terms, key=len, reverse=True))
+    return re.compile(rf"\b(?:{alternatives})\b", re.IGNORECASE)
+
 
 @router.post("/project/{project_id}/dataset")
 async def upload_dataset(
     project_id: uuid.UUID,
-    conn: Annotated[asyncpg.Connection, Depends(get_connection)],
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
     current_user: Annotated[db_user.User, Depends(get_current_user)],
     file: UploadFile,
 ):
@@ -55,13 +105,66 @@ async def upload_dataset(
     return {"dataset_id": dataset_id}
 
 
-@router.get("/project/{project_id}/dataset/{dataset_id}")
+@router.get("/project/{project_id}/search")
+async def search_datasets(
+    project_id: uuid.UUID,
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
+    current_user: Annotated[db_user.User, Depends(get_current_user)],
+    q: Annotated[str, Query(min_length=1)],
+    limit: Annotated[int, Query(ge=1, le=100)] = 20,
+    offset: Annotated[int, Query(ge=0)] = 0,
+) -> list[SearchResult]:
+    """
+    Returns the datasets of the project matching q, best matches first,
+    with the character offsets of the matched terms.
+    """
+    project = await db_project.get_by_id(conn, project_id)
+    if project is None:
+        # Project doesn't exist at all
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    if current_user.id not in project.members:
+        # The project exists but the current user is not a member
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    if current_user.id != project.owner:
+        # The project exists but the current user is not the owner
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+
+    hits = await db_dataset.search(conn, project_id, q, limit, offset)
+    pattern = _search_terms_pattern(q)
+    results = []
+    for hit in hits:
+        matches = []
+        if pattern is not None:
+            for match in pattern.finditer(hit.text):
+                matches.append(
+                    SearchMatch(start_offset=match.start(), end_offset=match.end())
+                )
+                if len(matches) == MAX_SEARCH_MATCHES:
+                    break
+        results.append(
+            SearchResult(
+                dataset_id=hit.id,
+                filename=hit.filename,
+                rank=hit.rank,
+                matches=matches,
+            )
+        )
+    return results
+
+
+@router.get(
+    "/project/{project_id}/dataset/{dataset_id}", response_model=db_dataset.Dataset
+)
 async def get_dataset(
     project_id: uuid.UUID,
     dataset_id: uuid.UUID,
-    conn: Annotated[asyncpg.Connection, Depends(get_connection)],
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
     current_user: Annotated[db_user.User, Depends(get_current_user)],
-) -> db_dataset.Dataset:
+    response: Response,
+    if_none_match: Annotated[str | None, Header()] = None,
+) -> db_dataset.Dataset | Response:
     project = await db_project.get_by_id(conn, project_id)
     if project is None:
         # Project doesn't exist at all
@@ -75,16 +178,82 @@ async def get_dataset(
         # The project exists but the current user is not the owner
         raise HTTPException(status_code=403, detail="Not enough permissions")
 
+    content_hash = await db_dataset.get_content_hash(conn, dataset_id)
+    if content_hash is None:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+
+    etag = make_etag(content_hash)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
     dataset = await db_dataset.get_by_id(conn, dataset_id)
     if dataset is None:
         raise HTTPException(status_code=404, detail="Dataset not found")
+    response.headers["ETag"] = etag
     return dataset
 
 
+@router.get("/project/{project_id}/dataset/{dataset_id}/text")
+async def get_dataset_text(
+    project_id: uuid.UUID,
+    dataset_id: uuid.UUID,
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
+    current_user: Annotated[db_user.User, Depends(get_current_user)],
+    start: Annotated[int | None, Query(ge=0)] = None,
+    end: Annotated[int | None, Query(ge=0)] = None,
+    if_none_match: Annotated[str | None, Header()] = None,
+):
+    """
+    Returns the dataset text as plain text, or only the characters in
+    [start, end) if any of the two is set.
+    """
+    project = await db_project.get_by_id(conn, project_id)
+    if project is None:
+        # Project doesn't exist at all
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    if current_user.id not in project.members:
+        # The project exists but the current user is not a member
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    if current_user.id != project.owner:
+        # The project exists but the current user is not the owner
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+
+    stored_text = await db_dataset.get_stored_text(conn, project_id, dataset_id)
+    if stored_text is None:
+        # Dataset doesn't exist at all or not in this project
+        raise HTTPException(status_code=404, detail="Dataset not found")
+
+    if start is not None or end is not None:
+        text = await db_dataset.get_text_range(
+            conn, project_id, dataset_id, start or 0, end
+        )
+        if text is None:
+            raise HTTPException(status_code=404, detail="Dataset not found")
+        return PlainTextResponse(text)
+
+    etag = make_etag(stored_text.content_hash)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    path = get_storage(stored_text.storage).path(stored_text.content_hash)
+    if path is not None:
+        # Let the server send the file straight from the page cache
+        return FileResponse(
+            path, media_type="text/plain; charset=utf-8", headers={"ETag": etag}
+        )
+
+    dataset = await db_dataset.get_by_id(conn, dataset_id)
+    if dataset is None:
+        raise HTTPException(status_code=404, detail="Dataset not found")
+    return PlainTextResponse(dataset.text, headers={"ETag": etag})
+
+
 @router.get("/project/{project_id}/dataset")
 async def get_project_dataset(
     project_id: uuid.UUID,
-    conn: Annotated[asyncpg.Connection, Depends(get_connection)],
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
     current_user: Annotated[db_user.User, Depends(get_current_user)],
 ) -> list[db_dataset.Dataset]:
     project = await db_project.get_by_id(conn, project_id)
@@ -108,9 +277,17 @@ async def get_project_dataset(
 async def delete_dataset(
     project_id: uuid.UUID,
     dataset_id: uuid.UUID,
-    conn: Annotated[asyncpg.Connection, Depends(get_connection)],
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
     current_user: Annotated[db_user.User, Depends(get_current_user)],
+    request: Request,
+    background_tasks: BackgroundTasks,
 ):
+    """
+    Hides the dataset right away, its categories and the dataset itself are
+    deleted in the background.
+    Returns the id of the operation tracking that, or None if there was
+    nothing to delete.
+    """
     project = await db_project.get_by_id(conn, project_id)
     if project is None:
         # Project doesn't exist at all
@@ -126,4 +303,17 @@ async def delete_dataset(
             status_code=401, detail="Not enough permissions to delete dataset"
         )
 
-    await db_dataset.delete(conn, dataset_id)
+    async with conn.transaction():
+        if not await db_dataset.hide(conn, project_id, dataset_id):
+            return {"operation_id": None}
+        operation_id = await tasks.start_operation(
+            conn, project_id, tasks.DELETE_DATASET, dataset_id
+        )
+    background_tasks.add_task(
+        tasks.purge_dataset,
+        request.state.db_pool,
+        operation_id,
+        project_id,
+        dataset_id,
+    )
+    return {"operation_id": operation_id}
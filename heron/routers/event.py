@@ -0,0 +1,94 @@
+import asyncio
+import json
+import uuid
+from typing import Annotated
+
+import asyncpg
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
+
+from heron.db import category as db_category
+from heron.db import dataset as db_dataset
+from heron.db import get_connection
+from heron.db import project as db_project
+from heron.db import user as db_user
+from heron.events import EventBroker
+
+from .user import get_current_user
+
+router = APIRouter()
+
+# Idle connections get a comment this often so proxies don't close them
+KEEPALIVE_INTERVAL = 15
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+@router.get("/project/{project_id}/dataset/{dataset_id}/events")
+async def get_dataset_events(
+    project_id: uuid.UUID,
+    dataset_id: uuid.UUID,
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
+    current_user: Annotated[db_user.User, Depends(get_current_user)],
+    request: Request,
+) -> StreamingResponse:
+    """
+    Streams the changes to the dataset categories and its project labels as
+    server-sent events.
+
+    The first event is ready, its cursor is the since value to pass to the
+    category changes endpoint to catch up with what happened before.
+    Category events carry the seq of their change, a gap means events were
+    missed. Large writes send a single sync event instead of one per category.
+    Slow clients are sent an evicted event and disconnected, they should
+    reconnect. In all these cases clients catch up through the changes
+    endpoint.
+    """
+    project = await db_project.get_by_id(conn, project_id)
+    if project is None:
+        # Project doesn't exist at all
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    if current_user.id not in project.members:
+        # The project exists but the current user is not a member
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    stored_dataset = await db_dataset.get_metadata(conn, dataset_id)
+    if stored_dataset is None or stored_dataset.project_id != project_id:
+        # Dataset doesn't exist at all or not in this project
+        raise HTTPException(status_code=404, detail="Dataset not found")
+
+    broker: EventBroker = request.state.event_broker
+    # Subscribe before reading the version so no change falls in between
+    subscription = await broker.subscribe(project_id, dataset_id)
+    version = await db_category.get_version(conn, project_id, dataset_id)
+    if version is None:
+        # Deleted since the check above
+        broker.unsubscribe(subscription)
+        raise HTTPException(status_code=404, detail="Dataset not found")
+
+    async def stream():
+        try:
+            yield _sse("ready", {"cursor": version[0]})
+            while True:
+                try:
+                    event = await asyncio.wait_for(
+                        subscription.get(), KEEPALIVE_INTERVAL
+                    )
+                except TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    yield _sse("evicted", {})
+                    return
+                yield _sse(event["type"], event)
+        finally:
+            broker.unsubscribe(subscription)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
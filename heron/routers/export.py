@@ -0,0 +1,76 @@
+import uuid
+from typing import Annotated
+
+import asyncpg
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+
+from heron.db import dataset as db_dataset
+from heron.db import get_connection
+from heron.db import project as db_project
+from heron.db import user as db_user
+from heron.export import ExportFormat, encode
+
+from .user import get_current_user
+
+router = APIRouter()
+
+MEDIA_TYPES: dict[ExportFormat, str] = {
+    "jsonl": "application/x-ndjson",
+    "conll": "text/plain; charset=utf-8",
+    "spacy": "application/x-ndjson",
+}
+EXTENSIONS: dict[ExportFormat, str] = {
+    "jsonl": "jsonl",
+    "conll": "conll",
+    "spacy": "spacy.jsonl",
+}
+
+
+@router.get("/project/{project_id}/export")
+async def export_project(
+    project_id: uuid.UUID,
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
+    current_user: Annotated[db_user.User, Depends(get_current_user)],
+    request: Request,
+    export_format: Annotated[ExportFormat, Query(alias="format")] = "jsonl",
+    gzip: bool = False,
+) -> StreamingResponse:
+    """
+    Streams every dataset of the project with its categories, as JSON lines,
+    CoNLL BIO tags or spaCy-style span records. Set gzip to get the export
+    gzip compressed.
+    """
+    project = await db_project.get_by_id(conn, project_id)
+    if project is None:
+        # Project doesn't exist at all
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    if current_user.id not in project.members:
+        # The project exists but the current user is not a member
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    if current_user.id != project.owner:
+        # The project exists but the current user is not the owner
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+
+    # conn goes back to the pool when this handler returns, the stream reads
+    # through a connection of its own for as long as it's sent
+    pool: asyncpg.Pool = request.state.db_pool
+
+    async def stream():
+        async with pool.acquire() as stream_conn:
+            datasets = db_dataset.iter_annotated(stream_conn, project_id)
+            async for chunk in encode(datasets, export_format, gzip):
+                yield chunk
+
+    filename = f"{project_id}.{EXTENSIONS[export_format]}"
+    media_type = MEDIA_TYPES[export_format]
+    if gzip:
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(
+        stream(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
@@ -2,13 +2,24 @@ import uuid
 from typing import Annotated
 
 import asyncpg
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    Header,
+    HTTPException,
+    Request,
+    Response,
+)
 from pydantic import BaseModel
 
+from heron import tasks
+from heron.db import category as db_category
 from heron.db import get_connection
 from heron.db import label as db_label
 from heron.db import project as db_project
 from heron.db import user as db_user
+from heron.etag import etag_matches, if_match_version, make_etag, not_modified
 
 from .user import get_current_user
 
@@ -18,17 +29,30 @@ router = APIRouter()
 class LabelCreateIn(BaseModel):
     name: str
     color: str
+    parent_id: uuid.UUID | None = None
 
 
 class LabelUpdateIn(BaseModel):
     name: str | None = None
     color: str | None = None
+    # Setting it, even to None, moves the label and its subtree
+    parent_id: uuid.UUID | None = None
+
+
+class LabelListOut(db_label.Label):
+    spans: int | None = None
+    subtree_spans: int | None = None
+
+
+class LabelMergeIn(BaseModel):
+    source_ids: list[uuid.UUID]
+    delete_sources: bool = False
 
 
 @router.post("/project/{project_id}/label")
 async def create_label(
     project_id: uuid.UUID,
-    conn: Annotated[asyncpg.Connection, Depends(get_connection)],
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
     current_user: Annotated[db_user.User, Depends(get_current_user)],
     label: LabelCreateIn,
 ):
@@ -45,16 +69,28 @@ async def create_label(
         # The project exists but the current user is not the owner
         raise HTTPException(status_code=403, detail="Not enough permissions")
 
+    if label.parent_id is not None:
+        labels = await db_label.get_cached_by_project(
+            conn, project_id, project.labels_version
+        )
+        if label.parent_id not in labels:
+            # Parent doesn't exist at all or not in this project
+            raise HTTPException(status_code=404, detail="Parent label not found")
+
     label_id = uuid.uuid4()
-    await db_label.create(
+    created = await db_label.create(
         conn,
         db_label.Label(
             id=label_id,
             project_id=project_id,
             name=label.name,
             color=label.color,
+            parent_id=label.parent_id,
         ),
     )
+    if not created:
+        # Parent deleted since the labels were read
+        raise HTTPException(status_code=404, detail="Parent label not found")
     return {"label_id": label_id}
 
 
@@ -62,8 +98,9 @@ async def create_label(
 async def get_label(
     project_id: uuid.UUID,
     label_id: uuid.UUID,
-    conn: Annotated[asyncpg.Connection, Depends(get_connection)],
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
     current_user: Annotated[db_user.User, Depends(get_current_user)],
+    response: Response,
 ) -> db_label.Label:
     project = await db_project.get_by_id(conn, project_id)
     if project is None:
@@ -78,18 +115,31 @@ async def get_label(
         # The project exists but the current user is not the owner
         raise HTTPException(status_code=403, detail="Not enough permissions")
 
-    label = await db_label.get_by_id(conn, label_id)
+    labels = await db_label.get_cached_by_project(
+        conn, project_id, project.labels_version
+    )
+    label = labels.get(label_id)
     if label is None:
         raise HTTPException(status_code=404, detail="Label not found")
+    response.headers["ETag"] = make_etag(label.version)
     return label
 
 
-@router.get("/project/{project_id}/label")
+@router.get("/project/{project_id}/label", response_model=list[LabelListOut])
 async def get_project_labels(
     project_id: uuid.UUID,
-    conn: Annotated[asyncpg.Connection, Depends(get_connection)],
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
     current_user: Annotated[db_user.User, Depends(get_current_user)],
-) -> list[db_label.Label]:
+    response: Response,
+    counts: bool = False,
+    if_none_match: Annotated[str | None, Header()] = None,
+) -> list[LabelListOut] | Response:
+    """
+    Returns the labels of the project.
+    With counts set each label comes with the number of its spans and of the
+    spans of its whole subtree, those change with every span so there's no
+    ETag then.
+    """
     project = await db_project.get_by_id(conn, project_id)
     if project is None:
         # Project doesn't exist at all
@@ -103,17 +153,81 @@ async def get_project_labels(
         # The project exists but the current user is not the owner
         raise HTTPException(status_code=403, detail="Not enough permissions")
 
-    return await db_label.get_by_project(conn, project_id)
+    labels = await db_label.get_cached_by_project(
+        conn, project_id, project.labels_version
+    )
+    if counts:
+        spans = await db_label.get_span_counts(conn, project_id)
+        subtree_spans = db_label.subtree_counts(
+            {label.id: label.path for label in labels.values()}, spans
+        )
+        return [
+            LabelListOut(
+                **label.model_dump(),
+                spans=spans.get(label.id, 0),
+                subtree_spans=subtree_spans[label.id],
+            )
+            for label in labels.values()
+        ]
+
+    etag = make_etag(project.labels_version)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    response.headers["ETag"] = etag
+    return [LabelListOut(**label.model_dump()) for label in labels.values()]
+
+
+@router.get("/project/{project_id}/label/{label_id}/category")
+async def get_label_subtree_categories(
+    project_id: uuid.UUID,
+    label_id: uuid.UUID,
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
+    current_user: Annotated[db_user.User, Depends(get_current_user)],
+    dataset_id: uuid.UUID | None = None,
+) -> list[db_category.Category]:
+    """
+    Returns the categories of the label and all its descendants, ordered by
+    dataset and start offset. With dataset_id set only the ones of that
+    dataset.
+    """
+    project = await db_project.get_by_id(conn, project_id)
+    if project is None:
+        # Project doesn't exist at all
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    if current_user.id not in project.members:
+        # The project exists but the current user is not a member
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    labels = await db_label.get_cached_by_project(
+        conn, project_id, project.labels_version
+    )
+    label = labels.get(label_id)
+    if label is None:
+        raise HTTPException(status_code=404, detail="Label not found")
+
+    return await db_category.get_by_label_subtree(
+        conn, project_id, label.path, dataset_id
+    )
 
 
 @router.put("/project/{project_id}/label/{label_id}")
 async def update_label(
     project_id: uuid.UUID,
     label_id: uuid.UUID,
-    conn: Annotated[asyncpg.Connection, Depends(get_connection)],
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
     current_user: Annotated[db_user.User, Depends(get_current_user)],
     label: LabelUpdateIn,
+    response: Response,
+    if_match: Annotated[str | None, Header()] = None,
 ) -> db_label.Label:
+    """
+    Updates the fields set in the body.
+    With an If-Match header holding the label ETag the update only happens
+    if nobody changed the label since, otherwise it fails with 412.
+    Setting parent_id moves the label with its whole subtree.
+    """
     project = await db_project.get_by_id(conn, project_id)
     if project is None:
         # Project doesn't exist at all
@@ -127,17 +241,46 @@ async def update_label(
         # The project exists but the current user is not the owner
         raise HTTPException(status_code=403, detail="Not enough permissions")
 
-    stored_label = await db_label.get_by_id(conn, label_id)
-    if stored_label is None:
-        raise HTTPException(status_code=404, detail="Label not found")
-
-    updated_label = db_label.Label(
-        **{**stored_label.model_dump(), **label.model_dump(exclude_unset=True)}
-    )
-    await db_label.update(
-        conn,
-        updated_label,
-    )
+    version = if_match_version(if_match)
+    moving = "parent_id" in label.model_fields_set
+    if moving and label.parent_id is not None:
+        labels = await db_label.get_cached_by_project(
+            conn, project_id, project.labels_version
+        )
+        parent = labels.get(label.parent_id)
+        if parent is None:
+            # Parent doesn't exist at all or not in this project
+            raise HTTPException(status_code=404, detail="Parent label not found")
+        if str(label_id) in parent.path:
+            raise HTTPException(
+                status_code=400, detail="A label can't be moved under itself"
+            )
+
+    # Failures raise inside the transaction so a move is rolled back with them
+    async with conn.transaction():
+        moved = not moving or await db_label.move(
+            conn, project_id, label_id, label.parent_id
+        )
+        updated_label = (
+            await db_label.update(
+                conn, project_id, label_id, label.name, label.color, version
+            )
+            if moved
+            else None
+        )
+        if updated_label is None:
+            # Only failed writes pay for telling why
+            stored_label = await db_label.get_by_id(conn, label_id)
+            if stored_label is None or stored_label.project_id != project_id:
+                raise HTTPException(status_code=404, detail="Label not found")
+            if not moved:
+                # The parent joined the subtree since it was checked
+                raise HTTPException(
+                    status_code=400, detail="A label can't be moved under itself"
+                )
+            raise HTTPException(status_code=412, detail="Label was modified")
+
+    response.headers["ETag"] = make_etag(updated_label.version)
     return updated_label
 
 
@@ -145,9 +288,17 @@ async def update_label(
 async def delete_label(
     project_id: uuid.UUID,
     label_id: uuid.UUID,
-    conn: Annotated[asyncpg.Connection, Depends(get_connection)],
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
     current_user: Annotated[db_user.User, Depends(get_current_user)],
+    request: Request,
+    background_tasks: BackgroundTasks,
 ):
+    """
+    Hides the label and its categories right away, they're deleted in the
+    background.
+    Returns the id of the operation tracking that, or None if there was
+    nothing to delete.
+    """
     project = await db_project.get_by_id(conn, project_id)
     if project is None:
         # Project doesn't exist at all
@@ -163,4 +314,83 @@ async def delete_label(
             status_code=401, detail="Not enough permissions to delete label"
         )
 
-    await db_label.delete(conn, label_id)
+    async with conn.transaction():
+        # Children created meanwhile would be left under a deleted label
+        await db_label.lock_tree(conn, project_id)
+        if await db_label.has_children(conn, label_id):
+            raise HTTPException(status_code=409, detail="Label has child labels")
+        if not await db_label.hide(conn, project_id, label_id):
+            return {"operation_id": None}
+        operation_id = await tasks.start_operation(
+            conn, project_id, tasks.DELETE_LABEL, label_id
+        )
+    background_tasks.add_task(
+        tasks.purge_label, request.state.db_pool, operation_id, project_id, label_id
+    )
+    return {"operation_id": operation_id}
+
+
+@router.post("/project/{project_id}/label/{label_id}/merge")
+async def merge_labels(
+    project_id: uuid.UUID,
+    label_id: uuid.UUID,
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
+    current_user: Annotated[db_user.User, Depends(get_current_user)],
+    request: Request,
+    background_tasks: BackgroundTasks,
+    merge: LabelMergeIn,
+):
+    """
+    Moves all categories of the source labels to this one in the background,
+    then deletes the source labels if delete_sources is set.
+    Returns the id of the operation tracking that.
+
+    The project overlap policy isn't checked, the overlaps endpoint lists
+    the categories that break it afterwards.
+    """
+    project = await db_project.get_by_id(conn, project_id)
+    if project is None:
+        # Project doesn't exist at all
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    if current_user.id not in project.members:
+        # The project exists but the current user is not a member
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    if current_user.id != project.owner:
+        # The project exists but the current user is not the owner
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+
+    source_ids = list(dict.fromkeys(merge.source_ids))
+    if not source_ids:
+        raise HTTPException(status_code=400, detail="No source labels")
+    if label_id in source_ids:
+        raise HTTPException(
+            status_code=400, detail="A label can't be merged into itself"
+        )
+    labels = await db_label.get_cached_by_project(
+        conn, project_id, project.labels_version
+    )
+    if any(i not in labels for i in [label_id, *source_ids]):
+        # Some label doesn't exist at all or not in this project
+        raise HTTPException(status_code=404, detail="Label not found")
+    if merge.delete_sources and any(
+        label.parent_id in source_ids and label.id not in source_ids
+        for label in labels.values()
+    ):
+        raise HTTPException(status_code=409, detail="Label has child labels")
+
+    kind = tasks.MERGE_LABELS if merge.delete_sources else tasks.RELABEL
+    operation_id = await tasks.start_operation(
+        conn, project_id, kind, label_id, source_ids
+    )
+    background_tasks.add_task(
+        tasks.merge_labels,
+        request.state.db_pool,
+        operation_id,
+        project_id,
+        source_ids,
+        label_id,
+        merge.delete_sources,
+    )
+    return {"operation_id": operation_id}
@@ -0,0 +1,36 @@
+import uuid
+from typing import Annotated
+
+import asyncpg
+from fastapi import APIRouter, Depends, HTTPException
+
+from heron.db import get_connection
+from heron.db import operation as db_operation
+from heron.db import project as db_project
+from heron.db import user as db_user
+
+from .user import get_current_user
+
+router = APIRouter()
+
+
+@router.get("/project/{project_id}/operation/{operation_id}")
+async def get_operation(
+    project_id: uuid.UUID,
+    operation_id: uuid.UUID,
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
+    current_user: Annotated[db_user.User, Depends(get_current_user)],
+) -> db_operation.Operation:
+    project = await db_project.get_by_id(conn, project_id)
+    if project is None:
+        # Project doesn't exist at all
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    if current_user.id not in project.members:
+        # The project exists but the current user is not a member
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    operation = await db_operation.get_by_id(conn, operation_id)
+    if operation is None or operation.project_id != project_id:
+        raise HTTPException(status_code=404, detail="Operation not found")
+    return operation
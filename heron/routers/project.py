@@ -1,15 +1,31 @@
+import asyncio
 import uuid
 from logging import getLogger
 from typing import Annotated
 
 import asyncpg
-from fastapi import APIRouter, Depends
+import numpy as np
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    Header,
+    Query,
+    Request,
+    Response,
+)
 from fastapi.exceptions import HTTPException
 from pydantic import BaseModel
 
+from heron import tasks
+from heron.agreement import AgreementScores, AgreementStats
+from heron.cache import VersionedLRUCache
+from heron.db import dataset as db_dataset
 from heron.db import get_connection
+from heron.db import label as db_label
 from heron.db import project as db_project
 from heron.db import user as db_user
+from heron.etag import etag_matches, make_etag, not_modified
 
 from .user import get_current_user
 
@@ -17,11 +33,21 @@ logger = getLogger(__name__)
 
 router = APIRouter()
 
+# Statistics of the most recently viewed projects, per worker
+_statistics_cache: VersionedLRUCache[uuid.UUID, db_project.ProjectStatistics] = (
+    VersionedLRUCache(max_entries=256)
+)
+# Spans of the most recently listed projects, per worker
+_span_counts_cache: VersionedLRUCache[uuid.UUID, int] = VersionedLRUCache(
+    max_entries=10000
+)
+
 
 class ProjectCreateIn(BaseModel):
     members: list[uuid.UUID]
     title: str
     description: str
+    overlap_policy: db_project.OverlapPolicy = "allow"
 
 
 class ProjectUpdateIn(BaseModel):
@@ -29,12 +55,39 @@ class ProjectUpdateIn(BaseModel):
     members: list[uuid.UUID] | None = None
     title: str | None = None
     description: str | None = None
+    overlap_policy: db_project.OverlapPolicy | None = None
+
+
+class ProjectCloneIn(BaseModel):
+    title: str
+    description: str | None = None
+    categories: bool = False
+
+
+class LabelAgreement(BaseModel):
+    label_id: uuid.UUID
+    name: str
+    scores: AgreementScores
+
+
+class DatasetAgreement(BaseModel):
+    dataset_id: uuid.UUID
+    filename: str | None
+    annotators: list[uuid.UUID]
+    scores: AgreementScores
+
+
+class ProjectAgreement(BaseModel):
+    annotators: list[uuid.UUID]
+    scores: AgreementScores
+    labels: list[LabelAgreement]
+    datasets: list[DatasetAgreement]
 
 
 @router.post("/project")
 async def create_project(
     project: ProjectCreateIn,
-    conn: Annotated[asyncpg.Connection, Depends(get_connection)],
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
     current_user: Annotated[db_user.User, Depends(get_current_user)],
 ):
     """
@@ -50,8 +103,11 @@ async def create_project(
                 members=project.members,
                 title=project.title,
                 description=project.description,
+                overlap_policy=project.overlap_policy,
             ),
         )
+    except asyncpg.ForeignKeyViolationError:
+        raise HTTPException(status_code=404, detail="Member not found")
     except Exception as exc:
         logger.exception(exc)
         raise HTTPException(status_code=500, detail="Failed to create project")
@@ -61,22 +117,51 @@ async def create_project(
 
 @router.get("/project")
 async def get_projects(
-    conn: Annotated[asyncpg.Connection, Depends(get_connection)],
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
     current_user: Annotated[db_user.User, Depends(get_current_user)],
-):
+    response: Response,
+    after: uuid.UUID | None = None,
+    limit: Annotated[int, Query(ge=1, le=1000)] = 50,
+) -> list[db_project.ProjectSummary]:
     """
-    Returns all the projects the current user is a member of.
+    Returns the projects the current user is a member of ordered by id, with
+    all their members and the number of their datasets, labels and spans.
+
+    At most limit projects are returned, if there might be more the
+    X-Next-Cursor header holds the after value of the next page.
     """
-    projects = await db_project.get_by_member(conn, current_user.id)
+    projects = await db_project.get_by_member(conn, current_user.id, after, limit)
+
+    # Only projects written since their spans were last counted are counted
+    stale = []
+    for project in projects:
+        spans = _span_counts_cache.get(project.id, project.write_version)
+        if spans is None:
+            stale.append(project)
+        else:
+            project.spans = spans
+    if stale:
+        counts = await db_project.count_spans(conn, [p.id for p in stale])
+        for project in stale:
+            project.spans = counts.get(project.id, 0)
+            _span_counts_cache.put(project.id, project.write_version, project.spans)
+
+    if len(projects) == limit:
+        response.headers["X-Next-Cursor"] = str(projects[-1].id)
     return projects
 
 
 @router.put("/project")
 async def update_project(
     project: ProjectUpdateIn,
-    conn: Annotated[asyncpg.Connection, Depends(get_connection)],
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
     current_user: Annotated[db_user.User, Depends(get_current_user)],
 ) -> db_project.Project:
+    """
+    Updates the fields set in the body, members replaces the project members.
+    The owner is always a member, only the members added or removed are
+    written.
+    """
     stored_project = await db_project.get_by_id(conn, project.id)
     if stored_project is None:
         # Project doesn't exist at all
@@ -95,5 +180,208 @@ async def update_project(
     updated_project = db_project.Project(
         **{**stored_project.model_dump(), **project.model_dump(exclude_unset=True)}
     )
-    await db_project.update_project(conn, updated_project)
+    # Like on creation members don't need to list the owner
+    members = list(dict.fromkeys([updated_project.owner, *updated_project.members]))
+    updated_project.members = members
+    try:
+        async with conn.transaction():
+            await db_project.update_project(conn, updated_project)
+            if set(members) != set(stored_project.members):
+                await db_project.set_members(conn, project.id, members)
+    except asyncpg.ForeignKeyViolationError:
+        raise HTTPException(status_code=404, detail="Member not found")
     return updated_project
+
+
+@router.post("/project/{project_id}/clone")
+async def clone_project(
+    project_id: uuid.UUID,
+    clone: ProjectCloneIn,
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
+    current_user: Annotated[db_user.User, Depends(get_current_user)],
+    request: Request,
+    background_tasks: BackgroundTasks,
+):
+    """
+    Creates a new project owned by the current user with copies of the
+    project labels and datasets, and of its categories if categories is set.
+    The copies are made in the background.
+    Returns the id of the new project and of the operation tracking the copy,
+    which belongs to the new project.
+    """
+    project = await db_project.get_by_id(conn, project_id)
+    if project is None:
+        # Project doesn't exist at all
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    if current_user.id not in project.members:
+        # The project exists but the current user is not a member
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    if current_user.id != project.owner:
+        # The project exists but the current user is not the owner
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+
+    clone_id = uuid.uuid4()
+    kind = tasks.CLONE_ANNOTATED_PROJECT if clone.categories else tasks.CLONE_PROJECT
+    async with conn.transaction():
+        await db_project.create(
+            conn,
+            db_project.Project(
+                id=clone_id,
+                owner=current_user.id,
+                members=[],
+                title=clone.title,
+                description=(
+                    clone.description
+                    if clone.description is not None
+                    else project.description
+                ),
+                overlap_policy=project.overlap_policy,
+            ),
+        )
+        operation_id = await tasks.start_operation(
+            conn, clone_id, kind, clone_id, [project_id]
+        )
+    background_tasks.add_task(
+        tasks.clone_project,
+        request.state.db_pool,
+        operation_id,
+        project_id,
+        clone_id,
+        clone.categories,
+    )
+    return {"project_id": clone_id, "operation_id": operation_id}
+
+
+@router.get(
+    "/project/{project_id}/statistics", response_model=db_project.ProjectStatistics
+)
+async def get_project_statistics(
+    project_id: uuid.UUID,
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
+    current_user: Annotated[db_user.User, Depends(get_current_user)],
+    response: Response,
+    if_none_match: Annotated[str | None, Header()] = None,
+) -> db_project.ProjectStatistics | Response:
+    """
+    Returns the project annotation statistics.
+
+    They're computed once per write version of the project, later calls
+    return the cached ones until a dataset, label or category is written.
+    """
+    project = await db_project.get_by_id(conn, project_id)
+    if project is None:
+        # Project doesn't exist at all
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    if current_user.id not in project.members:
+        # The project exists but the current user is not a member
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    version = await db_project.get_write_version(conn, project_id)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    etag = make_etag(*version)
+    if etag_matches(if_none_match, etag):
+        return not_modified(etag)
+
+    statistics = _statistics_cache.get(project_id, version)
+    if statistics is None:
+        statistics = await db_project.get_statistics(conn, project_id)
+        # Writes committed while computing make the entry stale right away,
+        # the next call recomputes it
+        _statistics_cache.put(project_id, version, statistics)
+    response.headers["ETag"] = etag
+    return statistics
+
+
+@router.get("/project/{project_id}/agreement")
+async def get_project_agreement(
+    project_id: uuid.UUID,
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
+    current_user: Annotated[db_user.User, Depends(get_current_user)],
+    annotators: Annotated[list[uuid.UUID] | None, Query()] = None,
+) -> ProjectAgreement:
+    """
+    Returns the agreement between the authors of the project categories:
+    span-level F1 and token-level Cohen's and Fleiss' kappa, overall, per
+    label and per dataset.
+
+    By default the annotators of a dataset are the users that created at least
+    one of its categories. If annotators are given only their categories count
+    and they're all considered to have annotated every dataset.
+    """
+    project = await db_project.get_by_id(conn, project_id)
+    if project is None:
+        # Project doesn't exist at all
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    if current_user.id not in project.members:
+        # The project exists but the current user is not a member
+        raise HTTPException(status_code=404, detail="Project not found")
+
+    if current_user.id != project.owner:
+        # The project exists but the current user is not the owner
+        raise HTTPException(status_code=403, detail="Not enough permissions")
+
+    project_labels = await db_label.get_cached_by_project(
+        conn, project_id, project.labels_version
+    )
+    labels = sorted(project_labels.values(), key=lambda l: l.name)
+    # 0 stands for no label
+    label_indexes = {label.id: index for index, label in enumerate(labels, 1)}
+    fixed_annotators = sorted(set(annotators), key=str) if annotators else None
+
+    overall = AgreementStats(len(labels))
+    all_annotators: set[uuid.UUID] = set()
+    datasets: list[DatasetAgreement] = []
+    async for dataset in db_dataset.iter_authored(conn, project_id):
+        dataset_annotators = fixed_annotators or sorted(
+            set(dataset.created_by), key=str
+        )
+        all_annotators.update(dataset_annotators)
+        author_indexes = {a: index for index, a in enumerate(dataset_annotators)}
+        kept = [
+            i
+            for i, author in enumerate(dataset.created_by)
+            if author in author_indexes and dataset.label_ids[i] in label_indexes
+        ]
+
+        stats = AgreementStats(len(labels))
+        # Scoring is CPU bound, keep the event loop free meanwhile
+        await asyncio.to_thread(
+            stats.add_dataset,
+            dataset.text,
+            dataset_annotators,
+            np.array(
+                [author_indexes[dataset.created_by[i]] for i in kept], dtype=np.int64
+            ),
+            np.array([dataset.start_offsets[i] for i in kept], dtype=np.int64),
+            np.array([dataset.end_offsets[i] for i in kept], dtype=np.int64),
+            np.array(
+                [label_indexes[dataset.label_ids[i]] for i in kept], dtype=np.int64
+            ),
+        )
+        overall.merge(stats)
+        datasets.append(
+            DatasetAgreement(
+                dataset_id=dataset.id,
+                filename=dataset.filename,
+                annotators=dataset_annotators,
+                scores=stats.scores(),
+            )
+        )
+
+    return ProjectAgreement(
+        annotators=sorted(all_annotators, key=str),
+        scores=overall.scores(),
+        labels=[
+            LabelAgreement(
+                label_id=label.id, name=label.name, scores=overall.scores(index)
+            )
+            for index, label in enumerate(labels, 1)
+        ],
+        datasets=datasets,
+    )
@@ -44,7 +44,8 @@ class Token(BaseModel):
 
 @router.post("/register")
 async def register(
-    user: UserRegister, conn: Annotated[asyncpg.Connection, Depends(get_connection)]
+    user: UserRegister,
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
 ):
     # Not the best way to handle email and username uniqueness, it does the job
     # for now.
@@ -92,7 +93,7 @@ def create_token(*, data: dict, expires_delta: timedelta) -> Token:
 
 
 async def authenticate_user(
-    conn: Annotated[asyncpg.Connection, Depends(get_connection)],
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
     username: str,
     password: str,
 ) -> db_user.User | None:
@@ -114,7 +115,7 @@ async def authenticate_user(
 
 
 async def get_current_user(
-    conn: Annotated[asyncpg.Connection, Depends(get_connection)],
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
     token: str = Depends(oauth2_scheme),
 ) -> db_user.User:
     """
@@ -150,7 +151,7 @@ def get_user(current_user: db_user.User = Depends(get_current_user)):
 
 @router.post("/token")
 async def login(
-    conn: Annotated[asyncpg.Connection, Depends(get_connection)],
+    conn: Annotated[asyncpg.Connection, Depends(get_connection, scope="function")],
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
 ):
     user = await authenticate_user(conn, form_data.username, form_data.password)
@@ -0,0 +1,185 @@
+import asyncio
+import mmap
+import os
+import tempfile
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+from heron.config import settings
+
+# Bytes that continue a UTF-8 sequence, every other byte starts a character
+_UTF8_CONTINUATION = bytes(range(0x80, 0xC0))
+_SCAN_CHUNK_SIZE = 1 << 16
+
+
+class DatasetStorage(ABC):
+    """
+    Base class for the backends storing datasets text.
+
+    Each dataset row records the name of the backend that stored it, so rows
+    written by different backends can coexist.
+    """
+
+    name: str
+
+    @abstractmethod
+    async def write(self, content_hash: str, text: str) -> str | None:
+        """
+        Stores text, returns the value to keep in the datasets text column.
+        """
+
+    @abstractmethod
+    async def read(self, content_hash: str, column_text: str | None) -> str:
+        """
+        Reads the whole text of a dataset.
+        """
+
+    @abstractmethod
+    async def read_range(
+        self, content_hash: str, column_text: str | None, start: int, end: int | None
+    ) -> str:
+        """
+        Reads the characters in [start, end) of a dataset text, up to its end if
+        end is None.
+        """
+
+    @abstractmethod
+    async def delete(self, content_hash: str):
+        """
+        Deletes a stored text, only called once no dataset references it.
+        """
+
+    def path(self, content_hash: str) -> Path | None:
+        """
+        Returns the file holding the text if there's one, used to serve it
+        without reading it in memory.
+        """
+        return None
+
+
+class PostgresStorage(DatasetStorage):
+    """
+    Keeps the text in the datasets text column.
+    """
+
+    name = "postgres"
+
+    async def write(self, content_hash: str, text: str) -> str | None:
+        return text
+
+    async def read(self, content_hash: str, column_text: str | None) -> str:
+        assert column_text is not None
+        return column_text
+
+    async def read_range(
+        self, content_hash: str, column_text: str | None, start: int, end: int | None
+    ) -> str:
+        assert column_text is not None
+        return column_text[start:end]
+
+    async def delete(self, content_hash: str):
+        pass
+
+
+class FilesystemStorage(DatasetStorage):
+    """
+    Keeps the text UTF-8 encoded in a content-addressed directory tree,
+    identical texts are stored once.
+    """
+
+    name = "filesystem"
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def path(self, content_hash: str) -> Path:
+        return self.root / content_hash[:2] / content_hash[2:4] / content_hash
+
+    async def write(self, content_hash: str, text: str) -> str | None:
+        await asyncio.to_thread(self._write, self.path(content_hash), text)
+        return None
+
+    async def read(self, content_hash: str, column_text: str | None) -> str:
+        return await asyncio.to_thread(
+            self.path(content_hash).read_text, encoding="utf-8"
+        )
+
+    async def read_range(
+        self, content_hash: str, column_text: str | None, start: int, end: int | None
+    ) -> str:
+        return await asyncio.to_thread(
+            self._read_range, self.path(content_hash), start, end
+        )
+
+    async def delete(self, content_hash: str):
+        await asyncio.to_thread(self.path(content_hash).unlink, missing_ok=True)
+
+    @staticmethod
+    def _write(path: Path, text: str):
+        if path.exists():
+            # Same hash, same content
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file and rename it so readers never see a
+        # partially written text
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(text.encode("utf-8"))
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    @staticmethod
+    def _read_range(path: Path, start: int, end: int | None) -> str:
+        with path.open("rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # Empty files can't be mapped
+                return ""
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                start_byte = _byte_offset(buffer, start, 0)
+                if end is None:
+                    return buffer[start_byte:].decode("utf-8")
+                end_byte = _byte_offset(buffer, max(end - start, 0), start_byte)
+                return buffer[start_byte:end_byte].decode("utf-8")
+
+
+def _byte_offset(buffer: mmap.mmap, chars: int, position: int) -> int:
+    """
+    Returns the offset of the byte starting the character that comes chars
+    characters after position in UTF-8 buffer, or its size if there's none.
+
+    Whole chunks are counted in C by dropping their continuation bytes, only
+    the chunk holding the character is walked byte by byte.
+    """
+    size = len(buffer)
+    while position < size:
+        chunk = buffer[position : position + _SCAN_CHUNK_SIZE]
+        chunk_chars = len(chunk.translate(None, _UTF8_CONTINUATION))
+        if chunk_chars > chars:
+            break
+        chars -= chunk_chars
+        position += len(chunk)
+    else:
+        return size
+
+    for index, byte in enumerate(chunk):
+        if byte & 0xC0 != 0x80:
+            if chars == 0:
+                return position + index
+            chars -= 1
+    return size
+
+
+def get_storage(name: str | None = None) -> DatasetStorage:
+    """
+    Returns the storage backend called name, or the one configured for new
+    datasets if name is None.
+    """
+    name = name or settings().dataset_storage
+    if name == PostgresStorage.name:
+        return PostgresStorage()
+    if name == FilesystemStorage.name:
+        return FilesystemStorage(Path(settings().dataset_storage_path))
+    raise ValueError(f"Unknown dataset storage {name}")
@@ -0,0 +1,321 @@
+"""
+Long running operations executed in the background.
+
+Every task reports its progress through an operations row, so clients can
+poll it while the task runs.
+"""
+
+import asyncio
+import uuid
+from collections.abc import Awaitable, Callable
+from logging import getLogger
+
+import asyncpg
+
+from heron.db import category as db_category
+from heron.db import dataset as db_dataset
+from heron.db import label as db_label
+from heron.db import operation as db_operation
+from heron.db import project as db_project
+
+logger = getLogger(__name__)
+
+# Categories deleted by a single statement while purging, keeps locks short
+PURGE_BATCH_SIZE = 5000
+
+# Categories moved to another label by a single statement while merging
+MERGE_BATCH_SIZE = 5000
+# Categories copied by a single statement while cloning
+CLONE_BATCH_SIZE = 10000
+
+DELETE_DATASET = "delete_dataset"
+DELETE_LABEL = "delete_label"
+# Moves categories to another label, merging deletes the source labels too
+RELABEL = "relabel"
+MERGE_LABELS = "merge_labels"
+# Copies a project, with or without its categories
+CLONE_PROJECT = "clone_project"
+CLONE_ANNOTATED_PROJECT = "clone_annotated_project"
+
+
+class LabelDeletedError(Exception):
+    """
+    Raised when the label an operation writes to is deleted while it runs.
+    """
+
+
+async def _run(
+    pool: asyncpg.Pool,
+    operation_id: uuid.UUID,
+    task: Callable[[asyncpg.Connection], Awaitable[None]],
+):
+    """
+    Runs task with a connection of its own, keeping the operation status
+    up to date.
+    Every worker resumes the unfinished operations on startup, the one
+    holding the operation lock runs it and the others skip it.
+    """
+    async with pool.acquire() as conn:
+        if not await db_operation.try_lock(conn, operation_id):
+            return
+        try:
+            if not await db_operation.claim(conn, operation_id):
+                return
+            try:
+                await task(conn)
+            except Exception as exc:
+                logger.exception(exc)
+                await db_operation.update_status(
+                    conn, operation_id, db_operation.FAILED
+                )
+                return
+            await db_operation.update_status(conn, operation_id, db_operation.DONE)
+        finally:
+            await db_operation.unlock(conn, operation_id)
+
+
+async def purge_dataset(
+    pool: asyncpg.Pool,
+    operation_id: uuid.UUID,
+    project_id: uuid.UUID,
+    dataset_id: uuid.UUID,
+):
+    """
+    Deletes the categories of a hidden dataset in batches, then the dataset.
+    """
+
+    async def _purge(conn: asyncpg.Connection):
+        remaining = await db_category.count_by_dataset(conn, project_id, dataset_id)
+        await db_operation.add_progress(conn, operation_id, 0, remaining)
+        while deleted := await db_category.delete_batch_by_dataset(
+            conn, project_id, dataset_id, PURGE_BATCH_SIZE
+        ):
+            await db_operation.add_progress(conn, operation_id, deleted)
+        while await db_category.delete_tombstones_batch(
+            conn, dataset_id, PURGE_BATCH_SIZE
+        ):
+            pass
+        await db_dataset.delete(conn, dataset_id)
+
+    await _run(pool, operation_id, _purge)
+
+
+async def purge_label(
+    pool: asyncpg.Pool,
+    operation_id: uuid.UUID,
+    project_id: uuid.UUID,
+    label_id: uuid.UUID,
+):
+    """
+    Deletes the categories of a hidden label in batches, then the label.
+    """
+
+    async def _purge(conn: asyncpg.Connection):
+        remaining = await db_category.count_by_label(conn, project_id, label_id)
+        await db_operation.add_progress(conn, operation_id, 0, remaining)
+        while deleted := await db_category.delete_batch_by_label(
+            conn, project_id, label_id, PURGE_BATCH_SIZE
+        ):
+            await db_operation.add_progress(conn, operation_id, deleted)
+        await db_label.delete(conn, label_id)
+
+    await _run(pool, operation_id, _purge)
+
+
+async def merge_labels(
+    pool: asyncpg.Pool,
+    operation_id: uuid.UUID,
+    project_id: uuid.UUID,
+    source_ids: list[uuid.UUID],
+    target_id: uuid.UUID,
+    delete_sources: bool,
+):
+    """
+    Moves the categories of the source labels to the target one in batches,
+    one dataset at a time, then deletes the source labels if delete_sources
+    is set.
+
+    The operation fails if the target label gets deleted meanwhile, hidden
+    source labels are restored then.
+    """
+
+    async def _relabel(conn: asyncpg.Connection):
+        if await db_label.get_by_id(conn, target_id) is None:
+            raise LabelDeletedError(target_id)
+        for dataset_id in await db_category.get_dataset_ids_by_labels(
+            conn, project_id, source_ids
+        ):
+            moved = MERGE_BATCH_SIZE
+            while moved == MERGE_BATCH_SIZE:
+                relabeled = await db_category.relabel_batch(
+                    conn,
+                    project_id,
+                    dataset_id,
+                    source_ids,
+                    target_id,
+                    MERGE_BATCH_SIZE,
+                )
+                if relabeled is None:
+                    raise LabelDeletedError(target_id)
+                moved = relabeled
+                await db_operation.add_progress(conn, operation_id, moved)
+
+    async def _merge(conn: asyncpg.Connection):
+        remaining = await db_category.count_by_labels(conn, project_id, source_ids)
+        await db_operation.add_progress(conn, operation_id, 0, remaining)
+        try:
+            await _relabel(conn)
+            if not delete_sources:
+                return
+            for source_id in source_ids:
+                await db_label.hide(conn, project_id, source_id)
+            # Categories created while the first pass ran, deleting the labels
+            # would delete them too
+            await _relabel(conn)
+        except LabelDeletedError:
+            if delete_sources:
+                # Nothing is left to merge them into
+                for source_id in source_ids:
+                    await db_label.restore(conn, project_id, source_id)
+            raise
+        for source_id in source_ids:
+            await db_label.delete(conn, source_id)
+
+    await _run(pool, operation_id, _merge)
+
+
+async def clone_project(
+    pool: asyncpg.Pool,
+    operation_id: uuid.UUID,
+    source_id: uuid.UUID,
+    target_id: uuid.UUID,
+    with_categories: bool,
+):
+    """
+    Copies the labels and datasets of the source project into the target one,
+    then the categories in batches if with_categories is set.
+    Nothing goes through Python, every copy is an INSERT ... SELECT.
+    """
+
+    async def _clone(conn: asyncpg.Connection):
+        async with conn.transaction():
+            await db_project.clone_labels(conn, source_id, target_id)
+            dataset_ids = await db_project.clone_datasets(conn, source_id, target_id)
+        if not with_categories:
+            await db_operation.add_progress(conn, operation_id, len(dataset_ids), 0)
+            return
+
+        remaining = await db_category.count_by_datasets(conn, source_id, dataset_ids)
+        await db_operation.add_progress(conn, operation_id, 0, remaining)
+        for dataset_id in dataset_ids:
+            after = None
+            copied = CLONE_BATCH_SIZE
+            while copied == CLONE_BATCH_SIZE:
+                copied, after = await db_category.clone_batch(
+                    conn, source_id, dataset_id, target_id, after, CLONE_BATCH_SIZE
+                )
+                await db_operation.add_progress(conn, operation_id, copied)
+
+    await _run(pool, operation_id, _clone)
+
+
+async def compact_tombstones(conn: asyncpg.Connection, retention: int):
+    """
+    Deletes the tombstones of categories deleted more than retention changes
+    before the latest change of their dataset, the changes feed tells clients
+    with older cursors to resync instead.
+    """
+    for dataset_id, until_seq in await db_category.get_compactable_datasets(
+        conn, retention
+    ):
+        until_seq = await db_category.start_compaction(conn, dataset_id, until_seq)
+        while await db_category.compact_tombstones_batch(
+            conn, dataset_id, until_seq, PURGE_BATCH_SIZE
+        ):
+            pass
+
+
+async def schedule_tombstone_compaction(
+    pool: asyncpg.Pool, retention: int, interval: float
+):
+    """
+    Runs compact_tombstones every interval seconds.
+    """
+    while True:
+        try:
+            async with pool.acquire() as conn:
+                await compact_tombstones(conn, retention)
+        except Exception as exc:
+            logger.exception(exc)
+        await asyncio.sleep(interval)
+
+
+async def resume_operations(pool: asyncpg.Pool):
+    """
+    Restarts the operations interrupted by a shutdown, they're all idempotent.
+    """
+    async with pool.acquire() as conn:
+        operations = await db_operation.get_unfinished(
+            conn,
+            [
+                DELETE_DATASET,
+                DELETE_LABEL,
+                RELABEL,
+                MERGE_LABELS,
+                CLONE_PROJECT,
+                CLONE_ANNOTATED_PROJECT,
+            ],
+        )
+    for operation in operations:
+        if operation.kind == DELETE_DATASET:
+            await purge_dataset(
+                pool, operation.id, operation.project_id, operation.target_id
+            )
+        elif operation.kind == DELETE_LABEL:
+            await purge_label(
+                pool, operation.id, operation.project_id, operation.target_id
+            )
+        elif operation.kind in (CLONE_PROJECT, CLONE_ANNOTATED_PROJECT):
+            await clone_project(
+                pool,
+                operation.id,
+                operation.source_ids[0],
+                operation.target_id,
+                operation.kind == CLONE_ANNOTATED_PROJECT,
+            )
+        else:
+            await merge_labels(
+                pool,
+                operation.id,
+                operation.project_id,
+                operation.source_ids,
+                operation.target_id,
+                operation.kind == MERGE_LABELS,
+            )
+
+
+async def start_operation(
+    conn: asyncpg.Connection,
+    project_id: uuid.UUID,
+    kind: str,
+    target_id: uuid.UUID,
+    source_ids: list[uuid.UUID] | None = None,
+) -> uuid.UUID:
+    """
+    Records a new pending operation, returns its id.
+    """
+    operation_id = uuid.uuid4()
+    await db_operation.create(
+        conn,
+        db_operation.Operation(
+            id=operation_id,
+            project_id=project_id,
+            kind=kind,
+            target_id=target_id,
+            source_ids=source_ids or [],
+            status=db_operation.PENDING,
+            processed=0,
+            total=0,
+        ),
+    )
+    return operation_id
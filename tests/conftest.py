@@ -1,8 +1,11 @@
+import threading
 import uuid
-from collections.abc import Callable
+from collections.abc import Callable, Iterator
 from io import BytesIO
 from typing import Tuple
+from urllib.parse import urlencode
 
+import anyio
 import asyncpg
 import pytest
 import pytest_asyncio
@@ -82,7 +85,7 @@ def create_project(
         res = test_client.post(
             "/project",
             json={
-                "members": [],
+                "members": members,
                 "title": title,
                 "description": description,
             },
@@ -180,3 +183,55 @@ def create_category(
         return res.json()["category_id"]
 
     return _create_category
+
+
+@pytest.fixture
+def open_stream(test_client: TestClient) -> Iterator[Callable[..., threading.Event]]:
+    """
+    Returns a function that starts a GET request on the app loop without
+    waiting for its response to end, and returns an event set once the first
+    body chunk arrives. Like a slow client, the request then holds the
+    response until the test ends and it disconnects.
+    """
+    portal = test_client.portal
+    assert portal is not None
+    disconnected = portal.call(anyio.Event)
+
+    async def receive():
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    def _open_stream(
+        path: str,
+        user_token: str,
+        params: dict | None = None,
+        headers: dict[str, str] | None = None,
+    ) -> threading.Event:
+        first_chunk = threading.Event()
+
+        async def send(message):
+            if message["type"] == "http.response.body" and message["body"]:
+                first_chunk.set()
+                await disconnected.wait()
+
+        headers = {**(headers or {}), "authorization": f"Bearer {user_token}"}
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": "GET",
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": urlencode(params or {}).encode(),
+            "root_path": "",
+            "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+            "client": ("testclient", 50000),
+            "server": ("testserver", 80),
+            "state": test_client.app_state.copy(),
+        }
+        portal.start_task_soon(app, scope, receive, send)
+        return first_chunk
+
+    yield _open_stream
+    portal.call(disconnected.set)
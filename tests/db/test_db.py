@@ -1,5 +1,8 @@
+import hashlib
+import uuid
 from unittest.mock import AsyncMock, MagicMock, call, patch
 
+import asyncpg
 import pytest
 
 from heron.db.db import create_connection_pool, create_tables
@@ -40,7 +43,12 @@ async def test_create_tables():
                 "id UUID PRIMARY KEY, "
                 "owner UUID references users(id), "
                 "title TEXT NOT NULL, "
-                "description TEXT NOT NULL"
+                "description TEXT NOT NULL, "
+                "labels_version BIGINT NOT NULL DEFAULT 0, "
+                "datasets_version BIGINT NOT NULL DEFAULT 0, "
+                "overlap_policy TEXT NOT NULL DEFAULT 'allow', "
+                "dataset_count BIGINT NOT NULL DEFAULT 0, "
+                "label_count BIGINT NOT NULL DEFAULT 0"
                 ")"
             ),
             call(
@@ -51,3 +59,118 @@ async def test_create_tables():
             ),
         ]
     )
+
+
+async def test_create_tables_upgrades_baseline_schema(db: asyncpg.Connection):
+    # The schema and rows as the first release left them
+    user_id, project_id, dataset_id, label_id = (uuid.uuid4() for _ in range(4))
+    text = "Grüße from the heron"
+    try:
+        await db.execute(
+            "CREATE TABLE users (id UUID PRIMARY KEY, username TEXT NOT NULL "
+            "UNIQUE, email TEXT NOT NULL UNIQUE, password_hash TEXT NOT NULL)"
+        )
+        await db.execute(
+            "CREATE TABLE projects (id UUID PRIMARY KEY, "
+            "owner UUID references users(id), title TEXT NOT NULL, "
+            "description TEXT NOT NULL)"
+        )
+        await db.execute(
+            "CREATE TABLE project_members (project_id UUID references projects(id), "
+            "user_id UUID references users(id), PRIMARY KEY (project_id, user_id))"
+        )
+        await db.execute(
+            "CREATE TABLE datasets (id UUID PRIMARY KEY, "
+            "project_id UUID references projects(id), filename TEXT, "
+            "text TEXT NOT NULL)"
+        )
+        await db.execute(
+            "CREATE TABLE labels (id UUID PRIMARY KEY, "
+            "project_id UUID references projects(id), name TEXT NOT NULL, "
+            "color VARCHAR(7) NOT NULL)"
+        )
+        await db.execute(
+            "CREATE TABLE categories (id UUID PRIMARY KEY, "
+            "label_id UUID references labels(id) ON DELETE CASCADE, "
+            "project_id UUID references projects(id), "
+            "dataset_id UUID references datasets(id) ON DELETE CASCADE, "
+            "start_offset INTEGER NOT NULL, end_offset INTEGER NOT NULL)"
+        )
+        await db.execute(
+            "INSERT INTO users VALUES ($1, 'user', 'user@example.com', 'hash')",
+            user_id,
+        )
+        await db.execute(
+            "INSERT INTO projects VALUES ($1, $2, 'Project', 'Description')",
+            project_id,
+            user_id,
+        )
+        await db.execute(
+            "INSERT INTO datasets VALUES ($1, $2, 'hello.txt', $3)",
+            dataset_id,
+            project_id,
+            text,
+        )
+        await db.execute(
+            "INSERT INTO labels VALUES ($1, $2, 'Label', '#FF0000')",
+            label_id,
+            project_id,
+        )
+        await db.execute(
+            "INSERT INTO categories VALUES ($1, $2, $3, $4, 0, 5)",
+            uuid.uuid4(),
+            label_id,
+            project_id,
+            dataset_id,
+        )
+
+        # Running it again on the upgraded schema changes nothing
+        for _ in range(2):
+            await create_tables(db)
+
+            project = await db.fetchrow("SELECT * FROM projects")
+            assert project["labels_version"] == 0
+            assert project["datasets_version"] == 0
+            assert project["overlap_policy"] == "allow"
+            assert project["dataset_count"] == 1
+            assert project["label_count"] == 1
+            dataset = await db.fetchrow("SELECT * FROM datasets")
+            assert dataset["storage"] == "postgres"
+            assert dataset["text"] == text
+            assert dataset["text_length"] == len(text)
+            assert (
+                dataset["content_hash"]
+                == hashlib.sha256(text.encode("utf-8")).hexdigest()
+            )
+            assert dataset["categories_version"] == 0
+            assert dataset["tombstones_compacted_seq"] == 0
+            assert not dataset["deleted"]
+            assert await db.fetchval(
+                "SELECT search_vector @@ to_tsquery('simple', 'heron') FROM datasets"
+            )
+            label = await db.fetchrow("SELECT * FROM labels")
+            assert label["parent_id"] is None
+            assert label["path"] == f"{label_id}/"
+            assert label["version"] == 0
+            assert not label["deleted"]
+            category = await db.fetchrow("SELECT * FROM categories")
+            assert category["seq"] == 0
+            assert category["created_by"] is None
+
+        not_null_columns = await db.fetch(
+            "SELECT table_name, column_name FROM information_schema.columns "
+            "WHERE table_schema = current_schema() AND is_nullable = 'NO' "
+            "AND column_name IN ('search_vector', 'content_hash', 'text_length', "
+            "'path', 'dataset_count', 'label_count')"
+        )
+        assert {tuple(c) for c in not_null_columns} == {
+            ("projects", "dataset_count"),
+            ("projects", "label_count"),
+            ("datasets", "search_vector"),
+            ("datasets", "content_hash"),
+            ("datasets", "text_length"),
+            ("labels", "path"),
+        }
+    finally:
+        await db.execute("DROP SCHEMA public CASCADE")
+        await db.execute("CREATE SCHEMA public")
@@ -1,9 +1,19 @@
+import json
+import threading
+import uuid
 from collections.abc import Callable
 from typing import Tuple
 
 import asyncpg
+import pytest
 from starlette.testclient import TestClient
 
+from heron import tasks
+from heron.columnar import MSGPACK_MEDIA_TYPE, decode_categories
+from heron.config import settings
+from heron.db import category as db_category
+from heron.routers import category as category_router
+
 
 async def test_create_category(
     test_client: TestClient,
@@ -146,6 +156,109 @@ async def test_update_category(
     assert updated_category["end_offset"] == 6
 
 
+async def test_update_category_label_and_precondition(
+    test_client: TestClient,
+    db: asyncpg.Connection,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+    create_label: Callable[..., str],
+    create_category: Callable[..., str],
+):
+    user_id, token = create_user(username="test_user")
+    project_id = create_project(
+        user_token=token, title="Test Project", description="Test Description"
+    )
+    dataset_id = create_dataset(
+        user_token=token, project_id=project_id, file=("test.txt", b"Test content")
+    )
+    label_id = create_label(
+        user_token=token, project_id=project_id, name="Test Label", color="#FF0000"
+    )
+    other_label_id = create_label(
+        user_token=token, project_id=project_id, name="Other Label", color="#00FF00"
+    )
+    category_id = create_category(
+        user_token=token,
+        project_id=project_id,
+        dataset_id=dataset_id,
+        label_id=label_id,
+        start_offset=0,
+        end_offset=5,
+    )
+    url = f"/project/{project_id}/dataset/{dataset_id}/category/{category_id}"
+    headers = {"Authorization": f"Bearer {token}"}
+
+    res = test_client.put(
+        url, headers=headers, json={"id": category_id, "label_id": other_label_id}
+    )
+    assert res.status_code == 200
+    assert res.json()["label_id"] == other_label_id
+    assert res.json()["start_offset"] == 0
+    etag = res.headers["ETag"]
+    stored = await db.fetchrow("SELECT * FROM categories WHERE id = $1", category_id)
+    assert str(stored["label_id"]) == other_label_id
+
+    res = test_client.put(
+        url,
+        headers={**headers, "If-Match": etag},
+        json={"id": category_id, "end_offset": 6},
+    )
+    assert res.status_code == 200
+    assert res.headers["ETag"] != etag
+
+    # Someone else wrote it since
+    res = test_client.put(
+        url,
+        headers={**headers, "If-Match": etag},
+        json={"id": category_id, "end_offset": 7},
+    )
+    assert res.status_code == 412
+    stored = await db.fetchrow("SELECT * FROM categories WHERE id = $1", category_id)
+    assert stored["end_offset"] == 6
+
+    # Reads give the current ETag to retry with
+    res = test_client.get(url, headers=headers)
+    assert res.status_code == 200
+    assert res.json()["seq"] == stored["seq"]
+    etag = res.headers["ETag"]
+    res = test_client.get(
+        f"/project/{project_id}/dataset/{dataset_id}/category",
+        params={"limit": 10},
+        headers=headers,
+    )
+    assert [c["seq"] for c in res.json()] == [stored["seq"]]
+    res = test_client.put(
+        url,
+        headers={**headers, "If-Match": etag},
+        json={"id": category_id, "end_offset": 7},
+    )
+    assert res.status_code == 200
+    assert res.json()["seq"] > stored["seq"]
+    stored = await db.fetchrow("SELECT * FROM categories WHERE id = $1", category_id)
+    assert stored["end_offset"] == 7
+
+    # Checks made on the written category roll it back
+    res = test_client.put(
+        url, headers=headers, json={"id": category_id, "end_offset": 100}
+    )
+    assert res.status_code == 400
+    res = test_client.put(
+        url, headers=headers, json={"id": category_id, "label_id": str(uuid.uuid4())}
+    )
+    assert res.status_code == 404
+    stored = await db.fetchrow("SELECT * FROM categories WHERE id = $1", category_id)
+    assert stored["end_offset"] == 7
+    assert str(stored["label_id"]) == other_label_id
+
+    res = test_client.put(
+        f"/project/{project_id}/dataset/{dataset_id}/category/{uuid.uuid4()}",
+        headers={**headers, "If-Match": etag},
+        json={"id": category_id, "end_offset": 7},
+    )
+    assert res.status_code == 404
+
+
 async def test_delete_category(
     test_client: TestClient,
     db: asyncpg.Connection,
@@ -184,6 +297,7 @@ async def test_delete_category(
 
     categories = await db.fetch("SELECT * FROM categories")
     assert len(categories) == 0
+    version = await db.fetchval("SELECT categories_version FROM datasets")
 
     res = test_client.delete(
         f"/project/{project_id}/dataset/{dataset_id}/category/{category_id}",
@@ -193,3 +307,960 @@ async def test_delete_category(
 
     categories = await db.fetch("SELECT * FROM categories")
     assert len(categories) == 0
+    # Deleting nothing doesn't make cached listings stale
+    assert await db.fetchval("SELECT categories_version FROM datasets") == version
+    assert await db.fetchval("SELECT COUNT(*) FROM category_tombstones") == 1
+
+
+async def test_get_dataset_categories_not_modified(
+    test_client: TestClient,
+    db: asyncpg.Connection,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+    create_label: Callable[..., str],
+    create_category: Callable[..., str],
+):
+    user_id, token = create_user(username="test_user")
+    project_id = create_project(
+        user_token=token, title="Test Project", description="Test Description"
+    )
+    dataset_id = create_dataset(
+        user_token=token, project_id=project_id, file=("test.txt", b"Test content")
+    )
+    label_id = create_label(
+        user_token=token, project_id=project_id, name="Test Label", color="#FF0000"
+    )
+    create_category(
+        user_token=token,
+        project_id=project_id,
+        dataset_id=dataset_id,
+        label_id=label_id,
+        start_offset=0,
+        end_offset=4,
+    )
+
+    res = test_client.get(
+        f"/project/{project_id}/dataset/{dataset_id}/category",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert res.status_code == 200
+    etag = res.headers["ETag"]
+    assert res.headers["Vary"] == "Accept, Accept-Encoding"
+
+    res = test_client.get(
+        f"/project/{project_id}/dataset/{dataset_id}/category",
+        headers={"Authorization": f"Bearer {token}", "If-None-Match": etag},
+    )
+    assert res.status_code == 304
+    assert res.headers["Vary"] == "Accept, Accept-Encoding"
+
+    # The NDJSON stream of the same categories doesn't match it
+    res = test_client.get(
+        f"/project/{project_id}/dataset/{dataset_id}/category",
+        headers={
+            "Authorization": f"Bearer {token}",
+            "Accept": "application/x-ndjson",
+            "Accept-Encoding": "identity",
+            "If-None-Match": etag.replace("-gzip", ""),
+        },
+    )
+    assert res.status_code == 200
+    assert res.headers["ETag"] != etag.replace("-gzip", "")
+    assert res.headers["Vary"] == "Accept, Accept-Encoding"
+
+    create_category(
+        user_token=token,
+        project_id=project_id,
+        dataset_id=dataset_id,
+        label_id=label_id,
+        start_offset=5,
+        end_offset=12,
+    )
+    res = test_client.get(
+        f"/project/{project_id}/dataset/{dataset_id}/category",
+        headers={"Authorization": f"Bearer {token}", "If-None-Match": etag},
+    )
+    assert res.status_code == 200
+    assert len(res.json()) == 2
+    etag = res.headers["ETag"]
+
+    test_client.delete(
+        f"/project/{project_id}/label/{label_id}",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    res = test_client.get(
+        f"/project/{project_id}/dataset/{dataset_id}/category",
+        headers={"Authorization": f"Bearer {token}", "If-None-Match": etag},
+    )
+    assert res.status_code == 200
+    assert res.json() == []
+
+
+async def test_batch_categories(
+    test_client: TestClient,
+    db: asyncpg.Connection,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+    create_label: Callable[..., str],
+    create_category: Callable[..., str],
+):
+    user_id, token = create_user(username="test_user")
+    project_id = create_project(
+        user_token=token, title="Test Project", description="Test Description"
+    )
+    dataset_id = create_dataset(
+        user_token=token, project_id=project_id, file=("test.txt", b"Test content")
+    )
+    label_id = create_label(
+        user_token=token, project_id=project_id, name="Test Label", color="#FF0000"
+    )
+    other_label_id = create_label(
+        user_token=token, project_id=project_id, name="Other Label", color="#00FF00"
+    )
+    to_update = create_category(
+        user_token=token,
+        project_id=project_id,
+        dataset_id=dataset_id,
+        label_id=label_id,
+        start_offset=0,
+        end_offset=4,
+    )
+    to_delete = create_category(
+        user_token=token,
+        project_id=project_id,
+        dataset_id=dataset_id,
+        label_id=label_id,
+        start_offset=5,
+        end_offset=12,
+    )
+
+    res = test_client.post(
+        f"/project/{project_id}/dataset/{dataset_id}/category/batch",
+        headers={"Authorization": f"Bearer {token}"},
+        json={
+            "operations": [
+                {
+                    "op": "create",
+                    "label_id": other_label_id,
+                    "start_offset": 1,
+                    "end_offset": 3,
+                },
+                {"op": "update", "id": to_update, "start_offset": 1},
+                {"op": "update", "id": to_update, "label_id": other_label_id},
+                {"op": "delete", "id": to_delete},
+                {"op": "delete", "id": to_delete},
+                {
+                    "op": "create",
+                    "label_id": str(uuid.uuid4()),
+                    "start_offset": 1,
+                    "end_offset": 3,
+                },
+                {"op": "create", "label_id": label_id},
+                {"op": "update", "id": str(uuid.uuid4()), "start_offset": 2},
+            ]
+        },
+    )
+    assert res.status_code == 200
+    results = res.json()
+    assert len(results) == 8
+    assert results[0]["status"] == "ok"
+    created_id = results[0]["id"]
+    assert results[1] == {"status": "ok", "id": to_update, "detail": None}
+    assert results[2] == {"status": "ok", "id": to_update, "detail": None}
+    assert results[3] == {"status": "ok", "id": to_delete, "detail": None}
+    assert results[4]["status"] == "error"
+    assert results[4]["detail"] == "Category not found"
+    assert results[5]["status"] == "error"
+    assert results[5]["detail"] == "Label not found"
+    assert results[6]["status"] == "error"
+    assert results[7]["status"] == "error"
+    assert results[7]["detail"] == "Category not found"
+
+    categories = {
+        str(c["id"]): c
+        for c in await db.fetch("SELECT * FROM categories ORDER BY start_offset")
+    }
+    assert set(categories) == {created_id, to_update}
+    assert str(categories[created_id]["label_id"]) == other_label_id
+    assert categories[created_id]["start_offset"] == 1
+    assert categories[created_id]["end_offset"] == 3
+    assert str(categories[to_update]["label_id"]) == other_label_id
+    assert categories[to_update]["start_offset"] == 1
+    assert categories[to_update]["end_offset"] == 4
+
+
+async def test_get_dataset_categories_window(
+    test_client: TestClient,
+    db: asyncpg.Connection,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+    create_label: Callable[..., str],
+    create_category: Callable[..., str],
+):
+    user_id, token = create_user(username="test_user")
+    project_id = create_project(
+        user_token=token, title="Test Project", description="Test Description"
+    )
+    dataset_id = create_dataset(
+        user_token=token,
+        project_id=project_id,
+        file=("test.txt", b"The quick brown fox jumps over the lazy dog"),
+    )
+    label_id = create_label(
+        user_token=token, project_id=project_id, name="Test Label", color="#FF0000"
+    )
+    spans = [(0, 3), (4, 9), (10, 15), (0, 43), (16, 19), (40, 43)]
+    category_ids = {
+        span: create_category(
+            user_token=token,
+            project_id=project_id,
+            dataset_id=dataset_id,
+            label_id=label_id,
+            start_offset=span[0],
+            end_offset=span[1],
+        )
+        for span in spans
+    }
+
+    def get_window(**params) -> list[tuple[int, int]]:
+        res = test_client.get(
+            f"/project/{project_id}/dataset/{dataset_id}/category",
+            params=params,
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert res.status_code == 200
+        for category in res.json():
+            span = (category["start_offset"], category["end_offset"])
+            assert category["id"] == category_ids[span]
+        # Categories starting at the same offset are ordered by id
+        return sorted((c["start_offset"], c["end_offset"]) for c in res.json())
+
+    assert get_window(start=9, end=16) == [(0, 43), (10, 15)]
+    assert get_window(start=3, end=4) == [(0, 43)]
+    assert get_window(start=18) == [(0, 43), (16, 19), (40, 43)]
+    assert get_window(end=4) == [(0, 3), (0, 43)]
+    assert get_window() == sorted(spans)
+
+    # Windows stay exact once the longest span is shortened
+    long_id = category_ids.pop((0, 43))
+    res = test_client.put(
+        f"/project/{project_id}/dataset/{dataset_id}/category/{long_id}",
+        headers={"Authorization": f"Bearer {token}"},
+        json={"id": long_id, "start_offset": 0, "end_offset": 2},
+    )
+    assert res.status_code == 200
+    category_ids[(0, 2)] = long_id
+    assert get_window(start=9, end=16) == [(10, 15)]
+    assert get_window(start=1, end=4) == [(0, 2), (0, 3)]
+    assert get_window(start=18) == [(16, 19), (40, 43)]
+
+
+async def test_get_dataset_categories_pages(
+    test_client: TestClient,
+    db: asyncpg.Connection,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+    create_label: Callable[..., str],
+    create_category: Callable[..., str],
+):
+    user_id, token = create_user(username="test_user")
+    project_id = create_project(
+        user_token=token, title="Test Project", description="Test Description"
+    )
+    dataset_id = create_dataset(
+        user_token=token, project_id=project_id, file=("test.txt", b"Test content")
+    )
+    label_id = create_label(
+        user_token=token, project_id=project_id, name="Test Label", color="#FF0000"
+    )
+    for start_offset in [4, 0, 2, 2, 7]:
+        create_category(
+            user_token=token,
+            project_id=project_id,
+            dataset_id=dataset_id,
+            label_id=label_id,
+            start_offset=start_offset,
+            end_offset=start_offset + 1,
+        )
+
+    res = test_client.get(
+        f"/project/{project_id}/dataset/{dataset_id}/category",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    expected = [c["id"] for c in res.json()]
+
+    ids: list[str] = []
+    params: dict = {"limit": 2}
+    while True:
+        res = test_client.get(
+            f"/project/{project_id}/dataset/{dataset_id}/category",
+            params=params,
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert res.status_code == 200
+        ids.extend(c["id"] for c in res.json())
+        if "X-Next-Cursor" not in res.headers:
+            break
+        params["after"] = res.headers["X-Next-Cursor"]
+    assert ids == expected
+
+    res = test_client.get(
+        f"/project/{project_id}/dataset/{dataset_id}/category",
+        headers={
+            "Authorization": f"Bearer {token}",
+            "Accept": "application/x-ndjson",
+        },
+    )
+    assert res.status_code == 200
+    assert res.headers["Content-Type"] == "application/x-ndjson"
+    lines = res.text.splitlines()
+    assert [json.loads(line)["id"] for line in lines] == expected
+
+    res = test_client.get(
+        f"/project/{project_id}/dataset/{dataset_id}/category",
+        headers={
+            "Authorization": f"Bearer {token}",
+            "Accept": MSGPACK_MEDIA_TYPE,
+        },
+    )
+    assert res.status_code == 200
+    assert res.headers["Content-Type"] == MSGPACK_MEDIA_TYPE
+    assert [str(c.id) for c in decode_categories(res.content)] == expected
+
+    res = test_client.get(
+        f"/project/{project_id}/dataset/{dataset_id}/category",
+        params={"after": "nope"},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert res.status_code == 400
+
+
+async def test_ndjson_streams_release_connections(
+    test_client: TestClient,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+    create_label: Callable[..., str],
+    create_category: Callable[..., str],
+    open_stream: Callable[..., threading.Event],
+):
+    user_id, token = create_user(username="test_user")
+    project_id = create_project(
+        user_token=token, title="Test Project", description="Test Description"
+    )
+    dataset_id = create_dataset(
+        user_token=token, project_id=project_id, file=("test.txt", b"Test content")
+    )
+    label_id = create_label(
+        user_token=token, project_id=project_id, name="Test Label", color="#FF0000"
+    )
+    create_category(
+        user_token=token,
+        project_id=project_id,
+        dataset_id=dataset_id,
+        label_id=label_id,
+        start_offset=0,
+        end_offset=4,
+    )
+
+    # Each held stream keeps its own connection, with the request one it
+    # would take more connections than the pool has
+    pool_size = test_client.app_state["db_pool"].get_max_size()
+    streams = [
+        open_stream(
+            f"/project/{project_id}/dataset/{dataset_id}/category",
+            token,
+            headers={"Accept": "application/x-ndjson"},
+        )
+        for _ in range(pool_size // 2 + 1)
+    ]
+    for first_chunk in streams:
+        assert first_chunk.wait(10)
+
+    res = test_client.get(
+        f"/project/{project_id}/dataset/{dataset_id}/category",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert res.status_code == 200
+
+
+async def test_get_dataset_categories_snapshot(
+    test_client: TestClient,
+    db: asyncpg.Connection,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+    create_label: Callable[..., str],
+    create_category: Callable[..., str],
+):
+    user_id, token = create_user(username="test_user")
+    project_id = create_project(
+        user_token=token, title="Test Project", description="Test Description"
+    )
+    dataset_id = create_dataset(
+        user_token=token, project_id=project_id, file=("test.txt", b"Test content")
+    )
+    label_id = create_label(
+        user_token=token, project_id=project_id, name="Test Label", color="#FF0000"
+    )
+    first_id = create_category(
+        user_token=token,
+        project_id=project_id,
+        dataset_id=dataset_id,
+        label_id=label_id,
+        start_offset=0,
+        end_offset=4,
+    )
+
+    def get_categories(encoding: str) -> list[str]:
+        res = test_client.get(
+            f"/project/{project_id}/dataset/{dataset_id}/category",
+            headers={"Authorization": f"Bearer {token}", "Accept-Encoding": encoding},
+        )
+        assert res.status_code == 200
+        assert res.headers.get("Content-Encoding") == (
+            "gzip" if encoding == "gzip" else None
+        )
+        return [c["id"] for c in res.json()]
+
+    for _ in range(2):
+        assert get_categories("gzip") == [first_id]
+        assert get_categories("identity") == [first_id]
+
+    # Writes make the cached listings stale
+    second_id = create_category(
+        user_token=token,
+        project_id=project_id,
+        dataset_id=dataset_id,
+        label_id=label_id,
+        start_offset=5,
+        end_offset=12,
+    )
+    assert get_categories("gzip") == [first_id, second_id]
+    test_client.delete(
+        f"/project/{project_id}/label/{label_id}",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert get_categories("identity") == []
+
+
+async def test_get_dataset_categories_other_project(
+    test_client: TestClient,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+    create_label: Callable[..., str],
+    create_category: Callable[..., str],
+):
+    _, alice_token = create_user(username="alice")
+    _, bob_token = create_user(username="bob")
+    alice_project_id = create_project(
+        user_token=alice_token, title="Alice Project", description="Alice"
+    )
+    bob_project_id = create_project(
+        user_token=bob_token, title="Bob Project", description="Bob"
+    )
+    bob_dataset_id = create_dataset(
+        user_token=bob_token,
+        project_id=bob_project_id,
+        file=("test.txt", b"Test content"),
+    )
+    bob_label_id = create_label(
+        user_token=bob_token,
+        project_id=bob_project_id,
+        name="Test Label",
+        color="#FF0000",
+    )
+    category_id = create_category(
+        user_token=bob_token,
+        project_id=bob_project_id,
+        dataset_id=bob_dataset_id,
+        label_id=bob_label_id,
+        start_offset=0,
+        end_offset=4,
+    )
+
+    for accept in ("application/json", MSGPACK_MEDIA_TYPE):
+        res = test_client.get(
+            f"/project/{alice_project_id}/dataset/{bob_dataset_id}/category",
+            headers={"Authorization": f"Bearer {alice_token}", "Accept": accept},
+        )
+        assert res.status_code == 404
+        # Nothing was cached for the dataset under Alice's project
+        assert not any(
+            key[:2] == (uuid.UUID(alice_project_id), uuid.UUID(bob_dataset_id))
+            for key in category_router._snapshot_cache()._entries
+        )
+
+    res = test_client.get(
+        f"/project/{bob_project_id}/dataset/{bob_dataset_id}/category",
+        headers={"Authorization": f"Bearer {bob_token}"},
+    )
+    assert res.status_code == 200
+    assert [c["id"] for c in res.json()] == [category_id]
+
+
+async def test_snapshot_cache_reads_settings_on_first_use(
+    test_client: TestClient,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+    monkeypatch: pytest.MonkeyPatch,
+):
+    user_id, token = create_user(username="test_user")
+    project_id = create_project(
+        user_token=token, title="Test Project", description="Test Description"
+    )
+    dataset_id = create_dataset(
+        user_token=token, project_id=project_id, file=("test.txt", b"Test content")
+    )
+    monkeypatch.setattr(settings(), "category_cache_size", 0)
+    category_router._snapshot_cache.cache_clear()
+    try:
+        res = test_client.get(
+            f"/project/{project_id}/dataset/{dataset_id}/category",
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert res.status_code == 200
+        assert category_router._snapshot_cache().max_size == 0
+        assert category_router._snapshot_cache().size == 0
+    finally:
+        category_router._snapshot_cache.cache_clear()
+
+
+async def test_get_dataset_category_changes(
+    test_client: TestClient,
+    db: asyncpg.Connection,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+    create_label: Callable[..., str],
+    create_category: Callable[..., str],
+):
+    user_id, token = create_user(username="test_user")
+    project_id = create_project(
+        user_token=token, title="Test Project", description="Test Description"
+    )
+    dataset_id = create_dataset(
+        user_token=token, project_id=project_id, file=("test.txt", b"Test content")
+    )
+    label_id = create_label(
+        user_token=token, project_id=project_id, name="Test Label", color="#FF0000"
+    )
+    other_label_id = create_label(
+        user_token=token, project_id=project_id, name="Other Label", color="#00FF00"
+    )
+
+    def get_changes(since: int) -> dict:
+        res = test_client.get(
+            f"/project/{project_id}/dataset/{dataset_id}/category/changes",
+            params={"since": since},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert res.status_code == 200
+        return res.json()
+
+    first_id = create_category(
+        user_token=token,
+        project_id=project_id,
+        dataset_id=dataset_id,
+        label_id=label_id,
+        start_offset=0,
+        end_offset=4,
+    )
+    second_id = create_category(
+        user_token=token,
+        project_id=project_id,
+        dataset_id=dataset_id,
+        label_id=label_id,
+        start_offset=5,
+        end_offset=12,
+    )
+    third_id = create_category(
+        user_token=token,
+        project_id=project_id,
+        dataset_id=dataset_id,
+        label_id=other_label_id,
+        start_offset=5,
+        end_offset=12,
+    )
+
+    result = get_changes(0)
+    assert [c["id"] for c in result["changes"]] == [first_id, second_id, third_id]
+    assert result["changes"][0]["deleted"] is False
+    assert result["changes"][0]["start_offset"] == 0
+    cursor = first_cursor = result["cursor"]
+    assert get_changes(cursor) == {"cursor": cursor, "changes": [], "resync": False}
+
+    test_client.put(
+        f"/project/{project_id}/dataset/{dataset_id}/category/{first_id}",
+        headers={"Authorization": f"Bearer {token}"},
+        json={"id": first_id, "start_offset": 1, "end_offset": 4},
+    )
+    test_client.delete(
+        f"/project/{project_id}/dataset/{dataset_id}/category/{second_id}",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    result = get_changes(cursor)
+    assert result["cursor"] > cursor
+    changes = result["changes"]
+    assert len(changes) == 2
+    assert changes[0]["id"] == first_id
+    assert changes[0]["deleted"] is False
+    assert changes[0]["start_offset"] == 1
+    assert changes[1] == {
+        "id": second_id,
+        "deleted": True,
+        "label_id": None,
+        "start_offset": None,
+        "end_offset": None,
+        "seq": result["cursor"],
+    }
+    cursor = result["cursor"]
+
+    test_client.delete(
+        f"/project/{project_id}/label/{other_label_id}",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    result = get_changes(cursor)
+    assert [(c["id"], c["deleted"]) for c in result["changes"]] == [(third_id, True)]
+
+    # Only the tombstone of the latest change is kept, older cursors resync
+    await tasks.compact_tombstones(db, retention=1)
+    tombstones = await db.fetch("SELECT category_id FROM category_tombstones")
+    assert [str(t["category_id"]) for t in tombstones] == [third_id]
+    latest = result["cursor"]
+    assert get_changes(first_cursor) == {
+        "cursor": latest,
+        "changes": [],
+        "resync": True,
+    }
+    result = get_changes(cursor)
+    assert not result["resync"]
+    assert [c["id"] for c in result["changes"]] == [third_id]
+
+
+async def test_category_overlap_policy(
+    test_client: TestClient,
+    db: asyncpg.Connection,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+    create_label: Callable[..., str],
+    create_category: Callable[..., str],
+):
+    user_id, token = create_user(username="test_user")
+    project_id = create_project(
+        user_token=token, title="Test Project", description="Test Description"
+    )
+    dataset_id = create_dataset(
+        user_token=token, project_id=project_id, file=("test.txt", b"Test content")
+    )
+    label_id = create_label(
+        user_token=token, project_id=project_id, name="Test Label", color="#FF0000"
+    )
+    other_label_id = create_label(
+        user_token=token, project_id=project_id, name="Other Label", color="#00FF00"
+    )
+    first_id = create_category(
+        user_token=token,
+        project_id=project_id,
+        dataset_id=dataset_id,
+        label_id=label_id,
+        start_offset=0,
+        end_offset=4,
+    )
+    res = test_client.put(
+        "/project",
+        headers={"Authorization": f"Bearer {token}"},
+        json={"id": project_id, "overlap_policy": "forbid_same_label"},
+    )
+    assert res.status_code == 200
+
+    def create(label_id: str, start_offset: int, end_offset: int):
+        return test_client.post(
+            f"/project/{project_id}/dataset/{dataset_id}/category",
+            headers={"Authorization": f"Bearer {token}"},
+            json={
+                "label_id": label_id,
+                "start_offset": start_offset,
+                "end_offset": end_offset,
+            },
+        )
+
+    assert create(label_id, 4, 2).status_code == 400
+    assert create(label_id, 5, 13).status_code == 400
+
+    res = create(label_id, 2, 6)
+    assert res.status_code == 409
+    assert res.json()["detail"] == f"Category overlaps category {first_id}"
+    assert create(label_id, 4, 6).status_code == 200
+    assert create(other_label_id, 2, 6).status_code == 200
+
+    res = test_client.put(
+        f"/project/{project_id}/dataset/{dataset_id}/category/{first_id}",
+        headers={"Authorization": f"Bearer {token}"},
+        json={"id": first_id, "start_offset": 3, "end_offset": 5},
+    )
+    assert res.status_code == 409
+
+    res = test_client.post(
+        f"/project/{project_id}/dataset/{dataset_id}/category/batch",
+        headers={"Authorization": f"Bearer {token}"},
+        json={
+            "operations": [
+                {"op": "delete", "id": first_id},
+                {
+                    "op": "create",
+                    "label_id": label_id,
+                    "start_offset": 0,
+                    "end_offset": 3,
+                },
+                {
+                    "op": "create",
+                    "label_id": label_id,
+                    "start_offset": 2,
+                    "end_offset": 4,
+                },
+            ]
+        },
+    )
+    assert [r["status"] for r in res.json()] == ["ok", "ok", "error"]
+
+    res = test_client.get(
+        f"/project/{project_id}/dataset/{dataset_id}/category/overlaps",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert res.status_code == 200
+    report = res.json()
+    assert report["overlap_policy"] == "forbid_same_label"
+    assert report["violations"] == 0
+    assert [(o["start_offset"], o["end_offset"]) for o in report["overlaps"]] == [
+        (2, 3),
+        (4, 6),
+    ]
+    assert not any(o["same_label"] for o in report["overlaps"])
+
+
+async def test_category_version_is_project_scoped(
+    test_client: TestClient,
+    db: asyncpg.Connection,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+):
+    _, alice_token = create_user(username="alice")
+    _, bob_token = create_user(username="bob")
+    alice_project_id = create_project(
+        user_token=alice_token, title="Alice Project", description="Alice"
+    )
+    bob_project_id = create_project(
+        user_token=bob_token, title="Bob Project", description="Bob"
+    )
+    bob_dataset_id = create_dataset(
+        user_token=bob_token,
+        project_id=bob_project_id,
+        file=("test.txt", b"Test content"),
+    )
+
+    assert await db_category.get_version(
+        db, uuid.UUID(bob_project_id), uuid.UUID(bob_dataset_id)
+    )
+    assert (
+        await db_category.get_version(
+            db, uuid.UUID(alice_project_id), uuid.UUID(bob_dataset_id)
+        )
+        is None
+    )
+
+    res = test_client.get(
+        f"/project/{alice_project_id}/dataset/{bob_dataset_id}/category/overlaps",
+        headers={"Authorization": f"Bearer {alice_token}"},
+    )
+    assert res.status_code == 404
+
+
+async def test_create_category_offsets_bounds(
+    test_client: TestClient,
+    db: asyncpg.Connection,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+    create_label: Callable[..., str],
+):
+    user_id, token = create_user(username="test_user")
+    project_id = create_project(
+        user_token=token, title="Test Project", description="Test Description"
+    )
+    other_project_id = create_project(
+        user_token=token, title="Other Project", description="Test Description"
+    )
+    dataset_id = create_dataset(
+        user_token=token,
+        project_id=project_id,
+        file=("test.txt", "Tëst cöntent".encode("utf-8")),
+    )
+    label_id = create_label(
+        user_token=token, project_id=project_id, name="Test Label", color="#FF0000"
+    )
+
+    text_length = await db.fetchval(
+        "SELECT text_length FROM datasets WHERE id = $1", uuid.UUID(dataset_id)
+    )
+    assert text_length == 12
+
+    def create(project_id: str, end_offset: int):
+        return test_client.post(
+            f"/project/{project_id}/dataset/{dataset_id}/category",
+            headers={"Authorization": f"Bearer {token}"},
+            json={"label_id": label_id, "start_offset": 5, "end_offset": end_offset},
+        )
+
+    assert create(project_id, 13).status_code == 400
+    assert create(other_project_id, 12).status_code == 404
+    assert create(project_id, 12).status_code == 200
+
+
+async def test_import_categories(
+    test_client: TestClient,
+    db: asyncpg.Connection,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+    create_label: Callable[..., str],
+):
+    user_id, token = create_user(username="test_user")
+    project_id = create_project(
+        user_token=token, title="Test Project", description="Test Description"
+    )
+    dataset_id = create_dataset(
+        user_token=token, project_id=project_id, file=("test.txt", b"Test content")
+    )
+    create_dataset(
+        user_token=token, project_id=project_id, file=("other.txt", b"Other content")
+    )
+    unnamed_id = create_dataset(
+        user_token=token, project_id=project_id, file=("unnamed.txt", b"No name")
+    )
+    await db.execute(
+        "UPDATE datasets SET filename = NULL WHERE id = $1", uuid.UUID(unnamed_id)
+    )
+    create_label(
+        user_token=token, project_id=project_id, name="Test Label", color="#FF0000"
+    )
+    rows = [
+        {"dataset_id": dataset_id, "label": "Test Label", "start": 0, "end": 4},
+        {"filename": "other.txt", "label": "Test Label", "start": 6, "end": 13},
+        {"filename": "missing.txt", "label": "Test Label", "start": 0, "end": 4},
+        {"dataset_id": dataset_id, "label": "Missing Label", "start": 0, "end": 4},
+        {"dataset_id": dataset_id, "label": "Test Label", "start": 5, "end": 13},
+        {"label": "Test Label", "start": 0, "end": 2},
+    ]
+    content = "\n".join(json.dumps(r) for r in rows) + "\nnot json\n"
+
+    def import_categories(dry_run: bool):
+        res = test_client.post(
+            f"/project/{project_id}/category/import",
+            headers={"Authorization": f"Bearer {token}"},
+            params={"dry_run": dry_run},
+            files=[("file", ("import.jsonl", content.encode("utf-8")))],
+        )
+        assert res.status_code == 200
+        return res.json()
+
+    expected_errors = [
+        {"line": 3, "detail": "Dataset not found"},
+        {"line": 4, "detail": "Label not found"},
+        {"line": 5, "detail": "Offsets out of the dataset text"},
+        {"line": 6, "detail": "Missing dataset_id or filename"},
+        {"line": 7, "detail": "Invalid row"},
+    ]
+    result = import_categories(dry_run=True)
+    assert result == {
+        "dry_run": True,
+        "imported": 2,
+        "error_count": 5,
+        "errors": expected_errors,
+    }
+    assert await db.fetchval("SELECT COUNT(*) FROM categories") == 0
+
+    result = import_categories(dry_run=False)
+    assert result["imported"] == 2
+    assert result["errors"] == expected_errors
+    categories = await db.fetch(
+        "SELECT start_offset, end_offset FROM categories ORDER BY start_offset"
+    )
+    assert [tuple(c) for c in categories] == [(0, 4), (6, 13)]
+
+
+async def test_partition_categories(
+    test_client: TestClient,
+    db: asyncpg.Connection,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+    create_label: Callable[..., str],
+    create_category: Callable[..., str],
+):
+    user_id, token = create_user(username="test_user")
+    headers = {"Authorization": f"Bearer {token}"}
+    project_ids = [
+        create_project(user_token=token, title=title, description="Description")
+        for title in ["First", "Second"]
+    ]
+    datasets = {}
+    for project_id in project_ids:
+        dataset_id = create_dataset(
+            user_token=token, project_id=project_id, file=("test.txt", b"Test content")
+        )
+        label_id = create_label(
+            user_token=token, project_id=project_id, name="Label", color="#FF0000"
+        )
+        for start_offset in range(3):
+            create_category(
+                user_token=token,
+                project_id=project_id,
+                dataset_id=dataset_id,
+                label_id=label_id,
+                start_offset=start_offset,
+                end_offset=start_offset + 4,
+            )
+        datasets[project_id] = (dataset_id, label_id)
+
+    assert not await db_category.is_partitioned(db)
+    copied = await db_category.partition_table(db, 4, batch_size=2)
+    assert copied == 6
+    assert await db_category.is_partitioned(db)
+    assert await db.fetchval("SELECT COUNT(*) FROM categories") == 6
+    assert await db.fetchval("SELECT COUNT(*) FROM categories_unpartitioned") == 6
+
+    # Reads of a dataset only touch the partition of its project
+    project_id = project_ids[0]
+    dataset_id, label_id = datasets[project_id]
+    plan = await db.fetchval(
+        "EXPLAIN SELECT * FROM categories WHERE project_id = $1 AND dataset_id = $2",
+        uuid.UUID(project_id),
+        uuid.UUID(dataset_id),
+    )
+    assert plan.count("categories_p") == 1
+
+    url = f"/project/{project_id}/dataset/{dataset_id}/category"
+    res = test_client.get(url, headers=headers)
+    assert res.status_code == 200
+    assert [c["start_offset"] for c in res.json()] == [0, 1, 2]
+    category_id = create_category(
+        user_token=token,
+        project_id=project_id,
+        dataset_id=dataset_id,
+        label_id=label_id,
+        start_offset=5,
+        end_offset=12,
+    )
+    res = test_client.delete(f"{url}/{category_id}", headers=headers)
+    assert res.status_code == 200
+    res = test_client.get(f"{url}/changes", params={"since": 0}, headers=headers)
+    assert len(res.json()["changes"]) == 4
@@ -1,10 +1,17 @@
+import uuid
 from collections.abc import Callable
 from io import BytesIO
+from pathlib import Path
 from typing import Tuple
 
 import asyncpg
+import pytest
 from starlette.testclient import TestClient
 
+from heron.config import settings
+from heron.db import dataset as db_dataset
+from heron.storage import get_storage
+
 
 async def test_upload_dataset(
     test_client: TestClient,
@@ -154,10 +161,20 @@ async def test_delete_dataset(
         },
     )
     assert res.status_code == 200
+    operation_id = res.json()["operation_id"]
 
     datasets = await db.fetch("SELECT * FROM datasets")
     assert len(datasets) == 0
 
+    res = test_client.get(
+        f"/project/{project_id}/operation/{operation_id}",
+        headers={
+            "Authorization": f"Bearer {token}",
+        },
+    )
+    assert res.status_code == 200
+    assert res.json()["status"] == "done"
+
     res = test_client.delete(
         f"/project/{project_id}/dataset/{dataset_id}",
         headers={
@@ -168,3 +185,293 @@ async def test_delete_dataset(
 
     datasets = await db.fetch("SELECT * FROM datasets")
     assert len(datasets) == 0
+
+
+async def test_search_datasets(
+    test_client: TestClient,
+    db: asyncpg.Connection,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+):
+    user_id, token = create_user(username="my_user")
+    project_id = create_project(
+        user_token=token, title="My Project", description="My project description"
+    )
+    another_project_id = create_project(
+        user_token=token,
+        title="Another Project",
+        description="Another project description",
+    )
+    first_dataset_id = create_dataset(
+        user_token=token,
+        project_id=project_id,
+        file=("first.txt", b"The heron waits. A heron eats."),
+    )
+    second_dataset_id = create_dataset(
+        user_token=token,
+        project_id=project_id,
+        file=("second.txt", b"Only one Heron here, and some other words."),
+    )
+    create_dataset(
+        user_token=token, project_id=project_id, file=("third.txt", b"No birds")
+    )
+    create_dataset(
+        user_token=token,
+        project_id=another_project_id,
+        file=("fourth.txt", b"A heron in another project"),
+    )
+
+    res = test_client.get(
+        f"/project/{project_id}/search",
+        params={"q": "heron"},
+        headers={
+            "Authorization": f"Bearer {token}",
+        },
+    )
+    assert res.status_code == 200
+    results = res.json()
+    assert len(results) == 2
+    assert results[0]["dataset_id"] == first_dataset_id
+    assert results[0]["filename"] == "first.txt"
+    assert results[0]["matches"] == [
+        {"start_offset": 4, "end_offset": 9},
+        {"start_offset": 19, "end_offset": 24},
+    ]
+    assert results[1]["dataset_id"] == second_dataset_id
+    assert results[1]["matches"] == [{"start_offset": 9, "end_offset": 14}]
+    assert results[0]["rank"] > results[1]["rank"]
+
+    res = test_client.get(
+        f"/project/{project_id}/search",
+        params={"q": "heron -waits"},
+        headers={
+            "Authorization": f"Bearer {token}",
+        },
+    )
+    assert res.status_code == 200
+    results = res.json()
+    assert len(results) == 1
+    assert results[0]["dataset_id"] == second_dataset_id
+
+
+async def test_search_large_dataset(
+    test_client: TestClient,
+    db: asyncpg.Connection,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+):
+    user_id, token = create_user(username="my_user")
+    project_id = create_project(
+        user_token=token, title="My Project", description="My project description"
+    )
+    # Its whole search vector would be well over the 1MB Postgres allows
+    text = "heron " + " ".join(f"w{i}" for i in range(300_000))
+    dataset_id = create_dataset(
+        user_token=token, project_id=project_id, file=("large.txt", text.encode())
+    )
+
+    def search(q: str) -> list[str]:
+        res = test_client.get(
+            f"/project/{project_id}/search",
+            params={"q": q},
+            headers={"Authorization": f"Bearer {token}"},
+        )
+        assert res.status_code == 200
+        return [r["dataset_id"] for r in res.json()]
+
+    assert search("heron") == [dataset_id]
+    assert search("w10") == [dataset_id]
+    # Past the indexed start of the text
+    assert search("w299999") == []
+
+
+async def test_search_ranks_bounded_candidates(
+    test_client: TestClient,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+    monkeypatch: pytest.MonkeyPatch,
+):
+    user_id, token = create_user(username="my_user")
+    project_id = create_project(
+        user_token=token, title="My Project", description="My project description"
+    )
+    for i in range(3):
+        create_dataset(
+            user_token=token,
+            project_id=project_id,
+            file=(f"{i}.txt", f"heron {i}".encode()),
+        )
+    monkeypatch.setattr(db_dataset, "SEARCH_CANDIDATES", 2)
+
+    res = test_client.get(
+        f"/project/{project_id}/search",
+        params={"q": "heron"},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert res.status_code == 200
+    assert len(res.json()) == 2
+
+
+async def test_get_dataset_not_modified(
+    test_client: TestClient,
+    db: asyncpg.Connection,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+):
+    user_id, token = create_user(username="my_user")
+    project_id = create_project(
+        user_token=token, title="My Project", description="My project description"
+    )
+    dataset_id = create_dataset(
+        user_token=token, project_id=project_id, file=("hello.txt", b"Hello world")
+    )
+
+    res = test_client.get(
+        f"/project/{project_id}/dataset/{dataset_id}",
+        headers={
+            "Authorization": f"Bearer {token}",
+        },
+    )
+    assert res.status_code == 200
+    etag = res.headers["ETag"]
+
+    res = test_client.get(
+        f"/project/{project_id}/dataset/{dataset_id}",
+        headers={
+            "Authorization": f"Bearer {token}",
+            "If-None-Match": etag,
+        },
+    )
+    assert res.status_code == 304
+    assert res.headers["ETag"] == etag
+    assert res.content == b""
+
+    res = test_client.get(
+        f"/project/{project_id}/dataset/{dataset_id}",
+        headers={
+            "Authorization": f"Bearer {token}",
+            "If-None-Match": '"stale"',
+        },
+    )
+    assert res.status_code == 200
+    assert res.json()["text"] == "Hello world"
+
+
+async def test_filesystem_storage(
+    test_client: TestClient,
+    db: asyncpg.Connection,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+):
+    monkeypatch.setattr(settings(), "dataset_storage", "filesystem")
+    monkeypatch.setattr(settings(), "dataset_storage_path", str(tmp_path))
+    user_id, token = create_user(username="my_user")
+    project_id = create_project(
+        user_token=token, title="My Project", description="My project description"
+    )
+    text = "Grüße from the heron"
+    dataset_id = create_dataset(
+        user_token=token, project_id=project_id, file=("hello.txt", text.encode())
+    )
+
+    datasets = await db.fetch("SELECT * FROM datasets")
+    assert len(datasets) == 1
+    assert datasets[0]["text"] is None
+    assert datasets[0]["storage"] == "filesystem"
+    content_hash = datasets[0]["content_hash"]
+    path = tmp_path / content_hash[:2] / content_hash[2:4] / content_hash
+    assert path.read_text() == text
+
+    res = test_client.get(
+        f"/project/{project_id}/dataset/{dataset_id}",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert res.status_code == 200
+    assert res.json()["text"] == text
+
+    res = test_client.get(
+        f"/project/{project_id}/dataset/{dataset_id}/text",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert res.status_code == 200
+    assert res.text == text
+    assert res.headers["ETag"] == f'"{content_hash}"'
+
+    res = test_client.get(
+        f"/project/{project_id}/dataset/{dataset_id}/text",
+        params={"start": 3, "end": 10},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert res.status_code == 200
+    assert res.text == text[3:10]
+
+    moved = await db_dataset.migrate_storage(db, get_storage("postgres"))
+    assert moved == 1
+    datasets = await db.fetch("SELECT * FROM datasets")
+    assert datasets[0]["text"] == text
+    assert datasets[0]["storage"] == "postgres"
+    assert not path.exists()
+
+    res = test_client.get(
+        f"/project/{project_id}/dataset/{dataset_id}/text",
+        params={"start": 3},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert res.status_code == 200
+    assert res.text == text[3:]
+
+
+async def test_get_dataset_text_other_project(
+    test_client: TestClient,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+):
+    _, alice_token = create_user(username="alice")
+    _, bob_token = create_user(username="bob")
+    alice_project_id = create_project(
+        user_token=alice_token, title="Alice Project", description="Alice"
+    )
+    bob_project_id = create_project(
+        user_token=bob_token, title="Bob Project", description="Bob"
+    )
+    bob_dataset_id = create_dataset(
+        user_token=bob_token,
+        project_id=bob_project_id,
+        file=("hello.txt", b"Bob's secret"),
+    )
+
+    for params in ({}, {"start": 0, "end": 5}):
+        res = test_client.get(
+            f"/project/{alice_project_id}/dataset/{bob_dataset_id}/text",
+            params=params,
+            headers={"Authorization": f"Bearer {alice_token}"},
+        )
+        assert res.status_code == 404
+        assert res.json()["detail"] == "Dataset not found"
+
+
+async def test_failed_insert_releases_text(
+    test_client: TestClient,
+    db: asyncpg.Connection,
+    monkeypatch: pytest.MonkeyPatch,
+    tmp_path: Path,
+):
+    monkeypatch.setattr(settings(), "dataset_storage", "filesystem")
+    monkeypatch.setattr(settings(), "dataset_storage_path", str(tmp_path))
+    # The project doesn't exist, so the insert fails after the text is written
+    dataset = db_dataset.Dataset(
+        id=uuid.uuid4(), project_id=uuid.uuid4(), filename="hello.txt", text="Hello"
+    )
+    with pytest.raises(asyncpg.ForeignKeyViolationError):
+        await db_dataset.create(db, dataset)
+
+    assert await db.fetchval("SELECT COUNT(*) FROM datasets") == 0
+    assert not any(path.is_file() for path in tmp_path.rglob("*"))
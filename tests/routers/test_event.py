@@ -0,0 +1,68 @@
+import threading
+import uuid
+from collections.abc import Callable
+from typing import Tuple
+
+from starlette.testclient import TestClient
+
+
+async def test_events_of_other_project_dataset(
+    test_client: TestClient,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+):
+    _, alice_token = create_user(username="alice")
+    _, bob_token = create_user(username="bob")
+    alice_project_id = create_project(
+        user_token=alice_token, title="Alice Project", description="Alice"
+    )
+    bob_project_id = create_project(
+        user_token=bob_token, title="Bob Project", description="Bob"
+    )
+    bob_dataset_id = create_dataset(
+        user_token=bob_token,
+        project_id=bob_project_id,
+        file=("hello.txt", b"Hello world"),
+    )
+
+    res = test_client.get(
+        f"/project/{alice_project_id}/dataset/{bob_dataset_id}/events",
+        headers={"Authorization": f"Bearer {alice_token}"},
+    )
+    assert res.status_code == 404
+    assert res.json()["detail"] == "Dataset not found"
+    # No subscription was ever made to the dataset events
+    broker = test_client.app_state["event_broker"]
+    assert uuid.UUID(bob_dataset_id) not in broker._by_dataset
+
+
+async def test_event_streams_release_connections(
+    test_client: TestClient,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+    open_stream: Callable[..., threading.Event],
+):
+    user_id, token = create_user(username="my_user")
+    project_id = create_project(
+        user_token=token, title="My Project", description="My project description"
+    )
+    dataset_id = create_dataset(
+        user_token=token, project_id=project_id, file=("hello.txt", b"Hello world")
+    )
+
+    # More open streams than connections in the pool
+    pool_size = test_client.app_state["db_pool"].get_max_size()
+    streams = [
+        open_stream(f"/project/{project_id}/dataset/{dataset_id}/events", token)
+        for _ in range(pool_size + 2)
+    ]
+    for first_chunk in streams:
+        assert first_chunk.wait(10)
+
+    res = test_client.get(
+        f"/project/{project_id}/dataset",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert res.status_code == 200
@@ -0,0 +1,111 @@
+import gzip
+import json
+import threading
+from collections.abc import Callable
+from typing import Tuple
+
+from starlette.testclient import TestClient
+
+
+def test_export_project(
+    test_client: TestClient,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+    create_label: Callable[..., str],
+    create_category: Callable[..., str],
+):
+    user_id, token = create_user(username="test_user")
+    member_id, member_token = create_user(username="member_user")
+    project_id = create_project(
+        user_token=token,
+        title="Test Project",
+        description="Test Description",
+        members=[member_id],
+    )
+    dataset_id = create_dataset(
+        user_token=token, project_id=project_id, file=("test.txt", b"Test content")
+    )
+    empty_dataset_id = create_dataset(
+        user_token=token, project_id=project_id, file=("empty.txt", b"Nothing here")
+    )
+    label_id = create_label(
+        user_token=token, project_id=project_id, name="Test Label", color="#FF0000"
+    )
+    create_category(
+        user_token=token,
+        project_id=project_id,
+        dataset_id=dataset_id,
+        label_id=label_id,
+        start_offset=5,
+        end_offset=12,
+    )
+    create_category(
+        user_token=token,
+        project_id=project_id,
+        dataset_id=dataset_id,
+        label_id=label_id,
+        start_offset=0,
+        end_offset=4,
+    )
+
+    res = test_client.get(
+        f"/project/{project_id}/export",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert res.status_code == 200
+    records = {r["id"]: r for r in (json.loads(line) for line in res.text.splitlines())}
+    assert records[dataset_id]["text"] == "Test content"
+    assert records[dataset_id]["spans"] == [
+        {"start": 0, "end": 4, "label": "Test Label"},
+        {"start": 5, "end": 12, "label": "Test Label"},
+    ]
+    assert records[empty_dataset_id]["spans"] == []
+
+    res = test_client.get(
+        f"/project/{project_id}/export",
+        params={"format": "conll", "gzip": True},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert res.status_code == 200
+    assert res.headers["content-type"] == "application/gzip"
+    conll = gzip.decompress(res.content).decode("utf-8")
+    assert "Test\tB-Test Label\ncontent\tB-Test Label\n" in conll
+
+    res = test_client.get(
+        f"/project/{project_id}/export",
+        headers={"Authorization": f"Bearer {member_token}"},
+    )
+    assert res.status_code == 403
+
+
+def test_export_streams_release_connections(
+    test_client: TestClient,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+    open_stream: Callable[..., threading.Event],
+):
+    user_id, token = create_user(username="test_user")
+    project_id = create_project(
+        user_token=token, title="Test Project", description="Test Description"
+    )
+    create_dataset(
+        user_token=token, project_id=project_id, file=("test.txt", b"Test content")
+    )
+
+    # Each held download keeps its own connection, with the request one it
+    # would take more connections than the pool has
+    pool_size = test_client.app_state["db_pool"].get_max_size()
+    streams = [
+        open_stream(f"/project/{project_id}/export", token)
+        for _ in range(pool_size // 2 + 1)
+    ]
+    for first_chunk in streams:
+        assert first_chunk.wait(10)
+
+    res = test_client.get(
+        f"/project/{project_id}/dataset",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert res.status_code == 200
@@ -1,9 +1,12 @@
+import uuid
 from collections.abc import Callable
 from typing import Tuple
 
 import asyncpg
 from starlette.testclient import TestClient
 
+from heron.db import label as db_label
+
 
 async def test_create_label(
     test_client: TestClient,
@@ -131,6 +134,107 @@ async def test_update_label(
     assert label["color"] == "#FF0000"
 
 
+async def test_update_label_precondition(
+    test_client: TestClient,
+    db: asyncpg.Connection,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_label: Callable[..., str],
+):
+    user_id, token = create_user(username="my_user")
+    project_id = create_project(
+        user_token=token, title="My Project", description="My project description"
+    )
+    label_id = create_label(
+        user_token=token, project_id=project_id, name="My label", color="#FF0000"
+    )
+    url = f"/project/{project_id}/label/{label_id}"
+    headers = {"Authorization": f"Bearer {token}"}
+
+    etag = test_client.get(url, headers=headers).headers["ETag"]
+    res = test_client.put(
+        url, headers={**headers, "If-Match": etag}, json={"color": "#00FF00"}
+    )
+    assert res.status_code == 200
+    assert res.json()["name"] == "My label"
+    assert res.json()["color"] == "#00FF00"
+    assert res.headers["ETag"] != etag
+
+    for if_match in [etag, "garbage"]:
+        res = test_client.put(
+            url, headers={**headers, "If-Match": if_match}, json={"name": "Stale"}
+        )
+        assert res.status_code == 412
+    stored = await db.fetchrow("SELECT * FROM labels WHERE id = $1", label_id)
+    assert stored["name"] == "My label"
+
+    res = test_client.put(
+        f"/project/{project_id}/label/{uuid.uuid4()}",
+        headers={**headers, "If-Match": etag},
+        json={"name": "Missing"},
+    )
+    assert res.status_code == 404
+
+
+async def test_label_reads_follow_writes(
+    test_client: TestClient,
+    db: asyncpg.Connection,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_label: Callable[..., str],
+    create_dataset: Callable[..., str],
+):
+    user_id, token = create_user(username="my_user")
+    headers = {"Authorization": f"Bearer {token}"}
+    project_id = create_project(
+        user_token=token, title="My Project", description="My project description"
+    )
+    other_project_id = create_project(
+        user_token=token, title="Other Project", description="Other description"
+    )
+    dataset_id = create_dataset(
+        user_token=token, project_id=project_id, file=("test.txt", b"Test content")
+    )
+    first_id = create_label(
+        user_token=token, project_id=project_id, name="First", color="#FF0000"
+    )
+
+    def get_labels() -> list[str]:
+        res = test_client.get(f"/project/{project_id}/label", headers=headers)
+        return sorted(label["name"] for label in res.json())
+
+    assert get_labels() == ["First"]
+    create_label(
+        user_token=token, project_id=project_id, name="Second", color="#00FF00"
+    )
+    assert get_labels() == ["First", "Second"]
+    test_client.put(
+        f"/project/{project_id}/label/{first_id}",
+        headers=headers,
+        json={"name": "Renamed"},
+    )
+    assert get_labels() == ["Renamed", "Second"]
+    test_client.delete(f"/project/{project_id}/label/{first_id}", headers=headers)
+    assert get_labels() == ["Second"]
+    res = test_client.get(f"/project/{project_id}/label/{first_id}", headers=headers)
+    assert res.status_code == 404
+
+    # Labels of other projects can't be used
+    other_label_id = create_label(
+        user_token=token, project_id=other_project_id, name="Other", color="#0000FF"
+    )
+    res = test_client.post(
+        f"/project/{project_id}/dataset/{dataset_id}/category",
+        headers=headers,
+        json={"label_id": other_label_id, "start_offset": 0, "end_offset": 4},
+    )
+    assert res.status_code == 404
+    res = test_client.get(
+        f"/project/{project_id}/label/{other_label_id}", headers=headers
+    )
+    assert res.status_code == 404
+
+
 async def test_delete_label(
     test_client: TestClient,
     db: asyncpg.Connection,
@@ -169,3 +273,448 @@ async def test_delete_label(
 
     labels = await db.fetch("SELECT * FROM labels")
     assert len(labels) == 0
+
+
+async def test_get_project_labels_not_modified(
+    test_client: TestClient,
+    db: asyncpg.Connection,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_label: Callable[..., str],
+):
+    user_id, token = create_user(username="my_user")
+    project_id = create_project(
+        user_token=token, title="My Project", description="My project description"
+    )
+    create_label(user_token=token, project_id=project_id, name="First", color="#FF0000")
+
+    res = test_client.get(
+        f"/project/{project_id}/label",
+        headers={
+            "Authorization": f"Bearer {token}",
+        },
+    )
+    assert res.status_code == 200
+    etag = res.headers["ETag"]
+
+    res = test_client.get(
+        f"/project/{project_id}/label",
+        headers={
+            "Authorization": f"Bearer {token}",
+            "If-None-Match": etag,
+        },
+    )
+    assert res.status_code == 304
+
+    create_label(
+        user_token=token, project_id=project_id, name="Second", color="#00FF00"
+    )
+    res = test_client.get(
+        f"/project/{project_id}/label",
+        headers={
+            "Authorization": f"Bearer {token}",
+            "If-None-Match": etag,
+        },
+    )
+    assert res.status_code == 200
+    assert res.headers["ETag"] != etag
+    assert len(res.json()) == 2
+
+
+async def test_delete_label_purges_categories(
+    test_client: TestClient,
+    db: asyncpg.Connection,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+    create_label: Callable[..., str],
+    create_category: Callable[..., str],
+):
+    user_id, token = create_user(username="my_user")
+    project_id = create_project(
+        user_token=token, title="My Project", description="My project description"
+    )
+    dataset_id = create_dataset(
+        user_token=token, project_id=project_id, file=("hello.txt", b"Hello world")
+    )
+    label_id = create_label(
+        user_token=token, project_id=project_id, name="My label", color="#FF0000"
+    )
+    other_label_id = create_label(
+        user_token=token, project_id=project_id, name="Other", color="#00FF00"
+    )
+    for offset in range(3):
+        create_category(
+            user_token=token,
+            project_id=project_id,
+            dataset_id=dataset_id,
+            label_id=label_id,
+            start_offset=offset,
+            end_offset=offset + 1,
+        )
+    create_category(
+        user_token=token,
+        project_id=project_id,
+        dataset_id=dataset_id,
+        label_id=other_label_id,
+        start_offset=0,
+        end_offset=5,
+    )
+
+    res = test_client.delete(
+        f"/project/{project_id}/label/{label_id}",
+        headers={
+            "Authorization": f"Bearer {token}",
+        },
+    )
+    assert res.status_code == 200
+    operation_id = res.json()["operation_id"]
+
+    res = test_client.get(
+        f"/project/{project_id}/operation/{operation_id}",
+        headers={
+            "Authorization": f"Bearer {token}",
+        },
+    )
+    assert res.status_code == 200
+    operation = res.json()
+    assert operation["kind"] == "delete_label"
+    assert operation["target_id"] == label_id
+    assert operation["status"] == "done"
+    assert operation["processed"] == 3
+    assert operation["total"] == 3
+
+    categories = await db.fetch("SELECT * FROM categories")
+    assert len(categories) == 1
+    assert str(categories[0]["label_id"]) == other_label_id
+
+
+async def test_merge_labels(
+    test_client: TestClient,
+    db: asyncpg.Connection,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+    create_label: Callable[..., str],
+    create_category: Callable[..., str],
+):
+    user_id, token = create_user(username="my_user")
+    headers = {"Authorization": f"Bearer {token}"}
+    project_id = create_project(
+        user_token=token, title="My Project", description="My project description"
+    )
+    dataset_ids = [
+        create_dataset(
+            user_token=token, project_id=project_id, file=(name, b"Hello world")
+        )
+        for name in ["first.txt", "second.txt"]
+    ]
+    target_id, first_id, second_id = [
+        create_label(
+            user_token=token, project_id=project_id, name=name, color="#FF0000"
+        )
+        for name in ["PERSON", "PERSON_NAME", "NAME"]
+    ]
+    for dataset_id, label_id in [
+        (dataset_ids[0], first_id),
+        (dataset_ids[1], first_id),
+        (dataset_ids[1], second_id),
+        (dataset_ids[0], target_id),
+    ]:
+        create_category(
+            user_token=token,
+            project_id=project_id,
+            dataset_id=dataset_id,
+            label_id=label_id,
+            start_offset=0,
+            end_offset=5,
+        )
+    url = f"/project/{project_id}/label/{target_id}/merge"
+
+    res = test_client.post(url, headers=headers, json={"source_ids": [target_id]})
+    assert res.status_code == 400
+    res = test_client.post(
+        url, headers=headers, json={"source_ids": [str(uuid.uuid4())]}
+    )
+    assert res.status_code == 404
+
+    # Relabeling keeps the source labels
+    res = test_client.post(url, headers=headers, json={"source_ids": [second_id]})
+    assert res.status_code == 200
+    operation_id = res.json()["operation_id"]
+    res = test_client.get(
+        f"/project/{project_id}/operation/{operation_id}", headers=headers
+    )
+    operation = res.json()
+    assert operation["kind"] == "relabel"
+    assert operation["status"] == "done"
+    assert operation["processed"] == 1
+    labels = await db.fetch("SELECT * FROM labels WHERE NOT deleted")
+    assert len(labels) == 3
+
+    res = test_client.post(
+        url,
+        headers=headers,
+        json={"source_ids": [first_id, second_id], "delete_sources": True},
+    )
+    assert res.status_code == 200
+    operation_id = res.json()["operation_id"]
+    res = test_client.get(
+        f"/project/{project_id}/operation/{operation_id}", headers=headers
+    )
+    operation = res.json()
+    assert operation["kind"] == "merge_labels"
+    assert operation["status"] == "done"
+    assert operation["processed"] == 2
+    assert operation["total"] == 2
+
+    categories = await db.fetch("SELECT * FROM categories")
+    assert len(categories) == 4
+    assert {str(c["label_id"]) for c in categories} == {target_id}
+    labels = await db.fetch("SELECT * FROM labels")
+    assert [str(label["id"]) for label in labels] == [target_id]
+
+    # Changes to the categories are visible to the changes feed
+    res = test_client.get(
+        f"/project/{project_id}/dataset/{dataset_ids[1]}/category/changes",
+        params={"since": 0},
+        headers=headers,
+    )
+    assert {c["label_id"] for c in res.json()["changes"]} == {target_id}
+
+
+async def test_label_hierarchy(
+    test_client: TestClient,
+    db: asyncpg.Connection,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+    create_label: Callable[..., str],
+    create_category: Callable[..., str],
+):
+    user_id, token = create_user(username="my_user")
+    headers = {"Authorization": f"Bearer {token}"}
+    project_id = create_project(
+        user_token=token, title="My Project", description="My project description"
+    )
+    dataset_id = create_dataset(
+        user_token=token, project_id=project_id, file=("hello.txt", b"Hello world")
+    )
+
+    def create_child(name: str, parent_id: str | None) -> str:
+        res = test_client.post(
+            f"/project/{project_id}/label",
+            headers=headers,
+            json={"name": name, "color": "#FF0000", "parent_id": parent_id},
+        )
+        assert res.status_code == 200
+        return res.json()["label_id"]
+
+    org_id = create_child("ORG", None)
+    company_id = create_child("COMPANY", org_id)
+    bank_id = create_child("BANK", company_id)
+    person_id = create_child("PERSON", None)
+    res = test_client.post(
+        f"/project/{project_id}/label",
+        headers=headers,
+        json={"name": "Nope", "color": "#FF0000", "parent_id": str(uuid.uuid4())},
+    )
+    assert res.status_code == 404
+
+    category_ids: dict[str, list[str]] = {}
+    for offset, label_id in enumerate(
+        [org_id, company_id, bank_id, bank_id, person_id]
+    ):
+        category_ids.setdefault(label_id, []).append(
+            create_category(
+                user_token=token,
+                project_id=project_id,
+                dataset_id=dataset_id,
+                label_id=label_id,
+                start_offset=offset,
+                end_offset=offset + 1,
+            )
+        )
+
+    def subtree(label_id: str) -> set[str]:
+        res = test_client.get(
+            f"/project/{project_id}/label/{label_id}/category", headers=headers
+        )
+        assert res.status_code == 200
+        return {c["id"] for c in res.json()}
+
+    assert subtree(org_id) == {
+        i for label_id in [org_id, company_id, bank_id] for i in category_ids[label_id]
+    }
+    assert subtree(company_id) == {*category_ids[company_id], *category_ids[bank_id]}
+
+    res = test_client.get(
+        f"/project/{project_id}/label", params={"counts": True}, headers=headers
+    )
+    counts = {
+        label["name"]: (label["spans"], label["subtree_spans"]) for label in res.json()
+    }
+    assert counts == {
+        "ORG": (1, 4),
+        "COMPANY": (1, 3),
+        "BANK": (2, 2),
+        "PERSON": (1, 1),
+    }
+    res = test_client.get(f"/project/{project_id}/statistics", headers=headers)
+    subtree_spans = {
+        label["name"]: label["subtree_spans"] for label in res.json()["labels"]
+    }
+    assert subtree_spans == {"ORG": 4, "COMPANY": 3, "BANK": 2, "PERSON": 1}
+
+    # Moves take the whole subtree along and can't create cycles
+    res = test_client.put(
+        f"/project/{project_id}/label/{org_id}",
+        headers=headers,
+        json={"parent_id": bank_id},
+    )
+    assert res.status_code == 400
+    res = test_client.put(
+        f"/project/{project_id}/label/{company_id}",
+        headers=headers,
+        json={"parent_id": person_id},
+    )
+    assert res.status_code == 200
+    assert res.json()["parent_id"] == person_id
+    assert res.json()["name"] == "COMPANY"
+    assert subtree(org_id) == set(category_ids[org_id])
+    assert subtree(person_id) == {
+        *category_ids[person_id],
+        *category_ids[company_id],
+        *category_ids[bank_id],
+    }
+    res = test_client.put(
+        f"/project/{project_id}/label/{company_id}",
+        headers=headers,
+        json={"parent_id": None},
+    )
+    assert res.json()["parent_id"] is None
+    assert subtree(person_id) == set(category_ids[person_id])
+    assert subtree(company_id) == {*category_ids[company_id], *category_ids[bank_id]}
+
+    # A stale version fails the whole update, the move included
+    company_url = f"/project/{project_id}/label/{company_id}"
+    etag = test_client.get(company_url, headers=headers).headers["ETag"]
+    test_client.put(company_url, headers=headers, json={"color": "#00FF00"})
+    res = test_client.put(
+        company_url,
+        headers={**headers, "If-Match": etag},
+        json={"parent_id": person_id},
+    )
+    assert res.status_code == 412
+    assert test_client.get(company_url, headers=headers).json()["parent_id"] is None
+
+    # Moves are checked again when written, not only against cached paths
+    async with db.transaction():
+        assert not await db_label.move(
+            db, uuid.UUID(project_id), uuid.UUID(company_id), uuid.UUID(bank_id)
+        )
+    stored = await db.fetchrow(
+        "SELECT parent_id FROM labels WHERE id = $1", uuid.UUID(company_id)
+    )
+    assert stored["parent_id"] is None
+
+    res = test_client.delete(company_url, headers=headers)
+    assert res.status_code == 409
+
+
+async def test_label_children_checked_when_written(
+    test_client: TestClient,
+    db: asyncpg.Connection,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_label: Callable[..., str],
+):
+    user_id, token = create_user(username="my_user")
+    headers = {"Authorization": f"Bearer {token}"}
+    project_id = create_project(
+        user_token=token, title="My Project", description="My project description"
+    )
+    parent_id = create_label(
+        user_token=token, project_id=project_id, name="ORG", color="#FF0000"
+    )
+    # Warm the cached labels of the project
+    test_client.get(f"/project/{project_id}/label", headers=headers)
+
+    # A child the cached labels don't know about yet
+    child = db_label.Label(
+        id=uuid.uuid4(),
+        project_id=uuid.UUID(project_id),
+        name="COMPANY",
+        color="#00FF00",
+        parent_id=uuid.UUID(parent_id),
+    )
+    assert await db_label.create(db, child)
+    await db.execute(
+        "UPDATE projects SET labels_version = labels_version - 1 WHERE id = $1",
+        uuid.UUID(project_id),
+    )
+    res = test_client.delete(
+        f"/project/{project_id}/label/{parent_id}", headers=headers
+    )
+    assert res.status_code == 409
+    assert not await db.fetchval(
+        "SELECT deleted FROM labels WHERE id = $1", uuid.UUID(parent_id)
+    )
+
+    # Nor can children be created under a label deleted meanwhile
+    assert await db_label.hide(db, uuid.UUID(project_id), child.id)
+    assert await db_label.hide(db, uuid.UUID(project_id), uuid.UUID(parent_id))
+    grandchild = child.model_copy(update={"id": uuid.uuid4(), "parent_id": child.id})
+    assert not await db_label.create(db, grandchild)
+    assert (
+        await db.fetchval("SELECT count(*) FROM labels WHERE id = $1", grandchild.id)
+        == 0
+    )
+
+
+async def test_hidden_label_categories_are_not_listed(
+    test_client: TestClient,
+    db: asyncpg.Connection,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+    create_label: Callable[..., str],
+    create_category: Callable[..., str],
+):
+    user_id, token = create_user(username="my_user")
+    project_id = create_project(
+        user_token=token, title="My Project", description="My project description"
+    )
+    dataset_id = create_dataset(
+        user_token=token, project_id=project_id, file=("hello.txt", b"Hello world")
+    )
+    label_id = create_label(
+        user_token=token, project_id=project_id, name="My label", color="#FF0000"
+    )
+    create_category(
+        user_token=token,
+        project_id=project_id,
+        dataset_id=dataset_id,
+        label_id=label_id,
+        start_offset=0,
+        end_offset=5,
+    )
+
+    # Only hide the label, as if the purge didn't run yet
+    assert await db_label.hide(db, uuid.UUID(project_id), uuid.UUID(label_id))
+
+    res = test_client.get(
+        f"/project/{project_id}/label",
+        headers={
+            "Authorization": f"Bearer {token}",
+        },
+    )
+    assert res.json() == []
+    res = test_client.get(
+        f"/project/{project_id}/dataset/{dataset_id}/category",
+        headers={
+            "Authorization": f"Bearer {token}",
+        },
+    )
+    assert res.json() == []
+    assert len(await db.fetch("SELECT * FROM categories")) == 1
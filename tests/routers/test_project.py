@@ -6,6 +6,8 @@ import asyncpg
 import pytest
 from starlette.testclient import TestClient
 
+from heron.db import category as db_category
+
 
 async def test_create(
     test_client: TestClient,
@@ -82,9 +84,6 @@ async def test_create_with_members(
     assert str(memberships[2]["user_id"]) == third_user_id
 
 
-@pytest.mark.skip(
-    reason="Need to implement some other checks before this can be enabled"
-)
 async def test_create_with_nonexisting_member(
     test_client: TestClient,
     db: asyncpg.Connection,
@@ -107,6 +106,10 @@ async def test_create_with_nonexisting_member(
     )
     assert res.status_code == 404
 
+    # Nothing is left behind
+    assert await db.fetch("SELECT * FROM projects") == []
+    assert await db.fetch("SELECT * FROM project_members") == []
+
 
 async def test_get_projects(
     test_client: TestClient,
@@ -163,6 +166,109 @@ async def test_get_projects(
     assert projects[1]["members"] == [user_id]
 
 
+async def test_get_projects_members_counts_and_pages(
+    test_client: TestClient,
+    db: asyncpg.Connection,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+    create_label: Callable[..., str],
+    create_category: Callable[..., str],
+):
+    owner_id, owner_token = create_user(username="owner")
+    member_id, member_token = create_user(username="member")
+    project_ids = [
+        create_project(
+            user_token=owner_token,
+            title=f"Project {i}",
+            description="Description",
+            members=[member_id],
+        )
+        for i in range(3)
+    ]
+    dataset_id = create_dataset(
+        user_token=owner_token,
+        project_id=project_ids[0],
+        file=("test.txt", b"Test content"),
+    )
+    label_id = create_label(
+        user_token=owner_token, project_id=project_ids[0], name="L", color="#FF0000"
+    )
+
+    def get_projects(params: dict) -> tuple[list[dict], str | None]:
+        res = test_client.get(
+            "/project",
+            params=params,
+            headers={"Authorization": f"Bearer {member_token}"},
+        )
+        assert res.status_code == 200
+        return res.json(), res.headers.get("X-Next-Cursor")
+
+    projects, _ = get_projects({})
+    assert [p["id"] for p in projects] == sorted(project_ids)
+    for project in projects:
+        # Members aren't limited to the one listing
+        assert sorted(project["members"]) == sorted([owner_id, member_id])
+        assert project["member_count"] == 2
+    counts = {p["id"]: (p["datasets"], p["labels"], p["spans"]) for p in projects}
+    assert counts[project_ids[0]] == (1, 1, 0)
+
+    # Counts follow writes
+    create_category(
+        user_token=owner_token,
+        project_id=project_ids[0],
+        dataset_id=dataset_id,
+        label_id=label_id,
+        start_offset=0,
+        end_offset=4,
+    )
+    projects, _ = get_projects({})
+    counts = {p["id"]: (p["datasets"], p["labels"], p["spans"]) for p in projects}
+    assert counts[project_ids[0]] == (1, 1, 1)
+
+    # The label and dataset rows are purged too, they're only counted once
+    owner_headers = {"Authorization": f"Bearer {owner_token}"}
+    test_client.delete(
+        f"/project/{project_ids[0]}/label/{label_id}", headers=owner_headers
+    )
+    projects, _ = get_projects({})
+    counts = {p["id"]: (p["datasets"], p["labels"], p["spans"]) for p in projects}
+    assert counts[project_ids[0]] == (1, 0, 0)
+    test_client.delete(
+        f"/project/{project_ids[0]}/dataset/{dataset_id}", headers=owner_headers
+    )
+    projects, _ = get_projects({})
+    counts = {p["id"]: (p["datasets"], p["labels"], p["spans"]) for p in projects}
+    assert counts[project_ids[0]] == (0, 0, 0)
+    assert await db.fetchval("SELECT COUNT(*) FROM labels") == 0
+
+    ids: list[str] = []
+    params: dict = {"limit": 2}
+    while True:
+        projects, cursor = get_projects(params)
+        ids.extend(p["id"] for p in projects)
+        if cursor is None:
+            break
+        params["after"] = cursor
+    assert ids == sorted(project_ids)
+
+    # Listings are paginated by default
+    await db.executemany(
+        "WITH project AS ("
+        "INSERT INTO projects (id, owner, title, description) "
+        "VALUES (gen_random_uuid(), $1, $2, 'Description') RETURNING id) "
+        "INSERT INTO project_members (project_id, user_id) "
+        "SELECT id, $1 FROM project",
+        [(uuid.UUID(owner_id), f"Bulk {i}") for i in range(50)],
+    )
+    res = test_client.get(
+        "/project", headers={"Authorization": f"Bearer {owner_token}"}
+    )
+    assert res.status_code == 200
+    assert len(res.json()) == 50
+    assert "X-Next-Cursor" in res.headers
+
+
 async def test_update_project(
     test_client: TestClient,
     db: asyncpg.Connection,
@@ -206,6 +312,63 @@ async def test_update_project(
     assert str(updated_project["owner"]) == user_id
 
 
+async def test_update_project_members(
+    test_client: TestClient,
+    db: asyncpg.Connection,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+):
+    owner_id, token = create_user(username="owner")
+    first_id, _ = create_user(username="first")
+    second_id, _ = create_user(username="second")
+    third_id, _ = create_user(username="third")
+    project_id = create_project(
+        user_token=token,
+        title="My Project",
+        description="Description",
+        members=[first_id, second_id],
+    )
+
+    async def stored_members() -> set[str]:
+        records = await db.fetch(
+            "SELECT user_id FROM project_members WHERE project_id = $1", project_id
+        )
+        return {str(r["user_id"]) for r in records}
+
+    res = test_client.put(
+        "/project",
+        json={"id": project_id, "members": [second_id, third_id]},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert res.status_code == 200
+    assert set(res.json()["members"]) == {owner_id, second_id, third_id}
+    assert await stored_members() == {owner_id, second_id, third_id}
+
+    # Unknown users fail the whole update
+    res = test_client.put(
+        "/project",
+        json={
+            "id": project_id,
+            "title": "Renamed",
+            "members": [first_id, str(uuid.uuid4())],
+        },
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert res.status_code == 404
+    assert await stored_members() == {owner_id, second_id, third_id}
+    title = await db.fetchval("SELECT title FROM projects WHERE id = $1", project_id)
+    assert title == "My Project"
+
+    # Leaving members out keeps them
+    res = test_client.put(
+        "/project",
+        json={"id": project_id, "title": "Renamed"},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert res.status_code == 200
+    assert await stored_members() == {owner_id, second_id, third_id}
+
+
 async def test_update_project_as_non_owner(
     test_client: TestClient,
     db: asyncpg.Connection,
@@ -284,3 +447,305 @@ async def test_update_project_as_non_member(
         },
     )
     assert res.status_code == 404
+
+
+async def test_clone_project(
+    test_client: TestClient,
+    db: asyncpg.Connection,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+    create_label: Callable[..., str],
+    create_category: Callable[..., str],
+):
+    user_id, token = create_user(username="my_user")
+    other_user_id, other_token = create_user(username="other_user")
+    headers = {"Authorization": f"Bearer {token}"}
+    project_id = create_project(
+        user_token=token,
+        title="My Project",
+        description="My project description",
+        members=[other_user_id],
+    )
+    dataset_id = create_dataset(
+        user_token=token, project_id=project_id, file=("hello.txt", b"Hello world")
+    )
+    org_id = create_label(
+        user_token=token, project_id=project_id, name="ORG", color="#FF0000"
+    )
+    res = test_client.post(
+        f"/project/{project_id}/label",
+        headers=headers,
+        json={"name": "COMPANY", "color": "#00FF00", "parent_id": org_id},
+    )
+    company_id = res.json()["label_id"]
+    for label_id, start_offset, end_offset in [(org_id, 0, 5), (company_id, 6, 11)]:
+        create_category(
+            user_token=token,
+            project_id=project_id,
+            dataset_id=dataset_id,
+            label_id=label_id,
+            start_offset=start_offset,
+            end_offset=end_offset,
+        )
+    url = f"/project/{project_id}/clone"
+
+    res = test_client.post(
+        url,
+        headers={"Authorization": f"Bearer {other_token}"},
+        json={"title": "Copy"},
+    )
+    assert res.status_code == 403
+
+    res = test_client.post(
+        url, headers=headers, json={"title": "Copy", "categories": True}
+    )
+    assert res.status_code == 200
+    clone_id = res.json()["project_id"]
+    res = test_client.get(
+        f"/project/{clone_id}/operation/{res.json()['operation_id']}",
+        headers=headers,
+    )
+    operation = res.json()
+    assert operation["kind"] == "clone_annotated_project"
+    assert operation["status"] == "done"
+    assert operation["processed"] == 2
+
+    clone = await db.fetchrow(
+        "SELECT * FROM projects WHERE id = $1", uuid.UUID(clone_id)
+    )
+    assert clone["title"] == "Copy"
+    assert clone["description"] == "My project description"
+    assert str(clone["owner"]) == user_id
+    assert clone["dataset_count"] == 1
+    assert clone["label_count"] == 2
+    members = await db.fetch(
+        "SELECT user_id FROM project_members WHERE project_id = $1",
+        uuid.UUID(clone_id),
+    )
+    assert [str(m["user_id"]) for m in members] == [user_id]
+
+    labels = {
+        label["name"]: label
+        for label in test_client.get(
+            f"/project/{clone_id}/label", headers=headers
+        ).json()
+    }
+    assert set(labels) == {"ORG", "COMPANY"}
+    assert not {labels["ORG"]["id"], labels["COMPANY"]["id"]} & {org_id, company_id}
+    assert labels["COMPANY"]["parent_id"] == labels["ORG"]["id"]
+
+    datasets = test_client.get(f"/project/{clone_id}/dataset", headers=headers).json()
+    assert [d["filename"] for d in datasets] == ["hello.txt"]
+    assert datasets[0]["id"] != dataset_id
+    categories = test_client.get(
+        f"/project/{clone_id}/dataset/{datasets[0]['id']}/category", headers=headers
+    ).json()
+    assert sorted((c["label_id"], c["start_offset"]) for c in categories) == sorted(
+        [(labels["ORG"]["id"], 0), (labels["COMPANY"]["id"], 6)]
+    )
+    res = test_client.get(
+        f"/project/{clone_id}/label/{labels['ORG']['id']}/category", headers=headers
+    )
+    assert len(res.json()) == 2
+
+    # Copied categories are newer than the version of their dataset copy
+    version = await db.fetchval(
+        "SELECT categories_version FROM datasets WHERE id = $1",
+        uuid.UUID(datasets[0]["id"]),
+    )
+    max_seq = await db.fetchval(
+        "SELECT MAX(seq) FROM categories WHERE project_id = $1", uuid.UUID(clone_id)
+    )
+    assert 0 < max_seq <= version
+
+    # Categories of labels created after the labels were copied are skipped
+    late_id = create_label(
+        user_token=token, project_id=project_id, name="LATE", color="#0000FF"
+    )
+    create_category(
+        user_token=token,
+        project_id=project_id,
+        dataset_id=dataset_id,
+        label_id=late_id,
+        start_offset=0,
+        end_offset=11,
+    )
+    read, _ = await db_category.clone_batch(
+        db,
+        uuid.UUID(project_id),
+        uuid.UUID(dataset_id),
+        uuid.UUID(clone_id),
+        None,
+        10,
+    )
+    assert read == 3
+    count = await db.fetchval(
+        "SELECT COUNT(*) FROM categories WHERE project_id = $1", uuid.UUID(clone_id)
+    )
+    assert count == 2
+    assert (
+        await db.fetchval(
+            "SELECT categories_version FROM datasets WHERE id = $1",
+            uuid.UUID(datasets[0]["id"]),
+        )
+        > version
+    )
+
+    # Without categories only labels and datasets are copied
+    res = test_client.post(url, headers=headers, json={"title": "Empty copy"})
+    assert res.status_code == 200
+    clone_id = res.json()["project_id"]
+    count = await db.fetchval(
+        "SELECT COUNT(*) FROM categories WHERE project_id = $1", uuid.UUID(clone_id)
+    )
+    assert count == 0
+    datasets = test_client.get(f"/project/{clone_id}/dataset", headers=headers).json()
+    assert len(datasets) == 1
+
+
+def test_get_project_statistics(
+    test_client: TestClient,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+    create_label: Callable[..., str],
+    create_category: Callable[..., str],
+):
+    user_id, token = create_user(username="my_user")
+    project_id = create_project(
+        user_token=token, title="Test Project", description="Test Description"
+    )
+    dataset_id = create_dataset(
+        user_token=token, project_id=project_id, file=("a.txt", b"Test content")
+    )
+    empty_dataset_id = create_dataset(
+        user_token=token, project_id=project_id, file=("b.txt", b"Nothing here")
+    )
+    label_id = create_label(
+        user_token=token, project_id=project_id, name="A Label", color="#FF0000"
+    )
+    unused_label_id = create_label(
+        user_token=token, project_id=project_id, name="B Label", color="#00FF00"
+    )
+    for start_offset, end_offset in [(0, 4), (5, 12), (0, 12)]:
+        create_category(
+            user_token=token,
+            project_id=project_id,
+            dataset_id=dataset_id,
+            label_id=label_id,
+            start_offset=start_offset,
+            end_offset=end_offset,
+        )
+
+    def get_statistics(**headers):
+        return test_client.get(
+            f"/project/{project_id}/statistics",
+            headers={"Authorization": f"Bearer {token}", **headers},
+        )
+
+    res = get_statistics()
+    assert res.status_code == 200
+    statistics = res.json()
+    assert statistics["spans"] == 3
+    assert statistics["datasets"] == 2
+    assert statistics["annotated_datasets"] == 1
+    assert statistics["unannotated_datasets"] == 1
+    assert [(s["label_id"], s["spans"]) for s in statistics["labels"]] == [
+        (label_id, 3),
+        (unused_label_id, 0),
+    ]
+    assert [(s["dataset_id"], s["spans"]) for s in statistics["datasets_spans"]] == [
+        (dataset_id, 3),
+        (empty_dataset_id, 0),
+    ]
+    assert statistics["span_lengths"] == {
+        "min": 4,
+        "max": 12,
+        "mean": 23 / 3,
+        "median": 7,
+        "p90": 12,
+        "p99": 12,
+        "histogram": {"4": 2, "8": 1},
+    }
+    etag = res.headers["ETag"]
+    assert get_statistics(**{"If-None-Match": etag}).status_code == 304
+
+    create_category(
+        user_token=token,
+        project_id=project_id,
+        dataset_id=empty_dataset_id,
+        label_id=unused_label_id,
+        start_offset=0,
+        end_offset=7,
+    )
+    res = get_statistics(**{"If-None-Match": etag})
+    assert res.status_code == 200
+    assert res.json()["spans"] == 4
+    assert res.json()["annotated_datasets"] == 2
+
+
+async def test_get_project_agreement(
+    test_client: TestClient,
+    db: asyncpg.Connection,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+    create_label: Callable[..., str],
+    create_category: Callable[..., str],
+):
+    user_id, token = create_user(username="my_user")
+    other_user_id, other_token = create_user(username="other_user")
+    project_id = create_project(
+        user_token=token,
+        title="Test Project",
+        description="Test Description",
+        members=[other_user_id],
+    )
+    dataset_id = create_dataset(
+        user_token=token, project_id=project_id, file=("a.txt", b"Test content here")
+    )
+    label_id = create_label(
+        user_token=token, project_id=project_id, name="A Label", color="#FF0000"
+    )
+    for user_token, spans in [(token, [(0, 4), (5, 12)]), (other_token, [(0, 4)])]:
+        for start_offset, end_offset in spans:
+            create_category(
+                user_token=user_token,
+                project_id=project_id,
+                dataset_id=dataset_id,
+                label_id=label_id,
+                start_offset=start_offset,
+                end_offset=end_offset,
+            )
+
+    authors = await db.fetch("SELECT created_by FROM categories")
+    assert {str(r["created_by"]) for r in authors} == {user_id, other_user_id}
+
+    res = test_client.get(
+        f"/project/{project_id}/agreement",
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert res.status_code == 200
+    agreement = res.json()
+    assert sorted(agreement["annotators"]) == sorted([user_id, other_user_id])
+    # One shared span out of three
+    assert agreement["scores"]["span_f1"] == pytest.approx(2 / 3)
+    # Tokens: Test, content, here
+    assert agreement["scores"]["cohen_kappa"] == pytest.approx(0.4)
+    assert agreement["labels"][0]["label_id"] == label_id
+    assert agreement["datasets"][0]["dataset_id"] == dataset_id
+    assert agreement["datasets"][0]["scores"] == agreement["scores"]
+
+    res = test_client.get(
+        f"/project/{project_id}/agreement",
+        params={"annotators": [user_id]},
+        headers={"Authorization": f"Bearer {token}"},
+    )
+    assert res.json()["scores"]["span_f1"] is None
+
+    res = test_client.get(
+        f"/project/{project_id}/agreement",
+        headers={"Authorization": f"Bearer {other_token}"},
+    )
+    assert res.status_code == 403
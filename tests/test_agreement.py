@@ -0,0 +1,117 @@
+import itertools
+import random
+import re
+
+import numpy as np
+
+from heron.agreement import AgreementStats, token_labels
+
+
+def _cohen(first: list[int], second: list[int]) -> float:
+    n = len(first)
+    observed = sum(a == b for a, b in zip(first, second)) / n
+    categories = set(first) | set(second)
+    expected = sum((first.count(c) / n) * (second.count(c) / n) for c in categories)
+    return (observed - expected) / (1 - expected)
+
+
+def _fleiss(ratings: list[list[int]]) -> float:
+    # ratings[annotator][item]
+    m, n = len(ratings), len(ratings[0])
+    categories = {c for r in ratings for c in r}
+    observed = 0.0
+    totals = dict.fromkeys(categories, 0)
+    for item in range(n):
+        counts = [sum(r[item] == c for r in ratings) for c in categories]
+        observed += (sum(c * c for c in counts) - m) / (m * (m - 1))
+        for c in categories:
+            totals[c] += sum(r[item] == c for r in ratings)
+    observed /= n
+    expected = sum((t / (n * m)) ** 2 for t in totals.values())
+    return (observed - expected) / (1 - expected)
+
+
+def test_token_labels():
+    token_starts = np.array([0, 5, 10, 15, 20])
+    # Sorted by start, the first span contains the second
+    starts = np.array([0, 4, 19])
+    ends = np.array([14, 7, 21])
+    labels = np.array([1, 2, 3])
+    assert token_labels(token_starts, starts, ends, labels).tolist() == [
+        1,
+        1,
+        1,
+        0,
+        3,
+    ]
+
+
+def test_agreement_stats():
+    rng = random.Random(0)
+    text = " ".join(f"w{i}" for i in range(200))
+    token_spans = [m.span() for m in re.finditer(r"\w+", text)]
+    annotators = ["a", "b", "c"]
+
+    # Each annotator labels single tokens, mostly the same ones
+    reference = {i: rng.randrange(1, 3) for i in rng.sample(range(200), 60)}
+    spans: list[tuple[int, int, int, int]] = []
+    tokens = []
+    for author in range(3):
+        labelled = dict(reference)
+        for i in rng.sample(range(200), 15):
+            labelled[i] = rng.randrange(0, 3)
+        row = [labelled.get(i, 0) for i in range(200)]
+        tokens.append(row)
+        for i, label in labelled.items():
+            if label:
+                spans.append((author, *token_spans[i], label))
+
+    authors, starts, ends, labels = (np.array(c) for c in zip(*spans))
+    order = np.lexsort((starts, authors))
+    stats = AgreementStats(2)
+    stats.add_dataset(
+        text, annotators, authors[order], starts[order], ends[order], labels[order]
+    )
+    scores = stats.scores()
+
+    expected_cohen = np.mean(
+        [_cohen(tokens[a], tokens[b]) for a, b in itertools.combinations(range(3), 2)]
+    )
+    assert np.isclose(scores.cohen_kappa, expected_cohen)
+    assert np.isclose(scores.fleiss_kappa, _fleiss(tokens))
+
+    sets = [{s[1:] for s in spans if s[0] == a} for a in range(3)]
+    f1_terms = [
+        (2 * len(sets[a] & sets[b]), len(sets[a]) + len(sets[b]))
+        for a, b in itertools.combinations(range(3), 2)
+    ]
+    expected_f1 = sum(t[0] for t in f1_terms) / sum(t[1] for t in f1_terms)
+    assert np.isclose(scores.span_f1, expected_f1)
+
+    binary = [[int(t == 1) for t in row] for row in tokens]
+    label_scores = stats.scores(1)
+    assert np.isclose(label_scores.fleiss_kappa, _fleiss(binary))
+    assert np.isclose(
+        label_scores.cohen_kappa,
+        np.mean(
+            [
+                _cohen(binary[a], binary[b])
+                for a, b in itertools.combinations(range(3), 2)
+            ]
+        ),
+    )
+
+    # Merging keeps the same scores
+    merged = AgreementStats(2)
+    merged.merge(stats)
+    assert merged.scores() == scores
+
+
+def test_agreement_stats_single_annotator():
+    stats = AgreementStats(1)
+    empty = np.array([], dtype=np.int64)
+    stats.add_dataset("some text", ["a"], empty, empty, empty, empty)
+    scores = stats.scores()
+    assert scores.span_f1 is None
+    assert scores.cohen_kappa is None
+    assert scores.fleiss_kappa is None
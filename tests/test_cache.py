@@ -0,0 +1,45 @@
+from heron.cache import VersionedLRUCache
+
+
+def test_versioned_lru_cache():
+    cache: VersionedLRUCache[str, int] = VersionedLRUCache(max_entries=2)
+    cache.put("a", 1, 10)
+    cache.put("b", 1, 20)
+    assert cache.get("a", 1) == 10
+    # Stale versions are dropped
+    assert cache.get("b", 2) is None
+    assert cache.get("b", 1) is None
+
+    cache.put("b", 2, 21)
+    cache.get("a", 1)
+    cache.put("c", 1, 30)
+    # b was the least recently used
+    assert cache.get("b", 2) is None
+    assert cache.get("a", 1) == 10
+    assert cache.get("c", 1) == 30
+    assert len(cache) == 2
+
+
+def test_versioned_lru_cache_max_size():
+    cache: VersionedLRUCache[str, bytes] = VersionedLRUCache(
+        max_entries=10, max_size=10, sizeof=len
+    )
+    cache.put("a", 1, b"aaaa")
+    cache.put("b", 1, b"bbbb")
+    # Too large to ever fit
+    cache.put("c", 1, b"c" * 11)
+    assert cache.get("c", 1) is None
+    assert cache.size == 8
+
+    cache.get("a", 1)
+    cache.put("d", 1, b"dddd")
+    # b was the least recently used
+    assert cache.get("b", 1) is None
+    assert cache.get("a", 1) == b"aaaa"
+    assert cache.size == 8
+
+    # Replacing and dropping stale entries frees their room
+    cache.put("a", 2, b"a")
+    assert cache.size == 5
+    assert cache.get("d", 2) is None
+    assert cache.size == 1
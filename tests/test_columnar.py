@@ -0,0 +1,48 @@
+import uuid
+
+from heron.columnar import decode_categories, encode_categories
+from heron.db.category import Category
+
+
+def _categories(count: int, labels: int) -> list[Category]:
+    project_id, dataset_id = uuid.uuid4(), uuid.uuid4()
+    label_ids = [uuid.uuid4() for _ in range(labels)]
+    authors = [uuid.uuid4(), None]
+    return [
+        Category(
+            id=uuid.uuid4(),
+            label_id=label_ids[i % labels],
+            project_id=project_id,
+            dataset_id=dataset_id,
+            start_offset=10 * i,
+            end_offset=10 * i + 5 + i % 7,
+            created_by=authors[i % 2],
+            # Past what 32 bits hold
+            seq=2**32 + i,
+        )
+        for i in range(count)
+    ]
+
+
+def test_round_trip():
+    categories = _categories(100, 3)
+    data = encode_categories(
+        categories[0].project_id, categories[0].dataset_id, categories
+    )
+    decoded = decode_categories(data)
+    assert decoded == categories
+    assert [c.seq for c in decoded] == [2**32 + i for i in range(100)]
+
+
+def test_empty():
+    project_id, dataset_id = uuid.uuid4(), uuid.uuid4()
+    assert decode_categories(encode_categories(project_id, dataset_id, [])) == []
+
+
+def test_smaller_than_json():
+    categories = _categories(10000, 20)
+    data = encode_categories(
+        categories[0].project_id, categories[0].dataset_id, categories
+    )
+    json_size = sum(len(c.model_dump_json()) + 1 for c in categories)
+    assert json_size / len(data) > 5
@@ -0,0 +1,90 @@
+import asyncio
+import uuid
+
+import asyncpg
+import pytest_asyncio
+
+from heron.db import create_connection_pool
+from heron.events import (
+    MAX_CATEGORY_EVENTS,
+    EventBroker,
+    publish_category_events,
+    publish_label_events,
+)
+
+
+@pytest_asyncio.fixture
+async def pool():
+    pool = await create_connection_pool()
+    yield pool
+    await pool.close()
+
+
+async def _get(subscription) -> dict | None:
+    return await asyncio.wait_for(subscription.get(), 5)
+
+
+async def test_category_events(pool: asyncpg.Pool):
+    broker = EventBroker(pool)
+    project_id, dataset_id = uuid.uuid4(), uuid.uuid4()
+    subscription = await broker.subscribe(project_id, dataset_id)
+    other = await broker.subscribe(project_id, uuid.uuid4())
+
+    events = [
+        {"type": "category", "op": "create", "seq": i, "category": {"id": uuid.uuid4()}}
+        for i in range(MAX_CATEGORY_EVENTS + 1)
+    ]
+    async with pool.acquire() as conn:
+        # More events than fit in a single notification
+        await publish_category_events(conn, dataset_id, events[:MAX_CATEGORY_EVENTS])
+        await publish_category_events(conn, dataset_id, events)
+
+    for i in range(MAX_CATEGORY_EVENTS):
+        event = await _get(subscription)
+        assert event is not None
+        assert event["seq"] == i
+    assert await _get(subscription) == {
+        "type": "category",
+        "op": "sync",
+        "seq": MAX_CATEGORY_EVENTS,
+    }
+    assert other._queue.empty()
+    await broker.close()
+
+
+async def test_label_events(pool: asyncpg.Pool):
+    broker = EventBroker(pool)
+    project_id = uuid.uuid4()
+    first = await broker.subscribe(project_id, uuid.uuid4())
+    second = await broker.subscribe(project_id, uuid.uuid4())
+    other = await broker.subscribe(uuid.uuid4(), uuid.uuid4())
+
+    async with pool.acquire() as conn:
+        await publish_label_events(conn, project_id, [{"type": "label"}])
+
+    assert await _get(first) == {"type": "label"}
+    assert await _get(second) == {"type": "label"}
+    assert other._queue.empty()
+    await broker.close()
+
+
+async def test_slow_subscriber_evicted(pool: asyncpg.Pool):
+    broker = EventBroker(pool, queue_size=2)
+    project_id, dataset_id = uuid.uuid4(), uuid.uuid4()
+    slow = await broker.subscribe(project_id, dataset_id)
+
+    events = [{"type": "category", "seq": i} for i in range(3)]
+    async with pool.acquire() as conn:
+        await publish_category_events(conn, dataset_id, events)
+
+    assert await _get(slow) is None
+
+    # Evicted subscribers don't get anything else
+    async with pool.acquire() as conn:
+        await publish_category_events(conn, dataset_id, events[:1])
+    fresh = await broker.subscribe(project_id, dataset_id)
+    async with pool.acquire() as conn:
+        await publish_category_events(conn, dataset_id, events[:1])
+    assert await _get(fresh) == events[0]
+    assert slow._queue.empty()
+    await broker.close()
@@ -0,0 +1,52 @@
+import json
+import uuid
+
+from heron.db.dataset import AnnotatedDataset
+from heron.export import to_conll, to_jsonl, to_spacy
+
+
+def _dataset(text: str, spans: list[tuple[int, int, str]]) -> AnnotatedDataset:
+    return AnnotatedDataset(
+        id=uuid.uuid4(), filename="test.txt", text=text, spans=spans
+    )
+
+
+def test_to_jsonl():
+    dataset = _dataset("Jane Doe lives in Paris", [(0, 8, "PER"), (18, 23, "LOC")])
+    record = json.loads(to_jsonl(dataset))
+    assert record["text"] == dataset.text
+    assert record["spans"] == [
+        {"start": 0, "end": 8, "label": "PER"},
+        {"start": 18, "end": 23, "label": "LOC"},
+    ]
+
+
+def test_to_spacy():
+    dataset = _dataset("Jane Doe", [(0, 8, "PER"), (0, 4, "NAME")])
+    record = json.loads(to_spacy(dataset))
+    assert record["text"] == "Jane Doe"
+    assert len(record["spans"]["sc"]) == 2
+    assert record["user_data"]["id"] == str(dataset.id)
+
+
+def test_to_conll():
+    dataset = _dataset(
+        "Jane Doe lives in Paris.\nShe likes it.",
+        [(0, 8, "PER"), (5, 14, "HIDDEN"), (18, 23, "LOC"), (25, 28, "PER")],
+    )
+    lines = to_conll(dataset).splitlines()
+    assert lines[0] == f"-DOCSTART-\tO\t{dataset.id}"
+    assert lines[2:] == [
+        "Jane\tB-PER",
+        "Doe\tI-PER",
+        "lives\tB-HIDDEN",
+        "in\tO",
+        "Paris\tB-LOC",
+        ".\tO",
+        "",
+        "She\tB-PER",
+        "likes\tO",
+        "it\tO",
+        ".\tO",
+        "",
+    ]
@@ -0,0 +1,80 @@
+import itertools
+import random
+import uuid
+
+import pytest
+
+from heron import overlap
+from heron.db.category import Category
+from heron.overlap import SpanIndex, find_overlaps, violates
+
+
+def _category(start_offset: int, end_offset: int) -> Category:
+    return Category(
+        id=uuid.uuid4(),
+        label_id=uuid.uuid4(),
+        project_id=uuid.uuid4(),
+        dataset_id=uuid.uuid4(),
+        start_offset=start_offset,
+        end_offset=end_offset,
+    )
+
+
+def _overlap(first: Category, second: Category) -> bool:
+    return (
+        first.start_offset < second.end_offset
+        and second.start_offset < first.end_offset
+    )
+
+
+def test_find_overlaps():
+    rng = random.Random(0)
+    categories = []
+    for _ in range(300):
+        start = rng.randrange(1000)
+        categories.append(_category(start, start + rng.randrange(1, 50)))
+    categories.sort(key=lambda c: (c.start_offset, c.id))
+
+    expected = {
+        frozenset((a.id, b.id))
+        for a, b in itertools.combinations(categories, 2)
+        if _overlap(a, b)
+    }
+    pairs = list(find_overlaps(categories))
+    assert len(pairs) == len(expected)
+    assert {frozenset((a.id, b.id)) for a, b in pairs} == expected
+    assert all(a.start_offset <= b.start_offset for a, b in pairs)
+
+
+def test_find_overlaps_touching():
+    categories = [_category(0, 5), _category(5, 10)]
+    assert list(find_overlaps(categories)) == []
+
+
+def test_span_index(monkeypatch: pytest.MonkeyPatch):
+    # Small buckets so they get split
+    monkeypatch.setattr(overlap, "_BUCKET_SIZE", 8)
+    rng = random.Random(1)
+    categories = []
+    for _ in range(200):
+        start = rng.randrange(500)
+        categories.append(_category(start, start + rng.randrange(1, 80)))
+    index = SpanIndex(categories[:50])
+    for category in categories[50:]:
+        index.add(category)
+
+    for _ in range(100):
+        start = rng.randrange(500)
+        probe = _category(start, start + rng.randrange(1, 30))
+        expected = {c.id for c in categories if _overlap(c, probe)}
+        found = index.overlapping(probe.start_offset, probe.end_offset)
+        assert {c.id for c in found} == expected
+        assert found == sorted(found, key=lambda c: (c.start_offset, c.id))
+
+
+def test_violates():
+    label_id, other_label_id = uuid.uuid4(), uuid.uuid4()
+    assert not violates("allow", label_id, label_id)
+    assert violates("forbid_same_label", label_id, label_id)
+    assert not violates("forbid_same_label", label_id, other_label_id)
+    assert violates("forbid_any", label_id, other_label_id)
@@ -0,0 +1,56 @@
+from pathlib import Path
+
+import pytest
+
+from heron import storage
+from heron.storage import FilesystemStorage
+
+TEXT = "Zürich → Köln, 東京 and 🦩 birds"
+
+
+@pytest.fixture
+def filesystem_storage(tmp_path: Path) -> FilesystemStorage:
+    return FilesystemStorage(tmp_path)
+
+
+async def test_write_and_read(filesystem_storage: FilesystemStorage):
+    assert await filesystem_storage.write("abcdef", TEXT) is None
+    path = filesystem_storage.path("abcdef")
+    assert path == filesystem_storage.root / "ab" / "cd" / "abcdef"
+    assert path.read_bytes() == TEXT.encode("utf-8")
+    assert await filesystem_storage.read("abcdef", None) == TEXT
+
+
+@pytest.mark.parametrize(
+    "start,end",
+    [(0, 0), (0, 6), (2, 9), (15, 17), (24, len(TEXT)), (3, None), (5, 1000)],
+)
+async def test_read_range(
+    filesystem_storage: FilesystemStorage, start: int, end: int | None
+):
+    await filesystem_storage.write("abcdef", TEXT)
+    assert await filesystem_storage.read_range("abcdef", None, start, end) == (
+        TEXT[start:end]
+    )
+
+
+async def test_read_range_across_chunks(
+    filesystem_storage: FilesystemStorage, monkeypatch: pytest.MonkeyPatch
+):
+    monkeypatch.setattr(storage, "_SCAN_CHUNK_SIZE", 7)
+    text = TEXT * 5
+    await filesystem_storage.write("abcdef", text)
+    for start in range(0, len(text), 3):
+        assert await filesystem_storage.read_range(
+            "abcdef", None, start, start + 11
+        ) == (text[start : start + 11])
+
+
+async def test_read_range_empty(filesystem_storage: FilesystemStorage):
+    await filesystem_storage.write("abcdef", "")
+    assert await filesystem_storage.read_range("abcdef", None, 0, 10) == ""
+
+
+def test_storage_is_abstract():
+    with pytest.raises(TypeError):
+        storage.DatasetStorage()
@@ -0,0 +1,121 @@
+import uuid
+from collections.abc import Callable
+from typing import Tuple
+
+import asyncpg
+from starlette.testclient import TestClient
+
+from heron import tasks
+from heron.db import category as db_category
+from heron.db import create_connection_pool
+from heron.db import label as db_label
+from heron.db import operation as db_operation
+
+
+async def test_resumed_operation_runs_once(
+    test_client: TestClient,
+    db: asyncpg.Connection,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_label: Callable[..., str],
+):
+    user_id, token = create_user(username="my_user")
+    project_id = create_project(
+        user_token=token, title="My Project", description="My project description"
+    )
+    label_id = create_label(
+        user_token=token, project_id=project_id, name="Label", color="#ff0000"
+    )
+    operation_id = await tasks.start_operation(
+        db, uuid.UUID(project_id), tasks.DELETE_LABEL, uuid.UUID(label_id)
+    )
+
+    pool = await create_connection_pool()
+    try:
+        # Another worker is running the operation
+        async with pool.acquire() as worker:
+            assert await db_operation.try_lock(worker, operation_id)
+            await tasks.resume_operations(pool)
+            operation = await db_operation.get_by_id(db, operation_id)
+            assert operation is not None
+            assert operation.status == db_operation.PENDING
+            assert await db.fetchval(
+                "SELECT 1 FROM labels WHERE id = $1", uuid.UUID(label_id)
+            )
+            await db_operation.unlock(worker, operation_id)
+
+        await tasks.resume_operations(pool)
+        operation = await db_operation.get_by_id(db, operation_id)
+        assert operation is not None
+        assert operation.status == db_operation.DONE
+        assert not await db.fetchval(
+            "SELECT 1 FROM labels WHERE id = $1", uuid.UUID(label_id)
+        )
+
+        # Completed operations aren't run again
+        assert not await db_operation.claim(db, operation_id)
+    finally:
+        await pool.close()
+
+
+async def test_merge_fails_once_target_is_deleted(
+    test_client: TestClient,
+    db: asyncpg.Connection,
+    create_user: Callable[..., Tuple[str, str]],
+    create_project: Callable[..., str],
+    create_dataset: Callable[..., str],
+    create_label: Callable[..., str],
+    create_category: Callable[..., str],
+):
+    user_id, token = create_user(username="my_user")
+    project_id = create_project(
+        user_token=token, title="My Project", description="My project description"
+    )
+    dataset_id = create_dataset(
+        user_token=token, project_id=project_id, file=("hello.txt", b"Hello world")
+    )
+    source_id, target_id = (
+        create_label(user_token=token, project_id=project_id, name=name, color="#f00")
+        for name in ["Source", "Target"]
+    )
+    create_category(
+        user_token=token,
+        project_id=project_id,
+        dataset_id=dataset_id,
+        label_id=source_id,
+        start_offset=0,
+        end_offset=5,
+    )
+    # The sources were already hidden by an interrupted run
+    assert await db_label.hide(db, uuid.UUID(project_id), uuid.UUID(source_id))
+    assert await db_label.hide(db, uuid.UUID(project_id), uuid.UUID(target_id))
+    moved = await db_category.relabel_batch(
+        db,
+        uuid.UUID(project_id),
+        uuid.UUID(dataset_id),
+        [uuid.UUID(source_id)],
+        uuid.UUID(target_id),
+        tasks.MERGE_BATCH_SIZE,
+    )
+    assert moved is None
+    operation_id = await tasks.start_operation(
+        db,
+        uuid.UUID(project_id),
+        tasks.MERGE_LABELS,
+        uuid.UUID(target_id),
+        [uuid.UUID(source_id)],
+    )
+
+    pool = await create_connection_pool()
+    try:
+        await tasks.resume_operations(pool)
+    finally:
+        await pool.close()
+
+    operation = await db_operation.get_by_id(db, operation_id)
+    assert operation is not None
+    assert operation.status == db_operation.FAILED
+    source = await db_label.get_by_id(db, uuid.UUID(source_id))
+    assert source is not None
+    categories = await db.fetch("SELECT label_id FROM categories")
+    assert [str(c["label_id"]) for c in categories] == [source_id]